@@ -0,0 +1,179 @@
+import collections
+import itertools
+import unittest
+
+import numpy as np
+
+from exact_solver import is_covering_sequence
+from gain_table import MAX_GAIN
+from util import batch_new_friend_pair_counts
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class BatchGreedySwapper(object):
+    """
+    Runs trials of GreedySwapper on a batch of independent tables in lockstep, so that the
+    interpreter overhead of each step is shared by the whole batch.
+
+    The batch is held as a B x n array of seating arrangements and a B x n x n array of
+    friend pairs. At each step, the gain of every swap at every table is computed in a
+    single vectorized pass, and each table carries out one of its swaps generating the most
+    new friends, breaking ties as GreedySwapper does (see SwapGainTable): each trial draws
+    a random order of the swaps, taking the first swap in that order with gain MAX_GAIN if
+    there is one, and otherwise a swap with the largest gain uniformly at random. Tables
+    that finish (or give up) are retired, and their rows reused for the next trials until
+    every trial has been started.
+    """
+
+    def __init__(self, table_size, batch_size=DEFAULT_BATCH_SIZE, seed=None):
+        """
+        :param table_size: Number of people at the table.
+        :param batch_size: Number of tables advanced together.
+        :param seed: seed for the random tie-breaking.
+        """
+        self.n = table_size
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.num_total_friend_pairs = table_size * (table_size - 1) // 2
+        self.swaps = list(itertools.combinations(range(table_size), 2))
+        (self.first, self.second) = np.array(self.swaps).reshape(-1, 2).T
+        self.initial_seating_arrangement = np.arange(table_size)
+        self.initial_adjacency = np.zeros((table_size, table_size), dtype=np.uint8)
+        neighbours = np.roll(self.initial_seating_arrangement, -1)
+        self.initial_adjacency[self.initial_seating_arrangement, neighbours] = 1
+        self.initial_adjacency[neighbours, self.initial_seating_arrangement] = 1
+
+    def run(self, num_trials, max_swap_num=None, first_trial=0):
+        """ Runs trials, yielding each trial as it finishes.
+
+        :param num_trials: Number of trials to run.
+        :param max_swap_num: If specified, trials give up once they cannot make everyone
+        friends in at most this many swaps (see run_trial). It is read from self.max_swap_num at
+        every step, so that it can be lowered while the trials run.
+        :param first_trial: index of the first trial.
+        :return: generator of (trial index, swaps) for each trial, in the order in which
+        they finish, where swaps is None if the trial gave up.
+        """
+        self.max_swap_num = max_swap_num
+        num_tables = min(self.batch_size, num_trials)
+        next_trial = first_trial + num_tables
+        end_trial = first_trial + num_trials
+        seating = np.tile(self.initial_seating_arrangement, (num_tables, 1))
+        adjacency = np.tile(self.initial_adjacency, (num_tables, 1, 1))
+        num_friend_pairs = np.full(num_tables, self.n)
+        trials = np.arange(first_trial, next_trial)
+        # history[b, :lengths[b]] are the indices of the swaps carried out at table b.
+        history = np.zeros((num_tables, 4 * self.n), dtype=np.intp)
+        lengths = np.zeros(num_tables, dtype=np.intp)
+        # the random order of the swaps of each trial, as a priority for each swap.
+        priorities = self.rng.random((num_tables, len(self.swaps)))
+
+        while num_tables:
+            gains = batch_new_friend_pair_counts(
+                seating, adjacency, self.first, self.second
+            )
+            # random fractions pick uniformly among the swaps with the largest gain, except
+            # that the swaps with gain MAX_GAIN are taken in the order of the trial.
+            fractions = np.where(
+                gains == MAX_GAIN, priorities, self.rng.random(gains.shape)
+            )
+            k = np.argmax(gains + fractions, axis=1)
+            rows = np.arange(num_tables)
+            (i, j) = (self.first[k], self.second[k])
+            (seating[rows, i], seating[rows, j]) = (seating[rows, j], seating[rows, i])
+            for seat in (i, j):
+                for neighbour in ((seat - 1) % self.n, (seat + 1) % self.n):
+                    (p, q) = (seating[rows, seat], seating[rows, neighbour])
+                    adjacency[rows, p, q] = 1
+                    adjacency[rows, q, p] = 1
+            num_friend_pairs += gains[rows, k]
+            if lengths.max() == history.shape[1]:
+                history = np.concatenate([history, np.zeros_like(history)], axis=1)
+            history[rows, lengths] = k
+            lengths += 1
+
+            finished = num_friend_pairs == self.num_total_friend_pairs
+            retired = finished
+            if self.max_swap_num is not None:
+                # a swap makes at most 4 new friend pairs.
+                min_remaining_swaps = -(
+                    -(self.num_total_friend_pairs - num_friend_pairs) // 4
+                )
+                retired = retired | (lengths + min_remaining_swaps > self.max_swap_num)
+            retired = np.flatnonzero(retired)
+            if len(retired) == 0:
+                continue
+            for b in retired.tolist():
+                if finished[b]:
+                    swaps = [self.swaps[k] for k in history[b, : lengths[b]].tolist()]
+                    yield (int(trials[b]), swaps)
+                else:
+                    yield (int(trials[b]), None)
+
+            # reuse the rows of retired tables for new trials, while there are any.
+            num_new = min(len(retired), end_trial - next_trial)
+            reused = retired[:num_new]
+            seating[reused] = self.initial_seating_arrangement
+            adjacency[reused] = self.initial_adjacency
+            num_friend_pairs[reused] = self.n
+            trials[reused] = np.arange(next_trial, next_trial + num_new)
+            lengths[reused] = 0
+            priorities[reused] = self.rng.random((num_new, len(self.swaps)))
+            next_trial += num_new
+
+            kept = np.ones(num_tables, dtype=bool)
+            kept[retired[num_new:]] = False
+            if not kept.all():
+                (
+                    seating,
+                    adjacency,
+                    num_friend_pairs,
+                    trials,
+                    history,
+                    lengths,
+                    priorities,
+                ) = (
+                    seating[kept],
+                    adjacency[kept],
+                    num_friend_pairs[kept],
+                    trials[kept],
+                    history[kept],
+                    lengths[kept],
+                    priorities[kept],
+                )
+                num_tables = len(trials)
+
+
+def profile_batch_greedy_swapper(
+    num_trials, table_size, batch_size=DEFAULT_BATCH_SIZE, seed=None
+):
+
+    """ Version of profile_swapper for GreedySwapper, running the trials in batches.
+
+    :param num_trials:
+    :param table_size:
+    :param batch_size: Number of tables advanced together.
+    :param seed: seed for the random tie-breaking.
+    :return: Counter of number of swops required for each trial.
+    """
+
+    c = collections.Counter()
+    for (_, swaps) in BatchGreedySwapper(table_size, batch_size, seed).run(num_trials):
+        c[len(swaps)] += 1
+    return c
+
+
+class TestBatchGreedySwapper(unittest.TestCase):
+    def test_covering_sequences(self):
+        results = list(BatchGreedySwapper(8, batch_size=7, seed=0).run(20))
+        self.assertEqual(sorted(i for (i, _) in results), list(range(20)))
+        for (_, swaps) in results:
+            self.assertTrue(is_covering_sequence(8, swaps))
+
+    def test_max_swap_num(self):
+        results = list(BatchGreedySwapper(10, batch_size=8, seed=0).run(50, 11))
+        self.assertEqual(len(results), 50)
+        completed = [swaps for (_, swaps) in results if swaps is not None]
+        self.assertTrue(0 < len(completed) < 50)
+        self.assertTrue(all(len(swaps) <= 11 for swaps in completed))
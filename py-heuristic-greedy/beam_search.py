@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import itertools
+import time
+import unittest
+
+import numpy as np
+import tqdm
+
+from checkpoint import Checkpoint
+from exact_solver import is_covering_sequence
+from results_index import ResultsIndex
+from swapper_util import get_checkpoint_file, get_swapper_name
+from util import batch_new_friend_pair_counts
+
+
+class BeamSearch(object):
+    """
+    Searches for a short sequence of swaps making everyone friends by keeping the
+    beam_width most promising tables at each step, rather than following a single
+    trajectory as the swappers do.
+
+    At each step, every swap at every table in the beam is scored (in a single vectorized
+    pass) by the number of friend pairs the table would have after it. The
+    expansion_factor * beam_width best candidates are carried out, identical tables are
+    merged, and the beam_width best of the rest are kept, breaking ties by the largest
+    gain available at the next step (a one-step lookahead), and then at random.
+    """
+
+    def __init__(self, table_size, beam_width=100, expansion_factor=4, seed=None):
+        """
+        :param table_size: Number of people at the table.
+        :param beam_width: Number of tables kept at each step.
+        :param expansion_factor: Number of candidates (per table kept) that are carried
+        out and scored with the lookahead at each step.
+        :param seed: seed for the random tie-breaking.
+        """
+        self.n = table_size
+        self.beam_width = beam_width
+        self.expansion_factor = expansion_factor
+        self.rng = np.random.default_rng(seed)
+        self.num_total_friend_pairs = table_size * (table_size - 1) // 2
+        self.swaps = list(itertools.combinations(range(table_size), 2))
+        (self.first, self.second) = np.array(self.swaps).T
+        # smallest dtype holding every seat label, for the keys merging identical tables.
+        self.seat_dtype = np.min_scalar_type(table_size - 1)
+        # number of tables expanded over the course of the search.
+        self.nodes = 0
+
+    def _carry_out(self, seating_arrangements, adjacencies, parents, swap_ids):
+        # returns copies of the tables at the indices in parents, with the corresponding
+        # swap carried out and the new neighbours marked as friends.
+        seating = seating_arrangements[parents]
+        rows = np.arange(len(parents))
+        first = self.first[swap_ids]
+        second = self.second[swap_ids]
+        (seating[rows, first], seating[rows, second]) = (
+            seating[rows, second],
+            seating[rows, first],
+        )
+        adjacency = adjacencies[parents]
+        neighbours = np.roll(seating, -1, axis=1)
+        adjacency[rows[:, np.newaxis], seating, neighbours] = 1
+        adjacency[rows[:, np.newaxis], neighbours, seating] = 1
+        return (seating, adjacency)
+
+    def search(self):
+        """
+        :return: list of swaps making everyone friends.
+        """
+        seating_arrangements = np.arange(self.n)[np.newaxis, :]
+        adjacencies = np.zeros((1, self.n, self.n), dtype=np.uint8)
+        neighbours = np.roll(seating_arrangements[0], -1)
+        adjacencies[0, seating_arrangements[0], neighbours] = 1
+        adjacencies[0, neighbours, seating_arrangements[0]] = 1
+        num_friend_pairs = np.array([self.n])
+        # for each step, the index of the parent (in the previous beam) and the swap
+        # carried out for each table in the beam, to recover the sequences at the end.
+        history = []
+
+        while True:
+            self.nodes += len(seating_arrangements)
+            gains = batch_new_friend_pair_counts(
+                seating_arrangements, adjacencies, self.first, self.second
+            )
+            scores = num_friend_pairs[:, np.newaxis] + gains
+            # random fractions break ties between candidates with equal scores.
+            noisy_scores = (scores + self.rng.random(scores.shape)).ravel()
+            num_candidates = min(
+                len(noisy_scores), self.expansion_factor * self.beam_width
+            )
+            candidates = np.argpartition(-noisy_scores, num_candidates - 1)[
+                :num_candidates
+            ]
+            (parents, swap_ids) = np.unravel_index(candidates, scores.shape)
+            (seating, adjacency) = self._carry_out(
+                seating_arrangements, adjacencies, parents, swap_ids
+            )
+
+            # merge identical tables.
+            keys = np.concatenate(
+                [
+                    seating.astype(self.seat_dtype),
+                    np.packbits(adjacency.reshape(len(parents), -1), axis=1),
+                ],
+                axis=1,
+            )
+            (_, unique) = np.unique(keys, axis=0, return_index=True)
+            (parents, swap_ids, seating, adjacency) = (
+                parents[unique],
+                swap_ids[unique],
+                seating[unique],
+                adjacency[unique],
+            )
+            num_friend_pairs = scores[parents, swap_ids]
+
+            if num_friend_pairs.max() == self.num_total_friend_pairs:
+                k = np.argmax(num_friend_pairs)
+                history.append((parents, swap_ids))
+                break
+
+            lookahead = batch_new_friend_pair_counts(
+                seating, adjacency, self.first, self.second
+            ).max(axis=1)
+            # lookahead is at most 4, so never outweighs a friend pair.
+            noisy_scores = (
+                num_friend_pairs * 8 + lookahead + self.rng.random(len(parents))
+            )
+            kept = np.argsort(-noisy_scores)[: self.beam_width]
+            history.append((parents[kept], swap_ids[kept]))
+            (seating_arrangements, adjacencies, num_friend_pairs) = (
+                seating[kept],
+                adjacency[kept],
+                num_friend_pairs[kept],
+            )
+
+        swaps = []
+        for (parents, swap_ids) in reversed(history):
+            swaps.append(self.swaps[swap_ids[k]])
+            k = parents[k]
+        return swaps[::-1]
+
+
+class TestBeamSearch(unittest.TestCase):
+    def test_covering_sequence(self):
+        for n in range(5, 12):
+            swaps = BeamSearch(n, beam_width=20, seed=0).search()
+            self.assertTrue(is_covering_sequence(n, swaps))
+
+    def test_wider_beam_is_no_worse_on_average(self):
+        narrow = [len(BeamSearch(12, beam_width=1, seed=s).search()) for s in range(5)]
+        wide = [len(BeamSearch(12, beam_width=50, seed=s).search()) for s in range(5)]
+        self.assertLessEqual(sum(wide), sum(narrow))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""
+        Conduct a beam search for the minimum number of swaps required for a table of
+        the specified size, keeping the most promising tables at each step rather than
+        following a single trajectory. Results are recorded in a checkpoint, as for
+        heuristic_search.py.
+        """,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("table_size", type=int, help="Number of people at the table.")
+    parser.add_argument(
+        "--beam-width", type=int, help="Number of tables kept at each step.", default=100
+    )
+    parser.add_argument(
+        "--expansion-factor",
+        type=int,
+        help="""Number of candidate swaps (per table kept) scored with a one-step
+        lookahead at each step.
+        """,
+        default=4,
+    )
+    parser.add_argument(
+        "--num-runs",
+        type=int,
+        help="Number of searches to run, each with different random tie-breaking.",
+        default=1,
+    )
+    args = parser.parse_args()
+
+    # checkpoints for each beam width and expansion factor are kept separately.
+    searcher = functools.partial(
+        BeamSearch, beam_width=args.beam_width, expansion_factor=args.expansion_factor
+    )
+    checkpoint = Checkpoint(get_checkpoint_file(searcher, args.table_size))
+    i = checkpoint.trials
+    run_start_time = time.time()
+    for _ in tqdm.trange(args.num_runs):
+        i += 1
+        start_time = time.time()
+        beam_search = searcher(args.table_size, seed=i)
+        swaps = beam_search.search()
+        tqdm.tqdm.write(
+            "Run #{}: {} swaps, {} tables expanded in {:.2f} seconds.".format(
+                i, len(swaps), beam_search.nodes, time.time() - start_time
+            )
+        )
+        if checkpoint.min_swap_num is None or len(swaps) < checkpoint.min_swap_num:
+            checkpoint.new_high_score(i, i, swaps)
+        elif len(swaps) == checkpoint.min_swap_num:
+            checkpoint.add_tie(i, swaps)
+    checkpoint.write(i)
+    ResultsIndex().record_checkpoint(
+        checkpoint, args.num_runs / (time.time() - run_start_time)
+    )
+
+    print(
+        "{} on a table of size {}: best {}, seen in {}/{} runs.".format(
+            get_swapper_name(searcher),
+            args.table_size,
+            checkpoint.min_swap_num,
+            checkpoint.num_ties,
+            checkpoint.trials,
+        )
+    )
+    print("Sample swap sequence: {}".format(next(checkpoint.swap_sequences())[1]))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from constants import BENCHMARK_DIR
+from swapper import nameToSwapper
+
+DEFAULT_TABLE_SIZES = [10, 15, 20, 25, 30, 40]
+SWAP_METHODS = ["do_swap", "do_swap_v1"]
+
+
+def run_benchmark_trial(swapper, table_size, swap_method, rng):
+
+    """ Runs a single trial to completion, using the specified method to carry out swaps.
+
+    :param swapper: Class that is used to select the next swap to be executed.
+    :param table_size:
+    :param swap_method: name of the method of the swapper used to carry out swaps.
+    :param rng: random.Random the swapper draws from.
+    :return: number of swaps required to make everyone friends.
+    """
+
+    s = swapper(list(range(table_size)), rng=rng)
+    do_swap = getattr(s, swap_method)
+    while not s.is_everyone_friends():
+        do_swap(s.generate_swap())
+    return len(s.swaps)
+
+
+def benchmark_swapper(swapper, table_size, swap_method, num_trials, seed):
+
+    """ Measures the speed, peak memory usage and results of a swapper.
+
+    Timing and memory are measured in separate passes, as tracing memory allocations
+    slows down the trials considerably; peak memory is that of a single trial.
+
+    :param swapper: Class that is used to select the next swap to be executed.
+    :param table_size:
+    :param swap_method: name of the method of the swapper used to carry out swaps.
+    :param num_trials:
+    :param seed: seed of the generator the swapper draws from, so that results are
+    reproducible.
+    :return: dict of results.
+    """
+
+    # warm up caches (and numpy's lazily initialised machinery) before timing.
+    run_benchmark_trial(swapper, table_size, swap_method, random.Random(seed))
+    rng = random.Random(seed)
+    counts = collections.Counter()
+    start_time = time.perf_counter()
+    for _ in range(num_trials):
+        counts[run_benchmark_trial(swapper, table_size, swap_method, rng)] += 1
+    seconds = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    run_benchmark_trial(swapper, table_size, swap_method, random.Random(seed))
+    (_, peak_memory_bytes) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_swaps = sum(k * v for (k, v) in counts.items())
+    return {
+        "swapper": swapper.__name__,
+        "swap_method": swap_method,
+        "table_size": table_size,
+        "num_trials": num_trials,
+        "seed": seed,
+        "seconds": seconds,
+        "trials_per_second": num_trials / seconds,
+        "swaps_per_second": num_swaps / seconds,
+        "peak_memory_bytes": peak_memory_bytes,
+        "best_swaps": min(counts),
+        "mean_swaps": num_swaps / num_trials,
+        "swap_count_distribution": {str(k): counts[k] for k in sorted(counts)},
+    }
+
+
+def benchmark_cpp_binary(cpp_binary, table_size, num_trials):
+
+    """ Measures the speed of the C++ heuristic search, for comparison.
+
+    :param cpp_binary: path of the heuristic_search binary in cpp-heuristic-greedy.
+    :param table_size:
+    :param num_trials:
+    :return: dict of results.
+    """
+
+    start_time = time.perf_counter()
+    output = subprocess.run(
+        [cpp_binary, str(table_size), "--num-trials", str(num_trials)],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    seconds = time.perf_counter() - start_time
+    best_swaps = re.search(r"Best number of swaps: (\d+)", output)
+    return {
+        "table_size": table_size,
+        "num_trials": num_trials,
+        "seconds": seconds,
+        "trials_per_second": num_trials / seconds,
+        "best_swaps": int(best_swaps.group(1)) if best_swaps else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""
+        Benchmark the swappers on tables of various sizes, with fixed seeds so that
+        runs are reproducible, and write the results to a JSON file so that changes to
+        the Python engine can be tracked and compared against the C++ implementation.
+        """,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--table-sizes",
+        type=int,
+        nargs="+",
+        help="Sizes of table to benchmark.",
+        default=DEFAULT_TABLE_SIZES,
+    )
+    parser.add_argument(
+        "--swappers",
+        nargs="+",
+        choices=list(nameToSwapper.keys()),
+        help="Swappers to benchmark.",
+        default=list(nameToSwapper.keys()),
+    )
+    parser.add_argument(
+        "--swap-methods",
+        nargs="+",
+        choices=SWAP_METHODS,
+        help="Methods used to carry out swaps (and update existing friend pairs).",
+        default=SWAP_METHODS,
+    )
+    parser.add_argument(
+        "--num-trials",
+        type=int,
+        help="Number of trials to run for each benchmark.",
+        default=20,
+    )
+    parser.add_argument("--seed", type=int, help="Random seed.", default=0)
+    parser.add_argument(
+        "--cpp-binary",
+        help="""Path of the C++ heuristic_search binary; if specified, it is
+        benchmarked on the same table sizes for comparison.
+        """,
+    )
+    parser.add_argument(
+        "--output",
+        help="""Path of the JSON file to write; defaults to a timestamped file in
+        the benchmarks directory.
+        """,
+    )
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python_version": platform.python_version(),
+        "numpy_version": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "benchmarks": [],
+    }
+    for table_size in args.table_sizes:
+        for swapper_name in args.swappers:
+            for swap_method in args.swap_methods:
+                result = benchmark_swapper(
+                    nameToSwapper[swapper_name],
+                    table_size,
+                    swap_method,
+                    args.num_trials,
+                    args.seed,
+                )
+                results["benchmarks"].append(result)
+                print(
+                    "{swapper:>22} {swap_method:>10} n={table_size:<3} {trials_per_second:>9.2f} trials/s {swaps_per_second:>10.1f} swaps/s {peak_memory_bytes:>10} B peak, best {best_swaps}".format(
+                        **result
+                    )
+                )
+        if args.cpp_binary:
+            result = benchmark_cpp_binary(args.cpp_binary, table_size, args.num_trials)
+            results.setdefault("cpp_benchmarks", []).append(result)
+            print(
+                "{:>22} {:>10} n={table_size:<3} {trials_per_second:>9.2f} trials/s, best {best_swaps}".format(
+                    "C++", "", **result
+                )
+            )
+
+    output = args.output
+    if output is None:
+        os.makedirs(BENCHMARK_DIR, exist_ok=True)
+        output = os.path.join(
+            BENCHMARK_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json"
+        )
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to {}.".format(output))
@@ -0,0 +1,815 @@
+import collections
+import contextlib
+import copy
+import fcntl
+import json
+import mmap
+import os
+import pickle
+import queue
+import random
+import struct
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from util import index_to_pair, pair_to_index
+
+DEFAULT_MAX_STORED_SEQUENCES = 1000
+
+CHECKPOINT_EXTENSION = ".ckpt"
+LOG_EXTENSION = ".ckptlog"
+# checkpoints were previously pickles of Python lists.
+LEGACY_CHECKPOINT_EXTENSION = ".pickle"
+# high score shared by the processes running trials for a checkpoint.
+HIGH_SCORE_EXTENSION = ".best"
+# held by any process reading or writing a checkpoint, which may be shared.
+LOCK_EXTENSION = ".lock"
+
+MAGIC = b"FRTC"
+VERSION = 2
+# magic, version, table size, trials, number of ties, best length, number of stored
+# sequences, number of stored seeded trials, length of the JSON metadata that follows
+# the header.
+HEADER = struct.Struct("<4sHHQQIIII")
+# trial index, seed (0 if the swaps follow) and length of a sequence in the log.
+LOG_RECORD_HEADER = struct.Struct("<QQI")
+
+CheckpointHeader = collections.namedtuple(
+    "CheckpointHeader",
+    [
+        "table_size",
+        "trials",
+        "num_ties",
+        "best_length",
+        "num_sequences",
+        "num_seeded",
+        "metadata",
+    ],
+)
+
+
+class SeededTrial(object):
+    """
+    Stands in for the swaps of a trial that can be regenerated from its seed (see
+    swapper_util.trial_rng), so that checkpoints store 16 bytes rather than the whole
+    sequence. Its length is that of the sequence.
+    """
+
+    __slots__ = ["seed", "length"]
+
+    def __init__(self, seed, length):
+        self.seed = seed
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __eq__(self, other):
+        return isinstance(other, SeededTrial) and (self.seed, self.length) == (
+            other.seed,
+            other.length,
+        )
+
+    def __repr__(self):
+        return "SeededTrial(seed={}, length={})".format(self.seed, self.length)
+
+
+def swap_index_dtype(table_size):
+    """
+    :param table_size:
+    :return: smallest numpy dtype that can hold the index (see util.pair_to_index) of
+    every swap at a table of the specified size.
+    """
+    num_swaps = table_size * (table_size - 1) // 2
+    if num_swaps <= 2 ** 8:
+        return np.dtype("<u1")
+    if num_swaps <= 2 ** 16:
+        return np.dtype("<u2")
+    return np.dtype("<u4")
+
+
+def record_dtype(table_size, best_length):
+    """
+    :return: numpy dtype of a stored sequence: its trial index followed by its swaps.
+    """
+    return np.dtype(
+        [("trial", "<u8"), ("swaps", swap_index_dtype(table_size), (best_length,))]
+    )
+
+
+# dtype of a stored seeded trial.
+SEEDED_RECORD_DTYPE = np.dtype([("trial", "<u8"), ("seed", "<u8")])
+
+
+def encode_swaps(swaps, table_size):
+    if len(swaps) == 0:
+        return np.zeros(0, dtype=swap_index_dtype(table_size))
+    (first, second) = np.array(swaps).T
+    return pair_to_index(first, second).astype(swap_index_dtype(table_size))
+
+
+def decode_swaps(indices):
+    (first, second) = index_to_pair(indices)
+    return list(zip(first.tolist(), second.tolist()))
+
+
+def unpack_checkpoint_header(data, cp_file):
+    """
+    :param data: buffer holding (at least the header and metadata of) a checkpoint.
+    :param cp_file: path of the checkpoint, for error messages.
+    :return: tuple (header, offset), where header is a CheckpointHeader and offset is
+    that of the stored sequences.
+    """
+    (magic, version) = struct.unpack_from("<4sH", data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not a version {} checkpoint.".format(cp_file, VERSION))
+    (_, _, *fields, metadata_length) = HEADER.unpack_from(data, 0)
+    offset = HEADER.size
+    metadata = json.loads(bytes(data[offset : offset + metadata_length]) or b"{}")
+    return (CheckpointHeader(*fields, metadata), offset + metadata_length)
+
+
+def read_checkpoint_header(cp_file):
+
+    """ Reads only the header (and metadata) of a checkpoint, through a memory map.
+
+    :param cp_file: path of the checkpoint.
+    :return: CheckpointHeader
+    """
+
+    with open(cp_file, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with m:
+        return unpack_checkpoint_header(m, cp_file)[0]
+
+
+def has_checkpoint(cp_file):
+    """
+    :return: True if a checkpoint, or a legacy checkpoint to migrate, exists at cp_file.
+    """
+    root = os.path.splitext(cp_file)[0]
+    return os.path.isfile(cp_file) or os.path.isfile(root + LEGACY_CHECKPOINT_EXTENSION)
+
+
+# a snapshot to write, queued by Checkpoint.write: the number of trials run so far by
+# the process writing it, and the metadata to store with it.
+Snapshot = collections.namedtuple("Snapshot", ["trials", "metadata"])
+
+
+class Checkpoint(object):
+    """
+    Progress of a heuristic search for a single swapper and table size: the number of
+    trials run, the number of trials that tied the high score, and a uniform random
+    sample (maintained by reservoir sampling) of at most max_stored_sequences of the
+    (trial index, swaps) pairs of those trials.
+
+    The checkpoint is stored as a snapshot, which is rewritten in full on a new high score
+    and periodically, plus an append-only log of the ties recorded since the snapshot, so
+    that recording a tie costs O(sequence) I/O rather than O(all sequences).
+
+    Both are stored in a packed binary format, with swaps stored by their index (see
+    util.pair_to_index) as uint8, uint16 or uint32. The snapshot is a fixed-size header (see
+    read_checkpoint_header), followed by JSON metadata, followed by the stored sequences
+    and then the stored seeded trials: trials that can be regenerated from a seed are
+    stored as a SeededTrial rather than their swaps, and only regenerated when read
+    through swap_sequences. Legacy pickled checkpoints are migrated to this format, with
+    the legacy file renamed rather than deleted.
+
+    Snapshots are written to a temporary file which then atomically replaces the previous
+    snapshot, so that being interrupted while writing never corrupts the checkpoint. Each
+    snapshot has a generation (in its metadata), which names the log of the ties recorded
+    after it; a log left behind by an interruption after its snapshot was replaced has an
+    older generation, and is not replayed.
+
+    Several processes may record trials in the same checkpoint at once. Every read and
+    write of the files takes an exclusive lock on a sidecar lock file; ties are appended
+    to the log of the snapshot currently on disk, and a snapshot is the one on disk with
+    its log folded in, plus the trials run by this process since its last snapshot. The
+    state in memory is that of this process, and is only brought up to date with the
+    files when a snapshot is written synchronously, or on flush.
+
+    If asynchronous, the I/O is done by a background thread (see CheckpointWriter), so
+    that recording a tie or writing a snapshot never blocks on disk I/O.
+    """
+
+    def __init__(
+        self,
+        cp_file,
+        max_stored_sequences=DEFAULT_MAX_STORED_SEQUENCES,
+        asynchronous=False,
+        regenerate_trial=None,
+    ):
+        """
+        :param cp_file: path of the snapshot; the log is stored alongside it.
+        :param max_stored_sequences: maximum number of tying sequences to keep.
+        :param asynchronous: if True, write in a background thread; call flush to wait
+        for pending writes to complete.
+        :param regenerate_trial: function taking a trial index and a SeededTrial, and
+        returning the swaps of the trial, used by swap_sequences.
+        """
+        self.cp_file = cp_file
+        self.regenerate_trial = regenerate_trial
+        self.root = os.path.splitext(cp_file)[0]
+        root = self.root
+        self.table_size = int(os.path.basename(root))
+        self.max_stored_sequences = max_stored_sequences
+        self.trials = 0
+        self.best_swap_sequences = []
+        self.num_ties = 0
+        self.metadata = {}
+        # kept separate from the global generator used by the swappers.
+        self.rng = random.Random()
+        self.writer = None
+        self.lock_file = None
+        # trials in the snapshot on disk when it was last read, not counting those of
+        # ties replayed from its log.
+        self.snapshot_trials = 0
+
+        legacy_file = root + LEGACY_CHECKPOINT_EXTENSION
+        if os.path.isfile(self.cp_file) or os.path.isfile(self._log_file(0)):
+            with self._locked():
+                self._load()
+        elif os.path.isfile(legacy_file):
+            with self._locked():
+                self._migrate_legacy(legacy_file)
+        # number of trials run so far, as passed to write, when this process last queued
+        # (or wrote, for written_trials) a snapshot.
+        self.queued_trials = self.trials
+        self.written_trials = self.trials
+
+        if asynchronous:
+            self.writer = CheckpointWriter(self)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        if self.lock_file is None:
+            self.lock_file = open(self.root + LOCK_EXTENSION, "a")
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def generation(self):
+        return self.metadata.get("generation", 0)
+
+    def _log_file(self, generation):
+        # the first generation keeps the name used before snapshots had generations.
+        if generation == 0:
+            return self.root + LOG_EXTENSION
+        return "{}.{}{}".format(self.root, generation, LOG_EXTENSION)
+
+    @property
+    def log_file(self):
+        return self._log_file(self.generation)
+
+    def _load(self):
+        # loads the snapshot (if any) and its log; must hold the lock.
+        if os.path.isfile(self.cp_file):
+            with open(self.cp_file, "rb") as f:
+                data = f.read()
+            (header, offset) = unpack_checkpoint_header(data, self.cp_file)
+            self.trials = header.trials
+            self.num_ties = header.num_ties
+            self.metadata = header.metadata
+            records = np.frombuffer(
+                data,
+                dtype=record_dtype(self.table_size, header.best_length),
+                count=header.num_sequences,
+                offset=offset,
+            )
+            seeded_records = np.frombuffer(
+                data,
+                dtype=SEEDED_RECORD_DTYPE,
+                count=header.num_seeded,
+                offset=offset + records.nbytes,
+            )
+            self.best_swap_sequences = [
+                (int(r["trial"]), decode_swaps(r["swaps"])) for r in records
+            ] + [
+                (int(r["trial"]), SeededTrial(int(r["seed"]), header.best_length))
+                for r in seeded_records
+            ]
+        self.snapshot_trials = self.trials
+
+        if self.generation > 0 and os.path.isfile(self._log_file(self.generation - 1)):
+            # already folded into the snapshot, before an interruption.
+            os.remove(self._log_file(self.generation - 1))
+        if os.path.isfile(self.log_file):
+            with open(self.log_file, "rb") as f:
+                data = f.read()
+            for (i, swaps) in self._read_log(data):
+                self._replay_tie(i, swaps)
+
+    def _read(self):
+        # returns a copy of this checkpoint holding the state on disk, leaving this one
+        # unchanged; must hold the lock.
+        disk = copy.copy(self)
+        disk.trials = 0
+        disk.best_swap_sequences = []
+        disk.num_ties = 0
+        disk.metadata = {}
+        disk._load()
+        return disk
+
+    def _adopt(self, disk):
+        # replaces the state in memory by that on disk, read by _read.
+        self.trials = disk.trials
+        self.best_swap_sequences = disk.best_swap_sequences
+        self.num_ties = disk.num_ties
+        self.metadata = disk.metadata
+        self.snapshot_trials = disk.snapshot_trials
+
+    def _read_log(self, data):
+        # yields the (trial index, swaps) of each tie in the log.
+        dtype = swap_index_dtype(self.table_size)
+        offset = 0
+        while offset + LOG_RECORD_HEADER.size <= len(data):
+            (i, seed, length) = LOG_RECORD_HEADER.unpack_from(data, offset)
+            offset += LOG_RECORD_HEADER.size
+            if seed:
+                yield (i, SeededTrial(seed, length))
+                continue
+            if offset + length * dtype.itemsize > len(data):
+                # a record cut short by an interruption while appending.
+                break
+            swaps = np.frombuffer(data, dtype=dtype, count=length, offset=offset)
+            offset += length * dtype.itemsize
+            yield (i, decode_swaps(swaps))
+
+    def _migrate_legacy(self, legacy_file):
+        with open(legacy_file, "rb") as f:
+            # some legacy pickle files have 3 fields; the third is extraneous
+            [self.trials, best_swap_sequences] = pickle.load(f)[:2]
+        self.num_ties = len(best_swap_sequences)
+        if len(best_swap_sequences) > self.max_stored_sequences:
+            best_swap_sequences = self.rng.sample(
+                best_swap_sequences, self.max_stored_sequences
+            )
+        self.best_swap_sequences = best_swap_sequences
+        self.metadata["generation"] = 1
+        self._write_records(
+            self.trials, self.num_ties, self.best_swap_sequences, self.metadata
+        )
+        self.snapshot_trials = self.trials
+        os.rename(legacy_file, legacy_file + ".migrated")
+
+    def _replay_tie(self, i, swaps):
+        # ties are logged in the order they were recorded, by any of the processes
+        # sharing the checkpoint, so a tie may beat those before it, or fall short of a
+        # high score found by another process.
+        self.trials = max(self.trials, i)
+        if self.min_swap_num is not None:
+            if len(swaps) > self.min_swap_num:
+                return
+            if len(swaps) < self.min_swap_num:
+                self.best_swap_sequences = []
+                self.num_ties = 0
+        self._sample(i, swaps)
+
+    @property
+    def min_swap_num(self):
+        """
+        :return: the high score, or None if no trial has made everyone friends yet.
+        """
+        if len(self.best_swap_sequences) == 0:
+            return None
+        return len(self.best_swap_sequences[0][1])
+
+    def _sample(self, i, swaps):
+        self.num_ties += 1
+        if len(self.best_swap_sequences) < self.max_stored_sequences:
+            self.best_swap_sequences.append((i, swaps))
+        else:
+            k = self.rng.randrange(self.num_ties)
+            if k < self.max_stored_sequences:
+                self.best_swap_sequences[k] = (i, swaps)
+
+    def swap_sequences(self):
+        """
+        :return: generator of the (trial index, swaps) pairs of the stored sequences,
+        regenerating the swaps of seeded trials as they are reached.
+        """
+        for (i, swaps) in self.best_swap_sequences:
+            if isinstance(swaps, SeededTrial):
+                if self.regenerate_trial is None:
+                    raise ValueError(
+                        "Trial #{} of {} is stored by its seed, and cannot be "
+                        "regenerated without its swapper.".format(i, self.cp_file)
+                    )
+                swaps = self.regenerate_trial(i, swaps)
+            yield (i, swaps)
+
+    def add_tie(self, i, swaps):
+        """ Records a trial that tied the high score, appending it to the log.
+
+        :param i: index of the trial.
+        :param swaps: list of swaps carried out in the trial, or SeededTrial to store
+        just its seed.
+        """
+        self._sample(i, swaps)
+        self._log(i, swaps)
+
+    def _log(self, i, swaps):
+        if self.writer:
+            self.writer.submit((i, swaps))
+        else:
+            self._append_ties([(i, swaps)])
+
+    def _append_ties(self, ties):
+        with self._locked():
+            # the snapshot may have been replaced by another process since it was read.
+            generation = 0
+            if os.path.isfile(self.cp_file):
+                generation = read_checkpoint_header(self.cp_file).metadata.get(
+                    "generation", 0
+                )
+            with open(self._log_file(generation), "ab") as f:
+                for (i, swaps) in ties:
+                    if isinstance(swaps, SeededTrial):
+                        f.write(LOG_RECORD_HEADER.pack(i, swaps.seed, len(swaps)))
+                    else:
+                        f.write(LOG_RECORD_HEADER.pack(i, 0, len(swaps)))
+                        f.write(encode_swaps(swaps, self.table_size).tobytes())
+
+    def new_high_score(self, trials, i, swaps):
+        """ Records a trial that beat the high score, writing a new snapshot.
+
+        :param trials: number of trials run so far.
+        :param i: index of the trial.
+        :param swaps: list of swaps carried out in the trial, or SeededTrial to store
+        just its seed.
+        """
+        self.best_swap_sequences = [(i, swaps)]
+        self.num_ties = 1
+        # logged like a tie, so that it is merged with the ties of any other process.
+        self._log(i, swaps)
+        self.write(trials)
+
+    def write(self, trials):
+        """ Writes a snapshot of the checkpoint, folding in (and clearing) the log.
+
+        :param trials: number of trials run so far, counting from self.trials when the
+        checkpoint was loaded; only those run since the last snapshot are added to the
+        trials on disk, which may have been run by other processes in the meantime.
+        """
+        self.trials = max(self.trials + trials - self.queued_trials, trials)
+        self.queued_trials = trials
+        snapshot = Snapshot(trials, dict(self.metadata))
+        if self.writer:
+            self.writer.submit(snapshot)
+        else:
+            self._adopt(self._write_snapshot(snapshot))
+
+    def _write_snapshot(self, snapshot):
+        # merges the snapshot with the checkpoint on disk, returning the merged state.
+        with self._locked():
+            disk = self._read()
+            # trials run by a process that was interrupted after logging its last tie
+            # are counted up to that tie, as this process carried on from there.
+            disk.trials = max(
+                disk.snapshot_trials + snapshot.trials - self.written_trials,
+                snapshot.trials,
+            )
+            previous_log_file = disk.log_file
+            generation = disk.generation + 1
+            disk.metadata.update(snapshot.metadata)
+            disk.metadata["generation"] = generation
+            self._write_records(
+                disk.trials, disk.num_ties, disk.best_swap_sequences, disk.metadata
+            )
+            self.written_trials = snapshot.trials
+            disk.snapshot_trials = disk.trials
+            # the log of the previous generation is folded into the snapshot.
+            if os.path.isfile(previous_log_file):
+                os.remove(previous_log_file)
+        return disk
+
+    def _write_records(self, trials, num_ties, best_swap_sequences, metadata):
+        best_length = len(best_swap_sequences[0][1]) if best_swap_sequences else 0
+        sequences = [
+            (i, swaps)
+            for (i, swaps) in best_swap_sequences
+            if not isinstance(swaps, SeededTrial)
+        ]
+        records = np.zeros(
+            len(sequences), dtype=record_dtype(self.table_size, best_length)
+        )
+        for (r, (i, swaps)) in enumerate(sequences):
+            records[r] = (i, encode_swaps(swaps, self.table_size))
+        seeded_records = np.array(
+            [
+                (i, swaps.seed)
+                for (i, swaps) in best_swap_sequences
+                if isinstance(swaps, SeededTrial)
+            ],
+            dtype=SEEDED_RECORD_DTYPE,
+        )
+        metadata = json.dumps(metadata).encode()
+
+        (fd, temp_file) = tempfile.mkstemp(
+            dir=os.path.dirname(self.cp_file) or ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    HEADER.pack(
+                        MAGIC,
+                        VERSION,
+                        self.table_size,
+                        trials,
+                        num_ties,
+                        best_length,
+                        len(records),
+                        len(seeded_records),
+                        len(metadata),
+                    )
+                )
+                f.write(metadata)
+                f.write(records.tobytes())
+                f.write(seeded_records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.cp_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    def flush(self):
+        """ Waits for pending writes to complete, if asynchronous, and brings the state in
+        memory up to date with the checkpoint on disk, including any trials recorded by
+        other processes.
+        """
+        if self.writer:
+            self.writer.flush()
+        with self._locked():
+            disk = self._read()
+        # trials since the last snapshot are only counted on disk by the next one.
+        disk.trials += self.queued_trials - self.written_trials
+        self._adopt(disk)
+
+
+class CheckpointWriter(object):
+    """
+    Background thread carrying out the writes of an asynchronous Checkpoint, so that the
+    trial loop never blocks on disk I/O.
+
+    Writes are queued in order, and each time the thread wakes it takes every write
+    queued so far: the ties queued before the last snapshot are appended to the log in a
+    single write, then only the last snapshot is written, as it folds in the log and
+    counts every trial run so far, and then the ties queued after it are appended.
+    """
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """
+        :param item: tie (trial index, swaps) or Snapshot.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(item)
+
+    def flush(self):
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            except Exception as e:
+                self.error = e
+            for _ in items:
+                self.queue.task_done()
+
+    def _write(self, items):
+        snapshots = [k for (k, item) in enumerate(items) if isinstance(item, Snapshot)]
+        if snapshots:
+            ties = [
+                item for item in items[: snapshots[-1]] if not isinstance(item, Snapshot)
+            ]
+            if ties:
+                self.checkpoint._append_ties(ties)
+            self.checkpoint._write_snapshot(items[snapshots[-1]])
+            items = items[snapshots[-1] + 1 :]
+        if items:
+            self.checkpoint._append_ties(items)
+
+
+class SharedHighScore(object):
+    """
+    High score shared by every process on a host running trials for the same checkpoint,
+    through a memory-mapped file holding a single 32-bit int, so that each process can
+    prune its trials against the best score found by any of them. Reads are a single
+    aligned load from the map; lowering the score takes an exclusive lock on the file.
+    """
+
+    def __init__(self, path, initial_value):
+        """
+        :param path: path of the file holding the high score, created if it does not exist.
+        :param initial_value: value of the high score if the file does not exist yet.
+        """
+        self.file = open(path, "a+b")
+        with self._locked():
+            if os.fstat(self.file.fileno()).st_size != 4:
+                self.file.truncate(0)
+                self.file.write(struct.pack("<i", initial_value))
+                self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), 4)
+        self.values = memoryview(self.map).cast("i")
+
+    @contextlib.contextmanager
+    def _locked(self):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def value(self):
+        return self.values[0]
+
+    def lower(self, value):
+        """ Lowers the high score to value, unless it is already at most value.
+
+        :return: True if value is at most the high score (i.e. ties or beats it).
+        """
+        with self._locked():
+            if value > self.values[0]:
+                return False
+            self.values[0] = value
+            return True
+
+    def reset(self, value):
+        """ Sets the high score to value, even if it is higher. """
+        with self._locked():
+            self.values[0] = value
+
+    def close(self):
+        self.values.release()
+        self.map.close()
+        self.file.close()
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cp_file = os.path.join(self.dir.name, "10" + CHECKPOINT_EXTENSION)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_reservoir_keeps_exact_tie_count(self):
+        cp = Checkpoint(self.cp_file, max_stored_sequences=3)
+        cp.new_high_score(1, 1, [(0, 1)])
+        for i in range(2, 11):
+            cp.add_tie(i, [(0, i % 10)])
+        self.assertEqual(cp.num_ties, 10)
+        self.assertEqual(len(cp.best_swap_sequences), 3)
+
+        # ties since the snapshot are replayed from the log.
+        cp = Checkpoint(self.cp_file, max_stored_sequences=3)
+        self.assertEqual((cp.trials, cp.num_ties, cp.min_swap_num), (10, 10, 1))
+        self.assertEqual(len(cp.best_swap_sequences), 3)
+
+        cp.write(20)
+        self.assertFalse(os.path.isfile(cp.log_file))
+        cp = Checkpoint(self.cp_file)
+        self.assertEqual((cp.trials, cp.num_ties), (20, 10))
+
+    def test_shared_high_score(self):
+        path = os.path.join(self.dir.name, "10" + HIGH_SCORE_EXTENSION)
+        a = SharedHighScore(path, 45)
+        b = SharedHighScore(path, 45)
+        self.assertTrue(a.lower(12))
+        self.assertEqual(b.value, 12)
+        self.assertFalse(b.lower(13))
+        self.assertTrue(b.lower(12))
+        a.close()
+        b.close()
+        # the existing high score is kept when the file is reopened.
+        c = SharedHighScore(path, 45)
+        self.assertEqual(c.value, 12)
+        c.reset(20)
+        self.assertEqual(c.value, 20)
+        c.close()
+
+    def test_round_trip(self):
+        sequences = [(4, [(0, 9), (3, 5), (1, 2)]), (8, [(2, 7), (0, 1), (8, 9)])]
+        cp = Checkpoint(self.cp_file)
+        cp.new_high_score(5, *sequences[0])
+        cp.add_tie(*sequences[1])
+        cp.write(10)
+        self.assertEqual(Checkpoint(self.cp_file).best_swap_sequences, sequences)
+        self.assertEqual(
+            read_checkpoint_header(self.cp_file),
+            CheckpointHeader(10, 10, 2, 3, 2, 0, {"generation": 2}),
+        )
+
+    def test_swap_index_dtype(self):
+        # indices of swaps at tables of more than 362 people do not fit in 16 bits.
+        for (table_size, itemsize) in [(23, 1), (100, 2), (363, 4)]:
+            swaps = [(0, table_size - 1), (table_size - 2, table_size - 1)]
+            encoded = encode_swaps(swaps, table_size)
+            self.assertEqual(encoded.itemsize, itemsize)
+            self.assertEqual(decode_swaps(encoded), swaps)
+
+    def test_seeded_trials(self):
+        regenerated = {4: [(0, 9), (3, 5), (1, 2)], 8: [(2, 7), (0, 1), (8, 9)]}
+        regenerate_trial = lambda i, trial: regenerated[i]
+        cp = Checkpoint(self.cp_file)
+        cp.new_high_score(5, 4, SeededTrial(123, 3))
+        cp.write(6)
+        cp.add_tie(8, SeededTrial(456, 3))
+        cp.add_tie(9, [(1, 4), (2, 5), (3, 6)])
+
+        # the seeded tie is replayed from the log.
+        cp = Checkpoint(self.cp_file, regenerate_trial=regenerate_trial)
+        self.assertEqual(cp.best_swap_sequences[1], (8, SeededTrial(456, 3)))
+        cp.write(10)
+        self.assertEqual(read_checkpoint_header(self.cp_file)[3:6], (3, 1, 2))
+        cp = Checkpoint(self.cp_file, regenerate_trial=regenerate_trial)
+        self.assertEqual(
+            list(cp.swap_sequences()),
+            [(9, [(1, 4), (2, 5), (3, 6)]), (4, regenerated[4]), (8, regenerated[8])],
+        )
+        with self.assertRaises(ValueError):
+            list(Checkpoint(self.cp_file).swap_sequences())
+
+    def test_log_of_replaced_snapshot_is_not_replayed(self):
+        cp = Checkpoint(self.cp_file)
+        cp.new_high_score(1, 1, [(0, 1)])
+        cp.add_tie(2, [(0, 2)])
+        stale_log = cp.log_file
+        with open(stale_log, "rb") as f:
+            data = f.read()
+        cp.write(3)
+        # as if interrupted between replacing the snapshot and removing the log.
+        with open(stale_log, "wb") as f:
+            f.write(data)
+        cp = Checkpoint(self.cp_file)
+        self.assertEqual((cp.trials, cp.num_ties), (3, 2))
+        self.assertFalse(os.path.isfile(stale_log))
+
+    def test_shared_by_several_processes(self):
+        a = Checkpoint(self.cp_file)
+        b = Checkpoint(self.cp_file)
+        a.new_high_score(1, 1, [(0, 1), (2, 3)])
+        # b has not seen a's high score, which it ties.
+        b.new_high_score(1, 1, [(0, 2), (1, 3)])
+        a.add_tie(3, [(0, 3), (1, 2)])
+        a.write(1500)
+        b.write(1500)
+        cp = Checkpoint(self.cp_file)
+        self.assertEqual((cp.trials, cp.num_ties, cp.min_swap_num), (3000, 3, 2))
+
+        # a tie short of a high score found by another process is not counted.
+        b.new_high_score(1600, 1600, [(0, 9)])
+        a.add_tie(1501, [(0, 3), (1, 2)])
+        a.flush()
+        self.assertEqual((a.trials, a.num_ties, a.min_swap_num), (3100, 1, 1))
+
+    def test_asynchronous_writes(self):
+        cp = Checkpoint(self.cp_file, asynchronous=True)
+        cp.new_high_score(1, 1, [(0, 1)])
+        for i in range(2, 50):
+            cp.add_tie(i, [(0, i % 9 + 1)])
+            if i % 10 == 0:
+                cp.write(i)
+        cp.flush()
+        expected = (cp.num_ties, cp.best_swap_sequences)
+        cp = Checkpoint(self.cp_file)
+        # ties since the last snapshot are replayed from the log.
+        self.assertEqual(
+            (cp.trials, cp.num_ties, cp.best_swap_sequences), (49,) + expected
+        )
+        self.assertFalse(any(f.endswith(".tmp") for f in os.listdir(self.dir.name)))
+
+    def test_legacy_checkpoint(self):
+        legacy_file = os.path.join(self.dir.name, "10" + LEGACY_CHECKPOINT_EXTENSION)
+        with open(legacy_file, "wb") as f:
+            pickle.dump([7, [(3, [(0, 1)]), (5, [(1, 2)])], "extraneous"], f)
+        cp = Checkpoint(self.cp_file, max_stored_sequences=1)
+        self.assertEqual((cp.trials, cp.num_ties, cp.min_swap_num), (7, 2, 1))
+        self.assertEqual(len(cp.best_swap_sequences), 1)
+        # the checkpoint is migrated.
+        self.assertFalse(os.path.isfile(legacy_file))
+        self.assertEqual(read_checkpoint_header(self.cp_file).num_ties, 2)
@@ -5,7 +5,7 @@ min_swaps = {
     5: 3,
     6: 4,
     7: 4,
-    8: 7,
+    8: 6,
     9: 8,
     10: 10,
     11: 12,
@@ -20,11 +20,135 @@ min_swaps = {
     20: 47,
     21: 54,
     22: 60,
-    30: 116,
+    30: 112,
+}
+
+# sequences achieving entries of min_swaps found by the searches in this directory, so
+# that they can be checked; the one at 30 was found by beam_search.py with a beam width of
+# 500.
+min_swap_sequences = {
+    30: [
+        (10, 24),
+        (0, 16),
+        (25, 28),
+        (10, 21),
+        (2, 24),
+        (5, 26),
+        (16, 23),
+        (11, 19),
+        (11, 25),
+        (8, 12),
+        (26, 29),
+        (7, 23),
+        (1, 20),
+        (5, 18),
+        (10, 22),
+        (8, 23),
+        (5, 14),
+        (1, 6),
+        (12, 17),
+        (9, 28),
+        (20, 24),
+        (6, 9),
+        (9, 12),
+        (4, 16),
+        (3, 16),
+        (1, 5),
+        (2, 8),
+        (10, 24),
+        (12, 16),
+        (15, 23),
+        (18, 27),
+        (0, 21),
+        (0, 24),
+        (20, 28),
+        (4, 20),
+        (8, 29),
+        (14, 29),
+        (9, 16),
+        (0, 4),
+        (12, 23),
+        (7, 12),
+        (17, 25),
+        (18, 23),
+        (3, 27),
+        (6, 26),
+        (13, 22),
+        (3, 21),
+        (0, 11),
+        (4, 24),
+        (5, 14),
+        (2, 19),
+        (1, 17),
+        (2, 25),
+        (7, 20),
+        (6, 23),
+        (10, 18),
+        (7, 10),
+        (11, 29),
+        (8, 16),
+        (14, 21),
+        (12, 26),
+        (22, 28),
+        (14, 17),
+        (7, 22),
+        (0, 20),
+        (11, 18),
+        (22, 25),
+        (5, 18),
+        (10, 27),
+        (1, 11),
+        (12, 28),
+        (2, 6),
+        (9, 22),
+        (3, 19),
+        (6, 14),
+        (7, 23),
+        (4, 16),
+        (15, 26),
+        (11, 16),
+        (2, 7),
+        (2, 12),
+        (15, 18),
+        (23, 29),
+        (8, 22),
+        (10, 20),
+        (12, 22),
+        (0, 13),
+        (7, 17),
+        (1, 4),
+        (2, 9),
+        (16, 20),
+        (6, 19),
+        (13, 16),
+        (2, 15),
+        (9, 28),
+        (6, 8),
+        (8, 25),
+        (1, 5),
+        (8, 26),
+        (9, 13),
+        (14, 28),
+        (20, 28),
+        (5, 21),
+        (4, 25),
+        (0, 26),
+        (10, 26),
+        (2, 28),
+        (2, 22),
+        (3, 8),
+        (4, 17),
+        (14, 23),
+        (2, 16),
+    ],
 }
 
 PWD = os.path.dirname(__file__)
 LOGS_DIR = os.path.join(PWD, "logs")
 CHECKPOINT_DIR = os.path.join(PWD, "checkpoint")
+SHARDS_DIR = os.path.join(PWD, "shards")
+RESULTS_INDEX_FILE = os.path.join(CHECKPOINT_DIR, "results.sqlite")
 LOGS_FULL_DIR = LOGS_DIR + "_full"
 CHECKPOINT_FULL_DIR = CHECKPOINT_DIR + "_full"
+CERTIFICATE_DIR = os.path.join(PWD, "certificates")
+BENCHMARK_DIR = os.path.join(PWD, "benchmarks")
@@ -0,0 +1,146 @@
+import unittest
+
+import numpy as np
+
+from exact_solver import BranchAndBoundSolver
+from friend_matrix import FriendMatrix
+from sequence_evaluator import SequenceEvaluator
+
+DEFAULT_MAX_NODES = 2000
+
+
+class EndgameSolver(object):
+    """
+    Finds a shortest sequence of swaps completing a table from a given state (typically
+    late in a heuristic trial, when few friend pairs remain), by iterative deepening with
+    the branch-and-bound solver.
+
+    Results are cached by the canonical key of the state (see TableStateCanonicalizer),
+    so that states equivalent up to rotation, reflection and relabelling share a single
+    search. As the key does not depend on which transformation took the state to its
+    canonical form, completions are stored as swaps of the canonical form, and mapped
+    to the seats of each state looked up.
+
+    Each search is limited to max_nodes nodes, so that the endgame costs at most a bounded
+    multiple of a heuristic trial; a state whose search gives up is recorded as such, and
+    left to the heuristic.
+    """
+
+    def __init__(self, table_size, max_nodes=DEFAULT_MAX_NODES):
+        """
+        :param table_size: Number of people at the table.
+        :param max_nodes: Maximum number of nodes searched for each state.
+        """
+        self.n = table_size
+        self.max_nodes = max_nodes
+        self.solver = BranchAndBoundSolver(table_size, use_transposition_table=False)
+        self.canonicalizer = self.solver.canonicalizer
+        self.swap_index = {swap: k for (k, swap) in enumerate(self.solver.swaps)}
+        # to_canonical[t, k] is the index of the swap of the canonical form that swaps[k]
+        # corresponds to, when the state is taken to its canonical form by transformation t.
+        self.to_canonical = np.argsort(self.canonicalizer.moved_swaps, axis=1)
+        # maps canonical keys to (min_length, canonical swap indices), where min_length is
+        # a proven lower bound on the length of a completion, and the swap indices are a
+        # completion of that length (or None if none was found).
+        self.cache = {}
+        # canonical keys of states whose search gave up, which are not searched again.
+        self.given_up = set()
+        self.hits = 0
+        self.misses = 0
+        self.nodes = 0
+
+    def solve(self, seating_arrangement, friend_pairs, max_swaps):
+        """ Searches for a shortest sequence of at most max_swaps swaps making everyone
+        friends from the given state.
+
+        :param seating_arrangement: list of ints representing the seating arrangement.
+        :param friend_pairs: FriendMatrix of the pairs of individuals who are friends.
+        :param max_swaps: Maximum number of swaps allowed.
+        :return: list of swaps, or None if no sequence was found within the limits.
+        """
+        (key, t) = self.canonicalizer.canonicalize(
+            np.array(seating_arrangement), friend_pairs
+        )
+        if key in self.given_up:
+            self.hits += 1
+            return None
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.hits += 1
+            (min_length, canonical_swaps) = entry
+        else:
+            self.misses += 1
+            (min_length, canonical_swaps) = (self.solver.lower_bound(friend_pairs), None)
+
+        while canonical_swaps is None and min_length <= max_swaps:
+            swaps = self.solver.solve(
+                min_length,
+                first_solution_only=True,
+                seating_arrangement=seating_arrangement,
+                friend_pairs=friend_pairs,
+                max_nodes=self.max_nodes,
+            )
+            self.nodes += self.solver.nodes
+            if self.solver.aborted:
+                self.given_up.add(key)
+                return None
+            if swaps is None:
+                # as every shallower search has failed, any sequence found is a shortest one.
+                min_length += 1
+            else:
+                canonical_swaps = [
+                    int(self.to_canonical[t, self.swap_index[swap]])
+                    for swap in swaps
+                ]
+        self.cache[key] = (min_length, canonical_swaps)
+
+        if canonical_swaps is None or min_length > max_swaps:
+            return None
+        moved_swaps = self.canonicalizer.moved_swaps[t]
+        return [self.solver.swaps[moved_swaps[c]] for c in canonical_swaps]
+
+
+class TestEndgameSolver(unittest.TestCase):
+    def setUp(self):
+        self.n = 9
+        self.endgame_solver = EndgameSolver(self.n)
+        self.evaluator = SequenceEvaluator(range(self.n))
+        for swap in [(0, 3), (4, 7), (1, 5), (2, 8), (0, 6)]:
+            self.evaluator.push(swap)
+
+    def assertCompletes(self, seating_arrangement, friend_pairs, swaps):
+        evaluator = SequenceEvaluator(seating_arrangement, friend_pairs)
+        for swap in swaps:
+            evaluator.push(swap)
+        self.assertTrue(evaluator.is_everyone_friends())
+
+    def test_completion(self):
+        seating = self.evaluator.seating_arrangement
+        friend_pairs = self.evaluator.friend_pairs
+        swaps = self.endgame_solver.solve(seating, friend_pairs, 20)
+        self.assertCompletes(seating, friend_pairs, swaps)
+        self.assertIsNone(
+            self.endgame_solver.solve(seating, friend_pairs, len(swaps) - 1)
+        )
+
+    def test_equivalent_states_share_the_cache(self):
+        seating = np.array(self.evaluator.seating_arrangement)
+        friend_pairs = self.evaluator.friend_pairs
+        swaps = self.endgame_solver.solve(list(seating), friend_pairs, 20)
+        nodes = self.endgame_solver.nodes
+
+        # reflect and rotate the seats, and relabel the people.
+        relabelling = np.array([4, 7, 0, 2, 8, 1, 6, 3, 5])
+        transformed_seating = list(relabelling[np.roll(seating[::-1], 4)])
+        transformed_friend_pairs = FriendMatrix(
+            self.n, [(relabelling[p_a], relabelling[p_b]) for (p_a, p_b) in friend_pairs]
+        )
+        transformed_swaps = self.endgame_solver.solve(
+            transformed_seating, transformed_friend_pairs, 20
+        )
+        self.assertEqual(self.endgame_solver.hits, 1)
+        self.assertEqual(self.endgame_solver.nodes, nodes)
+        self.assertEqual(len(transformed_swaps), len(swaps))
+        self.assertCompletes(
+            transformed_seating, transformed_friend_pairs, transformed_swaps
+        )
@@ -0,0 +1,476 @@
+import itertools
+import json
+import os
+import time
+import unittest
+
+import numpy as np
+
+from constants import CERTIFICATE_DIR, min_swap_sequences, min_swaps
+from friend_matrix import FriendMatrix
+from sequence_evaluator import SequenceEvaluator
+from util import all_friend_pairs, new_friend_pair_counts
+
+
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+def independent_swaps(swaps, n):
+
+    """ Determines which pairs of swaps are independent, i.e. no seat of one swap is the same
+    as or next to a seat of the other. Carrying out two independent swaps in either order
+    results in the same seating arrangement and the same new friend pairs.
+
+    :param swaps: list of pairs of integers representing the positions of the swaps.
+    :param n: Number of people at the table.
+    :return: square numpy array of bools, True at [k, l] if swaps[k] and swaps[l] are
+    independent.
+    """
+
+    seats = np.array(swaps)
+    # circular distance between every seat of swap k and every seat of swap l.
+    d = np.abs(seats[:, None, :, None] - seats[None, :, None, :]) % n
+    d = np.minimum(d, n - d)
+    return (d >= 2).all(axis=(2, 3))
+
+
+def dihedral_permutations(n):
+
+    """ Determines the rotations and reflections of the seats around a circular table.
+
+    :param n: Number of people at the table.
+    :return: (2n, n) numpy array, where row t maps each seat to the seat it is moved to by
+    the t-th rotation or reflection.
+    """
+
+    seats = np.arange(n)
+    rotations = [(seats + r) % n for r in range(n)]
+    reflections = [(r - seats) % n for r in range(n)]
+    return np.array(rotations + reflections)
+
+
+class TableStateCanonicalizer(object):
+    """
+    Maps each table state (the seating arrangement together with the friend pairs) to a
+    canonical key shared by all equivalent states, where states are equivalent if they are
+    the same up to rotation or reflection of the seats and relabelling of the people.
+
+    People are relabelled by the seat they sit in, so that a state is described by which
+    pairs of seats are occupied by friends; the canonical key is the lexicographically
+    smallest such description over all rotations and reflections of the seats.
+    """
+
+    def __init__(self, swaps, n):
+        """
+        :param swaps: list of all pairs of seats (i, j) with i < j, which also fixes the
+        order in which pairs of seats are described.
+        :param n: Number of people at the table.
+        """
+        (first, second) = np.array(swaps).reshape(-1, 2).T
+        permutations = dihedral_permutations(n)
+        # the seats that each pair of seats is moved to by each transformation.
+        self.moved_first = permutations[:, first]
+        self.moved_second = permutations[:, second]
+        index_of_swap = np.zeros((n, n), dtype=np.intp)
+        index_of_swap[first, second] = np.arange(len(swaps))
+        index_of_swap[second, first] = np.arange(len(swaps))
+        # moved_swaps[t, k] is the index of the pair of seats that swaps[k] is moved to.
+        self.moved_swaps = index_of_swap[self.moved_first, self.moved_second]
+
+    def canonicalize(self, seating_arrangement, friend_pairs):
+        """
+        :param seating_arrangement: numpy array of ints representing the seating arrangement.
+        :param friend_pairs: FriendMatrix of the pairs of individuals who are friends.
+        :return: tuple (key, t), where key is the canonical key of the state as bytes, and t
+        is the index of a transformation taking the state to its canonical form.
+        """
+        # descriptions[t, k] is 1 if the people in the seats that swaps[k] is moved to by the
+        # t-th transformation are friends.
+        descriptions = np.packbits(
+            friend_pairs.matrix[
+                seating_arrangement[self.moved_first],
+                seating_arrangement[self.moved_second],
+            ],
+            axis=1,
+        )
+        # np.lexsort uses the last key as the primary key.
+        t = np.lexsort(descriptions.T[::-1])[0]
+        return (descriptions[t].tobytes(), t)
+
+    def transform_swap_mask(self, mask, t):
+        """
+        :param mask: numpy array of bools, indexed by swap.
+        :param t: index of a transformation.
+        :return: the mask in the coordinates of the transformed state, packed into an int.
+        """
+        return int.from_bytes(np.packbits(mask[self.moved_swaps[t]]).tobytes(), "big")
+
+
+def is_covering_sequence(table_size, swaps):
+
+    """ Checks that carrying out a sequence of swaps makes everyone friends, in the slow
+    (but known to be correct) way of AbstractSwapper.do_swap_v1.
+
+    :param table_size: Number of people at the table.
+    :param swaps: list of pairs of integers representing the positions swapped.
+    :return: True if everyone is friends after the swaps, and False otherwise.
+    """
+
+    seating_arrangement = list(range(table_size))
+    friend_pairs = all_friend_pairs(seating_arrangement)
+    for (i, j) in swaps:
+        seating_arrangement[i], seating_arrangement[j] = (
+            seating_arrangement[j],
+            seating_arrangement[i],
+        )
+        friend_pairs |= all_friend_pairs(seating_arrangement)
+    return len(friend_pairs) == table_size * (table_size - 1) // 2
+
+
+class BranchAndBoundSolver(object):
+    """
+    Finds a shortest sequence of swaps making everyone at a table of the specified size
+    friends with a depth-first branch-and-bound search.
+
+    Each node of the search is a prefix of a swap sequence; swaps are pushed onto a
+    SequenceEvaluator when descending and popped when backtracking, so common prefixes
+    are only ever carried out once. Branches are pruned when:
+
+      - the lower bound on the number of swaps still required (see lower_bound) exceeds
+        the remaining swap budget,
+      - the swap is the same as the previous swap (which would just undo it), or
+      - the swap is independent of the previous swap but comes before it in the list of
+        swaps, as the two can be carried out in either order to the same effect.
+
+    Optionally, a transposition table records the canonical form of every state visited
+    (see TableStateCanonicalizer), so that a state equivalent to one already searched is
+    pruned. As which swaps may follow a state depends on the swap leading to it, each
+    entry records the depth of the state and the swaps that were disallowed after it, and
+    a state is only pruned if it is no shallower and at least as restricted.
+    """
+
+    def __init__(self, table_size, use_transposition_table=True):
+        self.n = table_size
+        self.num_total_friend_pairs = self.n * (self.n - 1) // 2
+        self.swaps = list(itertools.combinations(range(self.n), 2))
+        (self.first, self.second) = np.array(self.swaps).reshape(-1, 2).T
+        # disallowed[k] marks the swaps that may not directly follow swaps[k].
+        self.disallowed = np.tril(independent_swaps(self.swaps, self.n))
+        np.fill_diagonal(self.disallowed, True)
+        self.nothing_disallowed = np.zeros(len(self.swaps), dtype=bool)
+
+        self.use_transposition_table = use_transposition_table
+        self.canonicalizer = TableStateCanonicalizer(self.swaps, self.n)
+        # maps canonical keys to (depth, packed mask of disallowed swaps).
+        self.transposition_table = {}
+
+        self.nodes = 0
+        self.transpositions = 0
+        self.best = None
+        self.max_swaps = None
+        self.first_solution_only = False
+        self.max_nodes = None
+        self.aborted = False
+        self.unsearched = None
+        self.shared_bound = None
+
+    def solve(
+        self,
+        max_swaps,
+        first_solution_only=False,
+        seating_arrangement=None,
+        friend_pairs=None,
+        max_nodes=None,
+        shared_bound=None,
+    ):
+        """ Searches for a shortest sequence of at most max_swaps swaps.
+
+        :param max_swaps: Maximum number of swaps allowed.
+        :param first_solution_only: If True, stop at the first sequence found rather than
+        searching for a shorter one.
+        :param seating_arrangement: If specified, search from this seating arrangement
+        rather than from everyone sitting in order.
+        :param friend_pairs: If specified, FriendMatrix of the pairs of individuals who are
+        already friends; by default, those sitting next to each other.
+        :param max_nodes: If specified, give up (setting self.aborted) after searching this
+        many nodes, returning the best sequence found so far. The first swaps whose
+        subtrees were left (partly) unsearched are then in self.unsearched.
+        :param shared_bound: If specified, function returning a bound on the number of
+        swaps that other searches may lower as they find shorter sequences; it is read at
+        every node, and max_swaps is kept at most the bound.
+        :return: list of swaps, or None if there is no sequence of at most max_swaps swaps.
+        """
+        self.first_solution_only = first_solution_only
+        self.max_nodes = max_nodes
+        self.aborted = False
+        self.unsearched = list(self.swaps)
+        self.shared_bound = shared_bound
+        self.nodes = 0
+        self.transpositions = 0
+        self.transposition_table = {}
+        self.best = None
+        self.max_swaps = max_swaps
+        if seating_arrangement is None:
+            seating_arrangement = range(self.n)
+        # swaps are pushed when descending and popped when backtracking.
+        self._search(
+            SequenceEvaluator(seating_arrangement, friend_pairs, max_snapshots=0), []
+        )
+        return self.best
+
+    def prove(self, max_swaps=None):
+        """ Finds a shortest sequence of swaps by iterative deepening: searching for a
+        sequence of exactly k swaps for k = lower_bound(initial state), k + 1, ..., so that
+        the sequence found is proven to be optimal by the failed searches before it.
+
+        :param max_swaps: If specified, give up after failing to find a sequence of
+        max_swaps swaps.
+        :return: tuple (swaps, certificate), where swaps is a shortest sequence of swaps (or
+        None if we gave up), and certificate is a dict recording the result of the search at
+        every depth (see verify_certificate).
+        """
+        seating_arrangement = list(range(self.n))
+        min_swap_count = self.lower_bound(
+            FriendMatrix.from_seating_arrangement(seating_arrangement)
+        )
+        certificate = {
+            "table_size": self.n,
+            "lower_bound": min_swap_count,
+            "use_transposition_table": self.use_transposition_table,
+            "depths": [],
+        }
+
+        swaps = None
+        while swaps is None and (max_swaps is None or min_swap_count <= max_swaps):
+            start_time = time.time()
+            # as every shallower search has failed, any sequence found is a shortest one.
+            swaps = self.solve(min_swap_count, first_solution_only=True)
+            certificate["depths"].append(
+                {
+                    "depth": min_swap_count,
+                    "result": "no solution" if swaps is None else "solution",
+                    "nodes": self.nodes,
+                    "transpositions": self.transpositions,
+                    "seconds": round(time.time() - start_time, 3),
+                }
+            )
+            if swaps is None:
+                min_swap_count += 1
+
+        certificate["swaps"] = swaps
+        return (swaps, certificate)
+
+    def lower_bound(self, friend_pairs):
+        """ Determines an admissible lower bound on the number of swaps required to make
+        everyone friends, as the largest of:
+
+          - ceil(remaining_pairs / 4), as a swap makes at most 4 new friend pairs,
+          - ceil(max_deficit / 2), where a person's deficit is the number of people they
+            are not yet friends with, as a swap gives each person at most 2 new neighbours
+            (whether they move or their neighbours do), and
+          - ceil(num_people_with_deficit / 6), as a swap only changes the neighbours of the
+            2 people who move and the (at most) 4 people next to their seats.
+
+        :param friend_pairs: FriendMatrix of the pairs of individuals who are friends.
+        :return: lower bound on the number of swaps still required.
+        """
+        remaining = self.num_total_friend_pairs - len(friend_pairs)
+        deficits = (self.n - 1) - friend_pairs.matrix.sum(axis=1, dtype=np.intp)
+        return max(
+            ceil_div(remaining, 4),
+            ceil_div(int(deficits.max()), 2),
+            ceil_div(int(np.count_nonzero(deficits)), 6),
+        )
+
+    def _search(self, evaluator, path):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            self.aborted = True
+            # stops every branch still being searched.
+            self.max_swaps = -1
+            return
+        if self.shared_bound is not None:
+            # another search may have found a shorter sequence since.
+            self.max_swaps = min(self.max_swaps, self.shared_bound())
+        friend_pairs = evaluator.friend_pairs
+        remaining = evaluator.num_remaining_friend_pairs()
+        if remaining == 0:
+            # we only ever search for sequences shorter than the best one found so far.
+            self.best = list(evaluator.swaps)
+            self.max_swaps = -1 if self.first_solution_only else len(path) - 1
+            return
+        budget = self.max_swaps - len(path)
+        if self.lower_bound(friend_pairs) > budget:
+            return
+
+        seating = np.array(evaluator.seating_arrangement)
+        disallowed = self.disallowed[path[-1]] if path else self.nothing_disallowed
+        if self.use_transposition_table and self._is_transposition(
+            seating, friend_pairs, len(path), disallowed
+        ):
+            self.transpositions += 1
+            return
+
+        gains = new_friend_pair_counts(
+            seating, friend_pairs.matrix, self.first, self.second
+        )
+        # after this swap, the remaining pairs must still be coverable with budget - 1 swaps.
+        allowed = (remaining - gains <= 4 * (budget - 1)) & ~disallowed
+        candidates = np.flatnonzero(allowed)
+        # try the swaps making the most new friends first, to find short sequences early.
+        candidates = candidates[np.argsort(-gains[candidates], kind="stable")]
+
+        if not path:
+            # every other first swap is pruned, so its subtree is searched in full.
+            self.unsearched = [self.swaps[k] for k in candidates.tolist()]
+        for (c, k) in enumerate(candidates.tolist()):
+            if len(path) >= self.max_swaps:
+                # the bound was tightened by a solution found in an earlier branch.
+                return
+            evaluator.push(self.swaps[k])
+            path.append(k)
+
+            self._search(evaluator, path)
+
+            path.pop()
+            evaluator.pop()
+            if not path and not self.aborted:
+                self.unsearched = [self.swaps[k] for k in candidates[c + 1 :].tolist()]
+
+    def _is_transposition(self, seating, friend_pairs, depth, disallowed):
+        # Returns True if an equivalent state has already been searched, recording the
+        # state in the transposition table otherwise.
+        (key, t) = self.canonicalizer.canonicalize(seating, friend_pairs)
+        mask = self.canonicalizer.transform_swap_mask(disallowed, t)
+        entry = self.transposition_table.get(key)
+        if entry is None or depth < entry[0]:
+            self.transposition_table[key] = (depth, mask)
+            return False
+        (entry_depth, entry_mask) = entry
+        if entry_mask & ~mask == 0:
+            # every swap allowed here was already tried from an equivalent state with at
+            # least as many swaps remaining.
+            return True
+        if depth == entry_depth:
+            # between them, the two visits try every swap allowed by either.
+            self.transposition_table[key] = (depth, entry_mask & mask)
+        return False
+
+
+def write_certificate(certificate):
+    os.makedirs(CERTIFICATE_DIR, exist_ok=True)
+    cert_file = os.path.join(
+        CERTIFICATE_DIR, "{}.json".format(certificate["table_size"])
+    )
+    with open(cert_file, "w") as f:
+        json.dump(certificate, f, indent=2)
+    return cert_file
+
+
+def verify_certificate(certificate):
+
+    """ Checks a certificate produced by BranchAndBoundSolver.prove, by checking that its
+    sequence of swaps makes everyone friends, and repeating the (deterministic) search at
+    every depth, checking that it gives the same result after searching the same number of
+    nodes.
+
+    :param certificate: dict, as returned by BranchAndBoundSolver.prove.
+    :return: True if the certificate checks out, and False otherwise.
+    """
+
+    table_size = certificate["table_size"]
+    swaps = certificate["swaps"]
+    if swaps is not None and not is_covering_sequence(table_size, swaps):
+        return False
+
+    solver = BranchAndBoundSolver(table_size, certificate["use_transposition_table"])
+    lower_bound = solver.lower_bound(
+        FriendMatrix.from_seating_arrangement(list(range(table_size)))
+    )
+    depths = [d["depth"] for d in certificate["depths"]]
+    if depths != list(range(lower_bound, lower_bound + len(depths))):
+        return False
+    for d in certificate["depths"]:
+        found = solver.solve(d["depth"], first_solution_only=True) is not None
+        if found != (d["result"] == "solution") or solver.nodes != d["nodes"]:
+            return False
+    return swaps is None or len(swaps) == depths[-1]
+
+
+class TestBranchAndBoundSolver(unittest.TestCase):
+    def test_independent_swaps(self):
+        swaps = [(0, 1), (3, 4), (2, 5), (6, 8)]
+        independent = independent_swaps(swaps, 9)
+        self.assertTrue(independent[0, 1])
+        self.assertTrue(independent[1, 0])
+        # seat 2 is next to seat 1.
+        self.assertFalse(independent[0, 2])
+        # seat 8 is next to seat 0 around the table.
+        self.assertFalse(independent[0, 3])
+        self.assertFalse(independent[1, 2])
+
+    def test_min_swap_sequences(self):
+        for (n, swaps) in min_swap_sequences.items():
+            self.assertEqual(len(swaps), min_swaps[n])
+            self.assertTrue(is_covering_sequence(n, swaps))
+
+    def test_known_min_swaps(self):
+        for use_transposition_table in (False, True):
+            for n in range(4, 9):
+                solver = BranchAndBoundSolver(n, use_transposition_table)
+                solution = solver.solve(min_swaps[n])
+                self.assertEqual(len(solution), min_swaps[n])
+                self.assertIsNone(solver.solve(min_swaps[n] - 1))
+
+    def test_lower_bound(self):
+        solver = BranchAndBoundSolver(10)
+        friend_pairs = FriendMatrix.from_seating_arrangement(list(range(10)))
+        self.assertEqual(solver.lower_bound(friend_pairs), 9)
+        # everyone but person 0 is friends with everyone else.
+        friend_pairs = FriendMatrix(
+            10, [(p_a, p_b) for (p_a, p_b) in solver.swaps if p_a != 0]
+        )
+        friend_pairs.update([(0, 1), (0, 9)])
+        self.assertEqual(solver.lower_bound(friend_pairs), 4)
+
+    def test_prove(self):
+        (swaps, certificate) = BranchAndBoundSolver(8).prove()
+        self.assertEqual(len(swaps), min_swaps[8])
+        self.assertEqual(
+            [d["result"] for d in certificate["depths"]], ["no solution", "solution"]
+        )
+        self.assertTrue(verify_certificate(certificate))
+        certificate["depths"][0]["nodes"] += 1
+        self.assertFalse(verify_certificate(certificate))
+
+
+class TestTableStateCanonicalizer(unittest.TestCase):
+    def test_equivalent_states(self):
+        n = 7
+        swaps = list(itertools.combinations(range(n), 2))
+        canonicalizer = TableStateCanonicalizer(swaps, n)
+        seating = np.array([3, 0, 6, 1, 5, 2, 4])
+        friend_pairs = FriendMatrix.from_seating_arrangement(list(range(n)))
+        friend_pairs.update(FriendMatrix.from_seating_arrangement(list(seating)))
+        (key, _) = canonicalizer.canonicalize(seating, friend_pairs)
+
+        # rotating and reflecting the seats gives an equivalent state.
+        (rotated_key, _) = canonicalizer.canonicalize(
+            np.roll(seating[::-1], 2), friend_pairs
+        )
+        self.assertEqual(rotated_key, key)
+
+        # as does relabelling the people.
+        relabelling = np.array([2, 5, 0, 6, 1, 4, 3])
+        relabelled_friend_pairs = FriendMatrix(
+            n, [(relabelling[p_a], relabelling[p_b]) for (p_a, p_b) in friend_pairs]
+        )
+        (relabelled_key, _) = canonicalizer.canonicalize(
+            relabelling[seating], relabelled_friend_pairs
+        )
+        self.assertEqual(relabelled_key, key)
+
+        friend_pairs.add((0, 2))
+        (other_key, _) = canonicalizer.canonicalize(seating, friend_pairs)
+        self.assertNotEqual(other_key, key)
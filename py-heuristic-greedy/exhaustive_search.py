@@ -1,74 +1,126 @@
 #!/usr/bin/env python3
 
 import argparse
-import itertools
+import time
 
-import tqdm
+from tqdm import tqdm
 
-from constants import min_swaps
-from util import all_friend_pairs, new_friend_pairs
+from exact_solver import BranchAndBoundSolver, write_certificate
+from results_index import ResultsIndex, known_min_swaps
+from sharded_solver import DEFAULT_SHARD_MAX_NODES, ShardedSolver
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="""
-        Check every possible sequence of swaps for a table of the specified size, 
-        counting the number of results that match the minimum number of swaps required
-        and displays one such sequence of swaps at the end.
+        Search every possible sequence of swaps for a table of the specified size,
+        pruning sequences that cannot beat the shortest sequence found so far, and
+        display a shortest sequence of swaps making everyone friends. Since the
+        search is exhaustive, this proves that no shorter sequence exists.
         """,
     )
     parser.add_argument("table_size", type=int, help="Number of people at the table.")
+    parser.add_argument(
+        "--no-transposition-table",
+        action="store_true",
+        help="""If specified, do not prune states equivalent (up to rotation or
+        reflection of the seats and relabelling of the people) to states that have
+        already been searched.
+        """,
+    )
+    parser.add_argument(
+        "--prove",
+        action="store_true",
+        help="""If specified, search depth by depth upwards from a lower bound on the
+        number of swaps required rather than downwards from the known upper bound,
+        and write a certificate recording the search at every depth to the
+        certificates directory.
+        """,
+    )
+    parser.add_argument(
+        "--shard-depth",
+        type=int,
+        help="""If specified, split the search into shards, one for each sequence of
+        this many swaps (up to equivalence), searched in parallel by --workers
+        processes sharing the best sequence found. Finished shards are recorded in
+        the shards directory, so that an interrupted search can be resumed by running
+        it again.
+        """,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes searching shards, with --shard-depth.",
+    )
+    parser.add_argument(
+        "--shard-max-nodes",
+        type=int,
+        default=DEFAULT_SHARD_MAX_NODES,
+        help="""Number of nodes searched in a shard before splitting it into shards
+        one swap deeper, with --shard-depth (default: %(default)s).
+        """,
+    )
     args = parser.parse_args()
+    if args.shard_depth is not None and args.prove:
+        parser.error("--prove searches depth by depth, and cannot be sharded")
 
     table_size = args.table_size
-    # we start with a known upper bound on the number of swaps required.
-    current_min_swap_count = min_swaps.get(
-        table_size, table_size * (table_size - 1) // 2
-    )
-    all_possible_swaps = itertools.combinations(range(table_size), 2)
-
-    initial_seating_arrangement = list(range(table_size))
-    initial_friend_pairs = all_friend_pairs(initial_seating_arrangement)
+    # we start with a known upper bound on the number of swaps required, including the
+    # sequences found by the heuristic searches so far.
+    current_min_swap_count = known_min_swaps(table_size, ResultsIndex())
+    if current_min_swap_count is None:
+        current_min_swap_count = table_size * (table_size - 1) // 2
 
-    pbar = tqdm.tqdm(
-        itertools.product(all_possible_swaps, repeat=current_min_swap_count)
+    solver = BranchAndBoundSolver(
+        table_size, use_transposition_table=not args.no_transposition_table
     )
-
-    min_swap_count = current_min_swap_count
-    covering_swaps = None
-    num_distinct_solutions = 0
-
-    for candidate_swaps in pbar:
-        pbar.set_description(
-            "min swaps: {}, distinct solns: {}".format(
-                min_swap_count, num_distinct_solutions
+    start_time = time.time()
+    if args.prove:
+        (covering_swaps, certificate) = solver.prove(current_min_swap_count)
+        for d in certificate["depths"]:
+            print(
+                "Depth {depth}: {result} ({nodes} nodes, {transpositions} pruned as equivalent, {seconds} seconds).".format(
+                    **d
+                )
             )
+        print("Certificate written to {}.".format(write_certificate(certificate)))
+    elif args.shard_depth is not None:
+        sharded_solver = ShardedSolver(
+            table_size,
+            current_min_swap_count,
+            shard_depth=args.shard_depth,
+            use_transposition_table=not args.no_transposition_table,
+            max_nodes=args.shard_max_nodes,
         )
-        seating_arrangement = initial_seating_arrangement[::]
-        existing_friend_pairs = initial_friend_pairs.copy()
-        num_total_friend_pairs = table_size * (table_size - 1) / 2
-
-        for (t, swap) in enumerate(candidate_swaps):
-            (i, j) = swap
-            nfp = new_friend_pairs(seating_arrangement, existing_friend_pairs, swap)
-            p_i = seating_arrangement[i]
-            p_j = seating_arrangement[j]
-            seating_arrangement[j] = p_i
-            seating_arrangement[i] = p_j
-            existing_friend_pairs = existing_friend_pairs.union(nfp)
-            if len(existing_friend_pairs) == num_total_friend_pairs:
-                if t + 1 < min_swap_count or covering_swaps is None:
-                    min_swap_count = t + 1
-                    covering_swaps = candidate_swaps[: t + 1]
-                    num_distinct_solutions = 0
-                else:
-                    num_distinct_solutions += 1
-                pbar.set_description(
-                    "min swaps: {}, distinct solns: {}".format(
-                        min_swap_count, num_distinct_solutions
-                    )
+        with tqdm(unit="shard") as pbar:
+            covering_swaps = sharded_solver.solve(args.workers, pbar)
+        print(
+            "Searched {} nodes in {} shards in {:.2f} seconds.".format(
+                sharded_solver.nodes, pbar.total, time.time() - start_time
+            )
+        )
+    else:
+        covering_swaps = solver.solve(current_min_swap_count)
+        print(
+            "Searched {} nodes in {:.2f} seconds.".format(
+                solver.nodes, time.time() - start_time
+            )
+        )
+        if solver.use_transposition_table:
+            print(
+                "Pruned {} nodes ({:.1%}) as equivalent to one of the {} states already searched.".format(
+                    solver.transpositions,
+                    solver.transpositions / solver.nodes,
+                    len(solver.transposition_table),
                 )
-                break
-
-    pbar.close()
+            )
 
-    print("Covering swaps: {}".format(covering_swaps))
+    if covering_swaps is None:
+        print(
+            "No sequence of at most {} swaps makes everyone friends.".format(
+                current_min_swap_count
+            )
+        )
+    else:
+        print("Min swaps: {}".format(len(covering_swaps)))
+        print("Covering swaps: {}".format(covering_swaps))
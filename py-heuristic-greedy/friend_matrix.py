@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+
+from util import all_friend_pairs, new_friend_pairs, num_new_friend_pairs
+
+
+class FriendMatrix(object):
+    """
+    Compact, mutable record of which pairs of individuals are friends, intended as a
+    drop-in replacement for a set of sorted pairs: it supports `in`, `len`, `add` and
+    `update`, so it can be passed to the functions in util.py directly.
+
+    Friendships are stored in an n x n numpy.uint8 matrix, so that matrix[p_a, p_b] is 1
+    if p_a and p_b are friends and 0 otherwise. The matrix is symmetric, so that it can be
+    indexed directly by the labels of individuals in vectorized code. The number of
+    friend pairs is tracked as pairs are added, so that counting them is O(1).
+    """
+
+    def __init__(self, n, friend_pairs=()):
+        """
+        :param n: Number of individuals at the table.
+        :param friend_pairs: iterable of pairs of integers representing pairs of
+        individuals who are already friends.
+        """
+        self.n = n
+        # the bytearray backs the matrix; indexing it directly is much faster than
+        # indexing the matrix from Python.
+        self.flags = bytearray(n * n)
+        self.matrix = np.frombuffer(self.flags, dtype=np.uint8).reshape(n, n)
+        self.num_friend_pairs = 0
+        self.update(friend_pairs)
+
+    @classmethod
+    def from_seating_arrangement(cls, seating_arrangement):
+        """
+        :param seating_arrangement: List of ints representing the seating arrangement
+        around a circular table.
+        :return: FriendMatrix containing the pairs of individuals sitting next to each
+        other in seating_arrangement.
+        """
+        return cls(len(seating_arrangement), all_friend_pairs(seating_arrangement))
+
+    def __contains__(self, pair):
+        (p_a, p_b) = pair
+        return self.flags[p_a * self.n + p_b] != 0
+
+    def __len__(self):
+        return self.num_friend_pairs
+
+    def __iter__(self):
+        (p_a, p_b) = np.nonzero(np.triu(self.matrix))
+        return zip(p_a.tolist(), p_b.tolist())
+
+    def add(self, pair):
+        (p_a, p_b) = pair
+        if not self.flags[p_a * self.n + p_b]:
+            self.flags[p_a * self.n + p_b] = 1
+            self.flags[p_b * self.n + p_a] = 1
+            self.num_friend_pairs += 1
+
+    def discard(self, pair):
+        (p_a, p_b) = pair
+        if self.flags[p_a * self.n + p_b]:
+            self.flags[p_a * self.n + p_b] = 0
+            self.flags[p_b * self.n + p_a] = 0
+            self.num_friend_pairs -= 1
+
+    def update(self, pairs):
+        for pair in pairs:
+            self.add(pair)
+
+    def copy(self):
+        c = FriendMatrix(self.n)
+        c.flags[:] = self.flags
+        c.num_friend_pairs = self.num_friend_pairs
+        return c
+
+
+class TestFriendMatrix(unittest.TestCase):
+    def setUp(self):
+        self.sa = list(range(10))
+        self.fp = all_friend_pairs(self.sa)
+        self.fm = FriendMatrix.from_seating_arrangement(self.sa)
+
+    def test_matches_set(self):
+        self.assertEqual(len(self.fm), len(self.fp))
+        self.assertEqual(set(self.fm), self.fp)
+        self.assertIn((0, 9), self.fm)
+        self.assertIn((9, 0), self.fm)
+        self.assertNotIn((0, 2), self.fm)
+
+    def test_add_is_idempotent(self):
+        self.fm.add((0, 2))
+        self.fm.add((0, 2))
+        self.assertEqual(len(self.fm), len(self.fp) + 1)
+        self.assertEqual(self.fm.matrix[2, 0], 1)
+
+    def test_discard(self):
+        self.fm.discard((0, 1))
+        self.fm.discard((0, 1))
+        self.assertEqual(len(self.fm), len(self.fp) - 1)
+        self.assertNotIn((1, 0), self.fm)
+
+    def test_num_new_friend_pairs(self):
+        for swap in [(0, 0), (0, 1), (0, 5), (0, 9), (3, 7)]:
+            self.assertEqual(
+                num_new_friend_pairs(self.sa, self.fm, swap),
+                num_new_friend_pairs(self.sa, self.fp, swap),
+            )
+            self.assertEqual(
+                new_friend_pairs(self.sa, self.fm, swap),
+                new_friend_pairs(self.sa, self.fp, swap),
+            )
@@ -0,0 +1,225 @@
+import heapq
+import random
+import unittest
+
+import numpy as np
+
+from friend_matrix import FriendMatrix
+from util import all_friend_pairs, new_friend_pair_counts, num_new_friend_pairs
+
+# a swap moves two people, each of whom can sit next to at most two new friends.
+MAX_GAIN = 4
+
+
+class SwapGainTable(object):
+    """
+    Stores the number of new friend pairs (the "gain") generated by every possible swap,
+    and keeps swaps bucketed by gain so that the swaps with the largest gain can be
+    retrieved in O(1).
+
+    After a swap is carried out, only the swaps touching the two swapped seats or their
+    neighbours can change gain, so only those O(n) swaps are re-evaluated (in a single
+    vectorized pass).
+
+    Ties are broken the same way as the original full scan over the (randomly shuffled)
+    list of swaps: the first swap in the list with gain MAX_GAIN is chosen if there is
+    one, and otherwise a swap with the largest gain is chosen uniformly at random.
+    """
+
+    def __init__(self, seating_arrangement, existing_friend_pairs, swaps, rng=random):
+        """
+        :param seating_arrangement: list of ints representing the seating arrangement
+        around a circular table.
+        :param existing_friend_pairs: FriendMatrix of the pairs of individuals who are
+        already friends.
+        :param swaps: list of pairs of integers representing the positions (not IDs!) of
+        the people we could swap; every pair of distinct seats must appear exactly once.
+        :param rng: random.Random used to break ties (by default, the global generator).
+        """
+        self.n = len(seating_arrangement)
+        self.rng = rng
+        self.swaps = swaps
+        (self.first, self.second) = np.array(swaps, dtype=np.intp).reshape(-1, 2).T
+        # numpy array of the gain of each swap, in the same order as self.swaps.
+        self.gains = new_friend_pair_counts(
+            np.array(seating_arrangement),
+            existing_friend_pairs.matrix,
+            self.first,
+            self.second,
+        )
+        # number of times the gain of a swap has been evaluated.
+        self.num_evaluated = len(swaps)
+
+        # indices (into self.swaps) of the swaps that involve each seat; as every seat
+        # is involved in exactly n - 1 swaps, these form an n x (n - 1) array.
+        seats = np.concatenate([self.first, self.second])
+        order = np.argsort(seats, kind="stable")
+        self.swaps_at_seat = np.tile(np.arange(len(swaps)), 2)[order].reshape(
+            self.n, -1
+        )
+
+        self.buckets = []
+        # index of each swap within its bucket, so that it can be removed in O(1).
+        bucket_positions = np.empty(len(swaps), dtype=np.intp)
+        for gain in range(MAX_GAIN + 1):
+            bucket = np.flatnonzero(self.gains == gain)
+            bucket_positions[bucket] = np.arange(len(bucket))
+            self.buckets.append(bucket.tolist())
+        self.bucket_positions = bucket_positions.tolist()
+
+        # heap of the indices of swaps that have (or once had) gain MAX_GAIN; stale
+        # entries are discarded lazily when looking for the first such swap.
+        self.max_gain_heap = list(self.buckets[MAX_GAIN])
+        heapq.heapify(self.max_gain_heap)
+
+    def _add_to_bucket(self, k, gain):
+        bucket = self.buckets[gain]
+        self.bucket_positions[k] = len(bucket)
+        bucket.append(k)
+
+    def _remove_from_bucket(self, k, gain):
+        # move the last element of the bucket into the slot vacated by k.
+        bucket = self.buckets[gain]
+        last = bucket.pop()
+        if last != k:
+            position = self.bucket_positions[k]
+            bucket[position] = last
+            self.bucket_positions[last] = position
+
+    def affected_swaps(self, swap):
+        """ Determines the swaps whose gain may change when swap is carried out.
+
+        :param swap: pair of integers representing the positions of the people swapped.
+        :return: numpy array of indices (into self.swaps) of the affected swaps.
+        """
+        (i, j) = swap
+        seats = np.array([i - 1, i, i + 1, j - 1, j, j + 1]) % self.n
+        return np.unique(self.swaps_at_seat[seats])
+
+    def update(self, seating_arrangement, existing_friend_pairs, swap):
+        """ Updates the gains after swap has been carried out.
+
+        :param seating_arrangement: seating arrangement after the swap.
+        :param existing_friend_pairs: FriendMatrix of friend pairs after the swap.
+        :param swap: pair of integers representing the positions of the people swapped.
+        """
+        affected = self.affected_swaps(swap)
+        self.num_evaluated += len(affected)
+        new_gains = new_friend_pair_counts(
+            np.array(seating_arrangement),
+            existing_friend_pairs.matrix,
+            self.first[affected],
+            self.second[affected],
+        )
+        changed = new_gains != self.gains[affected]
+        affected = affected[changed]
+        new_gains = new_gains[changed]
+
+        for (k, old_gain, gain) in zip(
+            affected.tolist(), self.gains[affected].tolist(), new_gains.tolist()
+        ):
+            self._remove_from_bucket(k, old_gain)
+            self._add_to_bucket(k, gain)
+            if gain == MAX_GAIN:
+                heapq.heappush(self.max_gain_heap, k)
+        self.gains[affected] = new_gains
+
+    def best_gain(self):
+        for gain in range(MAX_GAIN, 0, -1):
+            if self.buckets[gain]:
+                return gain
+        return 0
+
+    def best_swaps(self):
+        """
+        :return: list of indices (into self.swaps) of the swaps with the largest gain.
+        Callers should not mutate the list.
+        """
+        return self.buckets[self.best_gain()]
+
+    def first_max_gain_swap(self):
+        """
+        :return: index (into self.swaps) of the first swap with gain MAX_GAIN, or None if
+        there is no such swap.
+        """
+        heap = self.max_gain_heap
+        while heap and self.gains[heap[0]] != MAX_GAIN:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def sample_weighted_swap(self, gain_weights):
+        """ Samples a swap with probability proportional to the weight of its gain.
+
+        As there are only MAX_GAIN + 1 possible gains, we pick a gain with probability
+        proportional to its weight times the number of swaps with that gain, and then pick
+        uniformly among the swaps with that gain, which takes O(1) rather than O(n^2).
+
+        :param gain_weights: sequence of the (non-negative) weight of each gain, not all
+        of which may be zero for gains that some swap has.
+        :return: the sampled swap.
+        """
+        class_weights = [w * len(b) for (w, b) in zip(gain_weights, self.buckets)]
+        r = self.rng.random() * sum(class_weights)
+        for (gain, class_weight) in enumerate(class_weights):
+            if r < class_weight:
+                break
+            r -= class_weight
+        # guard against floating point error leaving r at (or just past) the total.
+        while not class_weights[gain]:
+            gain -= 1
+        return self.swaps[self.rng.choice(self.buckets[gain])]
+
+    def sample_best_swap(self):
+        """
+        :return: A swap with the largest gain, chosen as described in the class docstring.
+        """
+        k = self.first_max_gain_swap()
+        if k is None:
+            k = self.rng.choice(self.best_swaps())
+        return self.swaps[k]
+
+
+class TestSwapGainTable(unittest.TestCase):
+    def setUp(self):
+        self.sa = list(range(10))
+        self.fp = FriendMatrix.from_seating_arrangement(self.sa)
+        self.swaps = [(i, j) for i in range(10) for j in range(i + 1, 10)]
+        random.Random(0).shuffle(self.swaps)
+        self.table = SwapGainTable(self.sa, self.fp, self.swaps)
+
+    def assertGainsMatchFullRescan(self):
+        for (k, swap) in enumerate(self.swaps):
+            self.assertEqual(
+                self.table.gains[k], num_new_friend_pairs(self.sa, self.fp, swap)
+            )
+            self.assertIn(k, self.table.buckets[self.table.gains[k]])
+
+    def test_initial_best_gain(self):
+        self.assertEqual(self.table.best_gain(), 4)
+        self.assertGainsMatchFullRescan()
+
+    def test_first_max_gain_swap(self):
+        self.assertEqual(
+            self.table.first_max_gain_swap(), self.table.gains.tolist().index(4)
+        )
+
+    def test_sample_weighted_swap(self):
+        # only swaps with gain 2 have any weight.
+        for _ in range(20):
+            k = self.swaps.index(self.table.sample_weighted_swap([0, 0, 1, 0, 0]))
+            self.assertEqual(self.table.gains[k], 2)
+
+    def test_update_matches_full_rescan(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            swap = rng.choice(self.swaps)
+            (i, j) = swap
+            self.sa[i], self.sa[j] = self.sa[j], self.sa[i]
+            self.fp.update(all_friend_pairs(self.sa))
+            self.table.update(self.sa, self.fp, swap)
+            self.assertGainsMatchFullRescan()
+            if 4 in self.table.gains:
+                self.assertEqual(
+                    self.table.first_max_gain_swap(),
+                    self.table.gains.tolist().index(4),
+                )
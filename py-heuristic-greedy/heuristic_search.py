@@ -1,11 +1,30 @@
 #!/usr/bin/env python3
 
 import argparse
+import cProfile
+import functools
 import os
-import pickle
+import time
 
-from swapper import nameToSwapper
-from swapper_util import SwapperRunner, get_checkpoint_file
+from checkpoint import (
+    Checkpoint,
+    DEFAULT_MAX_STORED_SEQUENCES,
+    has_checkpoint,
+)
+from results_index import ResultsIndex
+from swapper import GreedySwapper
+from swapper_util import (
+    RunStats,
+    SwapperRunner,
+    add_swapper_arguments,
+    format_run_stats,
+    get_checkpoint_file,
+    get_configured_swapper,
+    get_log_directory,
+    get_swapper_name,
+    regenerate_trial,
+)
+from trial_results import ColumnarWriter, Histogram, JsonlWriter
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -20,13 +39,7 @@ if __name__ == "__main__":
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     parser.add_argument("table_size", type=int, help="Number of people at the table.")
-    parser.add_argument(
-        "--swapper",
-        type=lambda x: nameToSwapper[x],
-        help="Swapper that selects the next swap to attempt.",
-        default="GreedySwapper",
-        choices=list(nameToSwapper.keys()),
-    )
+    add_swapper_arguments(parser, "Swapper that selects the next swap to attempt.")
     parser.add_argument(
         "--info",
         action="store_true",
@@ -37,28 +50,187 @@ if __name__ == "__main__":
     parser.add_argument(
         "--num-trials", type=int, help="Number of trials to run.", default=10000,
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="""Number of processes to run trials in. Workers share the high
+        score, so that every trial can terminate early against the best score
+        found so far by any worker.
+        """,
+        default=1,
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="""If specified, run GreedySwapper trials on batches of this many
+        tables at once, advancing every table in a batch with vectorized
+        operations; much faster than running trials one at a time on small
+        tables.
+        """,
+    )
+    parser.add_argument(
+        "--count-stats",
+        action="store_true",
+        help="""If specified, count the time spent choosing swaps, carrying them
+        out, solving endgames, writing checkpoints and updating the progress bar,
+        along with the candidate swaps evaluated per swap and the fraction of
+        trials given up early. Counters are written to the log and (summed over
+        runs) to the checkpoint, and shown by --info.
+        """,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="""If specified, profile the run with cProfile, writing the stats
+        (to be read with pstats) to the log directory.
+        """,
+    )
+    parser.add_argument(
+        "--max-stored-sequences",
+        type=int,
+        help="""Maximum number of swap sequences achieving the high score to store
+        in the checkpoint; a uniform random sample is kept, along with the exact
+        number of trials achieving the high score.
+        """,
+        default=DEFAULT_MAX_STORED_SEQUENCES,
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="""Seed of the run: each trial is driven by a generator derived from
+        the seed and its index, so that the checkpoint stores the trials tying the
+        high score by their seed and index, and regenerates their swaps when read
+        (trials with --endgame-threshold or --batch-size are stored in full). If
+        not specified, a fresh seed is drawn for each run.
+        """,
+    )
+    parser.add_argument(
+        "--histogram",
+        action="store_true",
+        help="""If specified, print the distribution of the number of swaps of the
+        trials that finished (rather than being cut off early) after the run.
+        """,
+    )
+    parser.add_argument(
+        "--results-jsonl",
+        help="""If specified, append the result of every trial (index, number of
+        swaps, whether it was cut off early) to this file, as a line of JSON.
+        """,
+    )
+    parser.add_argument(
+        "--results-columns",
+        help="""If specified, append the result of every trial to raw arrays of the
+        trial indices and numbers of swaps (-1 if cut off early) in this directory,
+        to be read with trial_results.read_columns.
+        """,
+    )
     args = parser.parse_args()
+    args.swapper = get_configured_swapper(parser, args)
+    if args.batch_size is not None and (
+        args.swapper is not GreedySwapper
+        or args.endgame_threshold is not None
+        or args.workers > 1
+    ):
+        parser.error(
+            "--batch-size can only be used with GreedySwapper, without "
+            "--endgame-threshold or --workers."
+        )
 
     if args.info:
-        cp_file = get_checkpoint_file(args.swapper, args.table_size)
-        if os.path.isfile(cp_file):
-            with open(cp_file, "rb") as f:
-                # some legacy pickle files have 3 fields; the third is extraneous
-                [i, best_swap_sequences] = pickle.load(f)[:2]
+        cp_file = get_checkpoint_file(
+            args.swapper, args.table_size, args.endgame_threshold
+        )
+        swapper_name = get_swapper_name(args.swapper, args.endgame_threshold)
+        index = ResultsIndex()
+        result = index.get(swapper_name, args.table_size)
+        if has_checkpoint(cp_file):
+            # reading the checkpoint replays the ties logged since its last snapshot,
+            # which the index only catches up with when the snapshot is next written.
+            cp = Checkpoint(
+                cp_file,
+                regenerate_trial=functools.partial(
+                    regenerate_trial, args.swapper, args.table_size
+                ),
+            )
+            index.record_checkpoint(cp)
+            result = index.get(swapper_name, args.table_size)
             print(
                 "\nCollecting log information when running {} on a table of size {}.".format(
-                    args.swapper, args.table_size
+                    swapper_name, args.table_size,
                 )
             )
             print(
                 "Trials at checkpoint: {}, high score: {}.".format(
-                    i, len(best_swap_sequences[0][1])
+                    result.trials, result.best_length
+                )
+            )
+            print("Trials achieving high score: {}.".format(result.num_ties))
+            print(
+                "Swap sequences stored: {}, in {}.".format(
+                    result.num_stored, result.checkpoint_file
                 )
             )
-            print("Trials achieving high score: {}.".format(len(best_swap_sequences)))
-            if len(best_swap_sequences) > 0:
-                print("Sample swap sequence: {}".format(best_swap_sequences[0][1]))
+            if result.trials_per_second:
+                print(
+                    "Throughput of the last run: {:.0f} trials/s.".format(
+                        result.trials_per_second
+                    )
+                )
+            if result.num_stored > 0:
+                (_, swaps) = next(cp.swap_sequences())
+                print("Sample swap sequence: {}".format(swaps))
+            if "run_stats" in cp.metadata:
+                print("Run counters, summed over runs with --count-stats:")
+                summary = RunStats(cp.metadata["run_stats"]).summary()
+                print("\n".join(format_run_stats(summary)))
         else:
             print("No checkpoint file found.")
+            if result is not None:
+                print(
+                    "The results index has a stale entry for {}, removed since: "
+                    "{} trials, high score {}.".format(
+                        result.checkpoint_file, result.trials, result.best_length
+                    )
+                )
     else:
-        SwapperRunner(args.swapper, args.table_size).run(args.num_trials)
+        runner = SwapperRunner(
+            args.swapper,
+            args.table_size,
+            args.max_stored_sequences,
+            args.endgame_threshold,
+            args.count_stats,
+            args.seed,
+        )
+        consumers = []
+        if args.histogram:
+            consumers.append(Histogram())
+        if args.results_jsonl:
+            consumers.append(JsonlWriter(args.results_jsonl))
+        if args.results_columns:
+            consumers.append(ColumnarWriter(args.results_columns))
+        profile = cProfile.Profile() if args.profile else None
+        if profile:
+            profile.enable()
+        try:
+            runner.run(
+                args.num_trials,
+                workers=args.workers,
+                batch_size=args.batch_size,
+                consumers=consumers,
+            )
+        finally:
+            # the results written so far are kept if the run is interrupted.
+            for consumer in consumers:
+                if not isinstance(consumer, Histogram):
+                    consumer.close()
+        for consumer in consumers:
+            if isinstance(consumer, Histogram):
+                print("\n".join(consumer.describe()))
+        if profile:
+            profile.disable()
+            profile_file = os.path.join(
+                get_log_directory(args.swapper, args.endgame_threshold),
+                "{}-{}.pstats".format(args.table_size, time.strftime("%Y%m%d-%H%M%S")),
+            )
+            profile.dump_stats(profile_file)
+            print("Profile written to {}.".format(profile_file))
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import itertools
+import math
+import random
+import time
+import unittest
+
+from checkpoint import Checkpoint, has_checkpoint
+from exact_solver import BranchAndBoundSolver, is_covering_sequence
+from results_index import ResultsIndex
+from sequence_evaluator import SequenceEvaluator
+from swapper_util import (
+    add_swapper_arguments,
+    get_checkpoint_file,
+    get_configured_swapper,
+    get_swapper_name,
+    regenerate_trial,
+)
+from util import all_friend_pairs
+
+
+def permutation_cycles(seating_arrangement, target_seating_arrangement):
+
+    """ Determines the cycles of the permutation of seats taking one seating arrangement
+    to another; the fewest swaps doing so is n minus the number of cycles.
+
+    :param seating_arrangement: list of ints representing a seating arrangement.
+    :param target_seating_arrangement: list of ints representing a seating arrangement of
+    the same people.
+    :return: list of lists of seats, one for each cycle of length at least 2.
+    """
+
+    seat_of = {p: s for (s, p) in enumerate(seating_arrangement)}
+    seen = set()
+    cycles = []
+    for start in range(len(seating_arrangement)):
+        cycle = []
+        s = start
+        while s not in seen:
+            seen.add(s)
+            cycle.append(s)
+            s = seat_of[target_seating_arrangement[s]]
+        if len(cycle) >= 2:
+            cycles.append(cycle)
+    return cycles
+
+
+class SequenceImprover(object):
+    """
+    Shortens a sequence of swaps making everyone friends, by:
+
+      - cutting out swaps that can be removed with everyone still ending up friends,
+      - re-optimizing windows of the sequence exactly: the final swaps are replaced by a
+        shortest sequence completing the table (found with BranchAndBoundSolver), and
+        each interior window is replaced by a shortest sequence of swaps reaching the same
+        seating arrangement (so that the rest of the sequence is unaffected) while making
+        every friend pair the rest of the sequence relies on, and
+      - simulated annealing over edits to the sequence (deleting, replacing, inserting or
+        reordering swaps), penalizing pairs left without being friends.
+
+    Sequences are evaluated with a SequenceEvaluator, so that after an edit only the swaps
+    from the edit onwards are carried out.
+    """
+
+    def __init__(
+        self,
+        table_size,
+        window_size=5,
+        iterations=5000,
+        uncovered_penalty=0.5,
+        seed=None,
+    ):
+        """
+        :param table_size: Number of people at the table.
+        :param window_size: Largest window of swaps re-optimized exactly.
+        :param iterations: Number of edits attempted by simulated annealing.
+        :param uncovered_penalty: Cost, in swaps, of each pair left without being friends
+        during simulated annealing.
+        :param seed: seed for the random edits.
+        """
+        self.n = table_size
+        self.all_possible_swaps = list(itertools.combinations(range(table_size), 2))
+        self.window_size = window_size
+        self.iterations = iterations
+        self.uncovered_penalty = uncovered_penalty
+        self.rng = random.Random(seed)
+        self.evaluator = SequenceEvaluator(range(table_size))
+        # states deep into a sequence rarely recur, so a transposition table costs more
+        # than it saves.
+        self.solver = BranchAndBoundSolver(table_size, use_transposition_table=False)
+
+    def remove_redundant_swaps(self, swaps):
+        """ Cuts out swaps that can be removed with everyone still ending up friends,
+        trying the latest swaps first.
+
+        :param swaps: list of swaps making everyone friends.
+        :return: the shortened sequence.
+        """
+        # drop any swaps after everyone is already friends.
+        self.evaluator.evaluate([])
+        for swap in swaps:
+            if self.evaluator.is_everyone_friends():
+                break
+            self.evaluator.push(swap)
+        swaps = list(self.evaluator.swaps)
+        for k in range(len(swaps) - 1, -1, -1):
+            candidate = swaps[:k] + swaps[k + 1 :]
+            if self.evaluator.evaluate(candidate) == 0:
+                swaps = candidate
+        return swaps
+
+    def reoptimize_tail(self, swaps):
+        """ Replaces the final swaps by a shortest sequence completing the table, for each
+        tail of up to window_size swaps.
+
+        :return: the shortened sequence.
+        """
+        for w in range(2, min(self.window_size, len(swaps)) + 1):
+            k = len(swaps) - w
+            self.evaluator.evaluate(swaps[:k])
+            tail = self.solver.solve(
+                w - 1,
+                seating_arrangement=self.evaluator.seating_arrangement,
+                friend_pairs=self.evaluator.friend_pairs,
+            )
+            if tail is not None:
+                swaps = swaps[:k] + tail
+        return swaps
+
+    def reoptimize_windows(self, swaps):
+        """ Replaces each interior window of up to window_size swaps by a shortest sequence
+        of swaps reaching the same seating arrangement and making every friend pair that
+        the rest of the sequence relies on.
+
+        :return: the shortened sequence.
+        """
+        evaluator = self.evaluator
+        for w in range(2, self.window_size + 1):
+            a = 0
+            while a + w <= len(swaps):
+                b = a + w
+                evaluator.evaluate(swaps[:b])
+                target = list(evaluator.seating_arrangement)
+                evaluator.evaluate(swaps[:a])
+                cycles = permutation_cycles(evaluator.seating_arrangement, target)
+                # by parity, any shorter sequence reaching the same seating arrangement
+                # has at least 2 fewer swaps.
+                if sum(len(c) - 1 for c in cycles) <= w - 2:
+                    seating_arrangement = list(target)
+                    made_later = all_friend_pairs(seating_arrangement)
+                    for (i, j) in swaps[b:]:
+                        seating_arrangement[i], seating_arrangement[j] = (
+                            seating_arrangement[j],
+                            seating_arrangement[i],
+                        )
+                        made_later |= all_friend_pairs(seating_arrangement)
+                    needed = [
+                        pair
+                        for pair in itertools.combinations(range(self.n), 2)
+                        if pair not in made_later and pair not in evaluator.friend_pairs
+                    ]
+                    window = self._search_window(target, needed)
+                    if window is not None:
+                        swaps = swaps[:a] + window + swaps[b:]
+                a += 1
+        return swaps
+
+    def _search_window(self, target, needed):
+        # Searches the sequences of the fewest swaps taking the evaluator's seating
+        # arrangement to target (every swap splitting a cycle of the permutation between
+        # them) for one making all of the needed friend pairs, returning it or None.
+        evaluator = self.evaluator
+        cycles = permutation_cycles(evaluator.seating_arrangement, target)
+        num_uncovered = sum(1 for pair in needed if pair not in evaluator.friend_pairs)
+        if not cycles:
+            return [] if num_uncovered == 0 else None
+        if num_uncovered > 4 * sum(len(c) - 1 for c in cycles):
+            return None
+        for cycle in cycles:
+            for swap in itertools.combinations(sorted(cycle), 2):
+                evaluator.push(swap)
+                rest = self._search_window(target, needed)
+                evaluator.pop()
+                if rest is not None:
+                    return [swap] + rest
+        return None
+
+    def _cost(self, swaps):
+        num_uncovered = self.evaluator.evaluate(swaps)
+        return (len(swaps) + self.uncovered_penalty * num_uncovered, num_uncovered)
+
+    def _random_edit(self, swaps):
+        k = self.rng.randrange(len(swaps))
+        move = self.rng.randrange(4)
+        if move == 0:
+            return swaps[:k] + swaps[k + 1 :]
+        elif move == 1:
+            return swaps[:k] + [self.rng.choice(self.all_possible_swaps)] + swaps[k + 1 :]
+        elif move == 2:
+            return swaps[:k] + [self.rng.choice(self.all_possible_swaps)] + swaps[k:]
+        else:
+            k = min(k, len(swaps) - 2)
+            return swaps[:k] + [swaps[k + 1], swaps[k]] + swaps[k + 2 :]
+
+    def anneal(self, swaps, initial_temperature=1.0, final_temperature=0.05):
+        """ Searches edits to the sequence by simulated annealing, with the cost of a
+        sequence being its length plus uncovered_penalty for each pair left without being
+        friends, and the temperature decaying geometrically.
+
+        :return: the shortest sequence making everyone friends found.
+        """
+        best = swaps
+        (cost, _) = self._cost(swaps)
+        for t in range(self.iterations):
+            if len(swaps) < 2:
+                break
+            temperature = initial_temperature * (
+                final_temperature / initial_temperature
+            ) ** (t / max(1, self.iterations - 1))
+            candidate = self._random_edit(swaps)
+            (candidate_cost, num_uncovered) = self._cost(candidate)
+            if candidate_cost <= cost or self.rng.random() < math.exp(
+                (cost - candidate_cost) / temperature
+            ):
+                (swaps, cost) = (candidate, candidate_cost)
+                if num_uncovered == 0 and len(swaps) < len(best):
+                    best = swaps
+        return best
+
+    def improve(self, swaps):
+        """ Shortens a sequence of swaps making everyone friends, as described in the class
+        docstring.
+
+        :param swaps: list of swaps making everyone friends.
+        :return: list of swaps making everyone friends, no longer than swaps.
+        """
+        swaps = self.remove_redundant_swaps(list(swaps))
+        swaps = self.reoptimize_tail(swaps)
+        swaps = self.reoptimize_windows(swaps)
+        swaps = self.anneal(swaps)
+        return self.remove_redundant_swaps(swaps)
+
+
+class TestSequenceImprover(unittest.TestCase):
+    def setUp(self):
+        self.improver = SequenceImprover(8, iterations=200, seed=0)
+        self.swaps = [(0, 3), (4, 7), (0, 4), (2, 6), (1, 6), (2, 5)]
+        self.assertTrue(is_covering_sequence(8, self.swaps))
+
+    def test_remove_redundant_swaps(self):
+        # swaps after everyone is friends are cut.
+        swaps = self.improver.remove_redundant_swaps(self.swaps + [(0, 7), (1, 2)])
+        self.assertEqual(swaps, self.swaps)
+        # as is a swap inserted into a shortest sequence.
+        padded = self.swaps[:3] + [(3, 4)] + self.swaps[3:]
+        swaps = self.improver.remove_redundant_swaps(padded)
+        self.assertTrue(is_covering_sequence(8, swaps))
+        self.assertLess(len(swaps), len(padded))
+
+    def test_reoptimize_windows(self):
+        # a swap immediately undone is the same as no swap, and three swaps of the same
+        # pair are the same as one.
+        padded = (
+            self.swaps[:2]
+            + [(0, 7), (0, 7)]
+            + self.swaps[2:3]
+            + [self.swaps[3]] * 3
+            + self.swaps[4:]
+        )
+        swaps = self.improver.reoptimize_windows(padded)
+        self.assertEqual(swaps, self.swaps)
+
+    def test_improve(self):
+        padded = [(2, 5)] + self.swaps + [(3, 7), (1, 2)]
+        swaps = self.improver.improve(padded)
+        self.assertTrue(is_covering_sequence(8, swaps))
+        self.assertEqual(len(swaps), 6)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""
+        Shorten the swap sequences stored in a heuristic search checkpoint, by cutting
+        out redundant swaps, re-optimizing windows of each sequence exactly and
+        simulated annealing. Each sequence improved is a trial of its own checkpoint,
+        kept separately for each window size and number of iterations, so that the
+        checkpoint of the search is left as it was.
+        """,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("table_size", type=int, help="Number of people at the table.")
+    add_swapper_arguments(
+        parser, "Swapper whose checkpoint holds the sequences to improve."
+    )
+    parser.add_argument(
+        "--checkpoint-file",
+        help="""Path of the checkpoint holding the sequences to improve, overriding
+        --swapper and its options (e.g. for a beam search checkpoint).
+        """,
+    )
+    parser.add_argument(
+        "--window-size",
+        type=int,
+        help="Largest window of swaps re-optimized exactly.",
+        default=5,
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        help="Number of edits attempted by simulated annealing for each sequence.",
+        default=5000,
+    )
+    parser.add_argument("--seed", type=int, help="Random seed.")
+    args = parser.parse_args()
+    swapper = get_configured_swapper(parser, args)
+
+    cp_file = args.checkpoint_file or get_checkpoint_file(
+        swapper, args.table_size, args.endgame_threshold
+    )
+    if not has_checkpoint(cp_file):
+        parser.error("No checkpoint file found.")
+    # trials stored by their seed are regenerated with the swapper that ran them.
+    checkpoint = Checkpoint(
+        cp_file,
+        regenerate_trial=functools.partial(regenerate_trial, swapper, args.table_size),
+    )
+    if checkpoint.table_size != args.table_size:
+        parser.error(
+            "{} holds sequences for a table of size {}, not {}.".format(
+                cp_file, checkpoint.table_size, args.table_size
+            )
+        )
+    # checkpoints for each configuration of the improver are kept separately.
+    improver_config = functools.partial(
+        SequenceImprover, window_size=args.window_size, iterations=args.iterations
+    )
+    improved_checkpoint = Checkpoint(
+        get_checkpoint_file(improver_config, args.table_size)
+    )
+    improver = improver_config(args.table_size, seed=args.seed)
+
+    stored = list(checkpoint.swap_sequences())
+    print(
+        "Improving {} sequences of {} swaps from {}.".format(
+            len(stored), checkpoint.min_swap_num, cp_file
+        )
+    )
+    k = improved_checkpoint.trials
+    run_start_time = time.time()
+    for (i, swaps) in stored:
+        k += 1
+        shortened = improver.improve(swaps)
+        assert is_covering_sequence(args.table_size, shortened)
+        if len(shortened) < len(swaps):
+            print("Trial #{}: {} -> {} swaps.".format(i, len(swaps), len(shortened)))
+        if (
+            improved_checkpoint.min_swap_num is None
+            or len(shortened) < improved_checkpoint.min_swap_num
+        ):
+            improved_checkpoint.new_high_score(k, k, shortened)
+        elif len(shortened) == improved_checkpoint.min_swap_num:
+            improved_checkpoint.add_tie(k, shortened)
+    improved_checkpoint.write(k)
+    ResultsIndex().record_checkpoint(
+        improved_checkpoint, len(stored) / (time.time() - run_start_time)
+    )
+    print(
+        "{}: best {}, seen in {}/{} sequences.".format(
+            get_swapper_name(improver_config),
+            improved_checkpoint.min_swap_num,
+            improved_checkpoint.num_ties,
+            improved_checkpoint.trials,
+        )
+    )
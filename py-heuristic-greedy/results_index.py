@@ -0,0 +1,225 @@
+import collections
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from checkpoint import (
+    Checkpoint,
+    CHECKPOINT_EXTENSION,
+    LEGACY_CHECKPOINT_EXTENSION,
+    read_checkpoint_header,
+)
+from constants import CHECKPOINT_DIR, RESULTS_INDEX_FILE, min_swaps
+
+IndexedResult = collections.namedtuple(
+    "IndexedResult",
+    [
+        "swapper",
+        "table_size",
+        "trials",
+        "best_length",
+        "num_ties",
+        "num_stored",
+        "trials_per_second",
+        "checkpoint_file",
+        "updated",
+    ],
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    swapper TEXT NOT NULL,
+    table_size INTEGER NOT NULL,
+    trials INTEGER NOT NULL,
+    best_length INTEGER,
+    num_ties INTEGER NOT NULL,
+    num_stored INTEGER NOT NULL,
+    trials_per_second REAL,
+    checkpoint_file TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (swapper, table_size)
+);
+CREATE INDEX IF NOT EXISTS results_by_table_size ON results (table_size, best_length);
+"""
+
+
+class ResultsIndex(object):
+    """
+    SQLite index of the checkpoints of every swapper (named after its checkpoint
+    directory, see swapper_util.get_swapper_name) and table size: trials run, high score,
+    number of trials tying it, throughput of the last run, and the checkpoint holding the
+    stored sequences. Runners update their row whenever they write a checkpoint, so that
+    summaries are answered by a query rather than by reading every checkpoint.
+    """
+
+    def __init__(self, path=RESULTS_INDEX_FILE):
+        """
+        :param path: path of the SQLite database, created if it does not exist.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # several runners may update the index at once; SQLite serializes the writes.
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.executescript(SCHEMA)
+
+    def record(
+        self,
+        swapper,
+        table_size,
+        trials,
+        best_length,
+        num_ties,
+        num_stored,
+        checkpoint_file,
+        trials_per_second=None,
+    ):
+        """ Records the state of a checkpoint, replacing any previous row for it.
+
+        :param trials_per_second: throughput of the last run, if known; otherwise that of
+        the previous row (if any) is kept.
+        """
+        with self.connection:
+            if trials_per_second is None:
+                previous = self.get(swapper, table_size)
+                if previous is not None:
+                    trials_per_second = previous.trials_per_second
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    swapper,
+                    table_size,
+                    trials,
+                    best_length,
+                    num_ties,
+                    num_stored,
+                    trials_per_second,
+                    os.path.abspath(checkpoint_file),
+                    time.time(),
+                ),
+            )
+
+    def record_checkpoint(self, checkpoint, trials_per_second=None):
+        """ Records the state of a Checkpoint, under the name of its directory.
+
+        :param checkpoint: Checkpoint
+        :param trials_per_second: throughput of the last run, if known.
+        """
+        self.record(
+            os.path.basename(os.path.dirname(os.path.abspath(checkpoint.cp_file))),
+            checkpoint.table_size,
+            checkpoint.trials,
+            checkpoint.min_swap_num,
+            checkpoint.num_ties,
+            len(checkpoint.best_swap_sequences),
+            checkpoint.cp_file,
+            trials_per_second,
+        )
+
+    def get(self, swapper, table_size):
+        """
+        :return: IndexedResult of the swapper at the table size, or None if there is
+        none.
+        """
+        row = self.connection.execute(
+            "SELECT * FROM results WHERE swapper = ? AND table_size = ?",
+            (swapper, table_size),
+        ).fetchone()
+        return None if row is None else IndexedResult(*row)
+
+    def results(self):
+        """
+        :return: list of every IndexedResult, by swapper and table size.
+        """
+        rows = self.connection.execute(
+            "SELECT * FROM results ORDER BY swapper, table_size"
+        ).fetchall()
+        return [IndexedResult(*row) for row in rows]
+
+    def best_lengths(self):
+        """
+        :return: dict mapping each table size to the fewest swaps found by any swapper.
+        """
+        return dict(
+            self.connection.execute(
+                "SELECT table_size, MIN(best_length) FROM results "
+                "WHERE best_length IS NOT NULL GROUP BY table_size"
+            ).fetchall()
+        )
+
+    def rebuild(self, checkpoint_dir=CHECKPOINT_DIR):
+        """ Records every checkpoint under checkpoint_dir from its header, migrating
+        legacy checkpoints first. Ties appended to the logs since the last snapshot are
+        not read, so their counts may lag behind until the runner next updates the index.
+
+        :param checkpoint_dir: directory holding a subdirectory per swapper.
+        """
+        for (dirpath, _, filenames) in os.walk(checkpoint_dir):
+            for filename in filenames:
+                (root, extension) = os.path.splitext(filename)
+                if extension == LEGACY_CHECKPOINT_EXTENSION:
+                    Checkpoint(os.path.join(dirpath, root + CHECKPOINT_EXTENSION))
+            for filename in os.listdir(dirpath):
+                if os.path.splitext(filename)[1] != CHECKPOINT_EXTENSION:
+                    continue
+                cp_file = os.path.join(dirpath, filename)
+                header = read_checkpoint_header(cp_file)
+                self.record(
+                    os.path.basename(dirpath),
+                    header.table_size,
+                    header.trials,
+                    header.best_length if header.num_ties else None,
+                    header.num_ties,
+                    header.num_sequences + header.num_seeded,
+                    cp_file,
+                )
+
+    def close(self):
+        self.connection.close()
+
+
+def known_min_swaps(table_size, index=None):
+    """
+    :param table_size:
+    :param index: ResultsIndex holding the results of the searches run so far, if any.
+    :return: fewest swaps known to make everyone friends at a table of the specified
+    size: the least of constants.min_swaps and of every indexed search, or None if no
+    sequence is known.
+    """
+    known = [min_swaps.get(table_size)]
+    if index is not None:
+        known.append(index.best_lengths().get(table_size))
+    known = [k for k in known if k is not None]
+    return min(known) if known else None
+
+
+class TestResultsIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.index = ResultsIndex(os.path.join(self.dir.name, "results.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_rebuild_and_record(self):
+        checkpoint_dir = os.path.join(self.dir.name, "checkpoint")
+        os.makedirs(os.path.join(checkpoint_dir, "GreedySwapper"))
+        cp = Checkpoint(
+            os.path.join(checkpoint_dir, "GreedySwapper", "25" + CHECKPOINT_EXTENSION)
+        )
+        cp.new_high_score(5, 4, [(0, 9)] * 11)
+        self.index.rebuild(checkpoint_dir)
+        self.assertEqual(self.index.get("GreedySwapper", 25)[2:6], (5, 11, 1, 1))
+
+        cp.new_high_score(8, 7, [(0, 9)] * 9)
+        self.index.record_checkpoint(cp, trials_per_second=100.0)
+        cp.add_tie(9, [(1, 8)] * 9)
+        self.index.record_checkpoint(cp)
+        result = self.index.get("GreedySwapper", 25)
+        # the throughput of the last run is kept when it is not known.
+        self.assertEqual(result[2:7], (8, 9, 2, 2, 100.0))
+        self.assertEqual(self.index.best_lengths(), {25: 9})
+        self.assertEqual(known_min_swaps(25, self.index), 9)
+        self.assertIsNone(known_min_swaps(25))
+        self.assertEqual(known_min_swaps(10, self.index), min_swaps[10])
@@ -0,0 +1,222 @@
+import collections
+import itertools
+import random
+import unittest
+
+from friend_matrix import FriendMatrix
+from util import all_friend_pairs, new_friend_pairs
+
+
+class SequenceEvaluator(object):
+    """
+    Carries out sequences of swaps at a table, so that many sequences can be evaluated
+    without replaying each of them from the initial seating arrangement.
+
+    The evaluator holds the state of the table after its current sequence of swaps
+    (self.swaps). Swaps can be pushed onto and popped off the sequence in O(1), as each
+    push records the (at most 4) new friend pairs it made, so that search code can
+    backtrack without copying the state. Evaluating another sequence pops back to the
+    prefix it shares with the current sequence and pushes only the rest, so evaluating a
+    batch of sequences in order (e.g. sorted) costs only their differing suffixes.
+
+    In addition, a snapshot of the state is cached every snapshot_interval swaps, in an
+    LRU cache keyed by the prefix of swaps leading to it, so that a sequence sharing a
+    long prefix with any recently evaluated sequence (not just the current one) can be
+    evaluated from the deepest cached prefix.
+    """
+
+    def __init__(
+        self,
+        initial_seating_arrangement,
+        initial_friend_pairs=None,
+        snapshot_interval=8,
+        max_snapshots=1000,
+    ):
+        """
+        :param initial_seating_arrangement: list of ints representing the seating
+        arrangement around a circular table before any swaps.
+        :param initial_friend_pairs: FriendMatrix of the pairs of individuals who are
+        already friends; by default, those sitting next to each other.
+        :param snapshot_interval: number of swaps between cached snapshots of the state.
+        :param max_snapshots: maximum number of snapshots cached (0 to disable caching).
+        """
+        self.seating_arrangement = list(initial_seating_arrangement)
+        if initial_friend_pairs is None:
+            initial_friend_pairs = FriendMatrix.from_seating_arrangement(
+                self.seating_arrangement
+            )
+        self.friend_pairs = initial_friend_pairs.copy()
+        self.n = len(self.seating_arrangement)
+        self.num_total_friend_pairs = self.n * (self.n - 1) // 2
+        self.swaps = []
+        # the new friend pairs made by each swap in self.swaps, to undo them.
+        self.new_friend_pairs = []
+
+        self.snapshot_interval = snapshot_interval
+        self.max_snapshots = max_snapshots
+        self.snapshots = collections.OrderedDict()
+        # number of swaps carried out (whether pushed directly or while evaluating).
+        self.num_pushes = 0
+
+    def push(self, swap):
+        """ Carries out a swap, appending it to the current sequence.
+
+        :param swap: pair of integers representing the positions of the people swapped.
+        :return: list of the new friend pairs made by the swap.
+        """
+        # equivalent to new_friend_pairs followed by FriendMatrix.update, but working on
+        # the flags of the FriendMatrix directly, as this is the innermost loop of searches.
+        seating = self.seating_arrangement
+        flags = self.friend_pairs.flags
+        n = self.n
+        (i, j) = swap
+        p_i = seating[i]
+        p_j = seating[j]
+        nfp = []
+        for (p, q) in (
+            (p_i, seating[(j - 1) % n]),
+            (p_i, seating[(j + 1) % n]),
+            (p_j, seating[(i - 1) % n]),
+            (p_j, seating[(i + 1) % n]),
+        ):
+            if p != q and not flags[p * n + q]:
+                flags[p * n + q] = 1
+                flags[q * n + p] = 1
+                nfp.append((p, q) if p < q else (q, p))
+        self.friend_pairs.num_friend_pairs += len(nfp)
+        seating[i] = p_j
+        seating[j] = p_i
+        self.swaps.append(swap)
+        self.new_friend_pairs.append(nfp)
+        self.num_pushes += 1
+        return nfp
+
+    def pop(self):
+        """ Undoes the last swap of the current sequence.
+
+        :return: the swap undone.
+        """
+        swap = self.swaps.pop()
+        for pair in self.new_friend_pairs.pop():
+            self.friend_pairs.discard(pair)
+        (i, j) = swap
+        self.seating_arrangement[i], self.seating_arrangement[j] = (
+            self.seating_arrangement[j],
+            self.seating_arrangement[i],
+        )
+        return swap
+
+    def num_remaining_friend_pairs(self):
+        return self.num_total_friend_pairs - len(self.friend_pairs)
+
+    def is_everyone_friends(self):
+        return len(self.friend_pairs) == self.num_total_friend_pairs
+
+    def _snapshot(self):
+        key = tuple(self.swaps)
+        if key in self.snapshots:
+            self.snapshots.move_to_end(key)
+            return
+        self.snapshots[key] = (
+            tuple(self.seating_arrangement),
+            bytes(self.friend_pairs.flags),
+            len(self.friend_pairs),
+            list(self.new_friend_pairs),
+        )
+        if len(self.snapshots) > self.max_snapshots:
+            self.snapshots.popitem(last=False)
+
+    def _restore(self, key):
+        (seating_arrangement, flags, num_friend_pairs, nfp) = self.snapshots[key]
+        self.snapshots.move_to_end(key)
+        self.seating_arrangement[:] = seating_arrangement
+        self.friend_pairs.flags[:] = flags
+        self.friend_pairs.num_friend_pairs = num_friend_pairs
+        self.swaps = list(key)
+        self.new_friend_pairs = list(nfp)
+
+    def evaluate(self, swaps):
+        """ Makes swaps the current sequence, carrying out only the swaps not shared with
+        the current sequence or a cached prefix.
+
+        :param swaps: list of swaps.
+        :return: number of friend pairs remaining after the swaps.
+        """
+        common = 0
+        for (a, b) in zip(self.swaps, swaps):
+            if a != b:
+                break
+            common += 1
+
+        if self.max_snapshots:
+            # restore the deepest cached prefix, if it saves more swaps than it costs.
+            depth = len(swaps) - len(swaps) % self.snapshot_interval
+            while depth > common + self.snapshot_interval:
+                key = tuple(swaps[:depth])
+                if key in self.snapshots:
+                    self._restore(key)
+                    common = depth
+                    break
+                depth -= self.snapshot_interval
+
+        while len(self.swaps) > common:
+            self.pop()
+        for swap in swaps[common:]:
+            self.push(swap)
+            if self.max_snapshots and len(self.swaps) % self.snapshot_interval == 0:
+                self._snapshot()
+        return self.num_remaining_friend_pairs()
+
+
+class TestSequenceEvaluator(unittest.TestCase):
+    def setUp(self):
+        self.n = 10
+        self.evaluator = SequenceEvaluator(range(self.n), snapshot_interval=2)
+        rng = random.Random(0)
+        all_swaps = list(itertools.combinations(range(self.n), 2))
+        self.sequences = [[rng.choice(all_swaps) for _ in range(12)] for _ in range(5)]
+
+    def assertMatchesReplay(self, swaps):
+        seating_arrangement = list(range(self.n))
+        friend_pairs = all_friend_pairs(seating_arrangement)
+        for (i, j) in swaps:
+            seating_arrangement[i], seating_arrangement[j] = (
+                seating_arrangement[j],
+                seating_arrangement[i],
+            )
+            friend_pairs |= all_friend_pairs(seating_arrangement)
+        self.assertEqual(self.evaluator.seating_arrangement, seating_arrangement)
+        self.assertEqual(set(self.evaluator.friend_pairs), friend_pairs)
+        self.assertEqual(len(self.evaluator.friend_pairs), len(friend_pairs))
+
+    def test_push_pop(self):
+        for swap in self.sequences[0]:
+            self.evaluator.push(swap)
+        for _ in range(5):
+            self.evaluator.pop()
+        self.assertMatchesReplay(self.sequences[0][:-5])
+
+    def test_push_matches_new_friend_pairs(self):
+        for swap in self.sequences[0] + [(0, 1), (0, 9), (3, 4)]:
+            nfp = new_friend_pairs(
+                self.evaluator.seating_arrangement, self.evaluator.friend_pairs, swap
+            )
+            self.assertEqual(self.evaluator.push(swap), nfp)
+
+    def test_evaluate(self):
+        for swaps in self.sequences + [s[:7] for s in self.sequences]:
+            self.evaluator.evaluate(swaps)
+            self.assertMatchesReplay(swaps)
+
+    def test_shared_prefixes_are_not_replayed(self):
+        self.evaluator.evaluate(self.sequences[0])
+        self.evaluator.evaluate(self.sequences[1])
+        pushes = self.evaluator.num_pushes
+        # the cached prefix of 12 swaps is restored, and only the last swap carried out.
+        swaps = self.sequences[0] + [(0, 5)]
+        self.evaluator.evaluate(swaps)
+        self.assertEqual(self.evaluator.num_pushes - pushes, 1)
+        self.assertMatchesReplay(swaps)
+        for _ in range(4):
+            self.evaluator.pop()
+        self.assertMatchesReplay(swaps[:-4])
@@ -0,0 +1,384 @@
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from checkpoint import SharedHighScore
+from constants import SHARDS_DIR
+from exact_solver import BranchAndBoundSolver, is_covering_sequence
+from sequence_evaluator import SequenceEvaluator
+
+DEFAULT_SHARD_MAX_NODES = 100000
+SHARD_LOG_FILE = "shards.jsonl"
+BOUND_FILE = "bound"
+
+
+def replay(table_size, prefix):
+    """
+    :param table_size: Number of people at the table.
+    :param prefix: list of swaps.
+    :return: SequenceEvaluator holding the state after the swaps.
+    """
+    evaluator = SequenceEvaluator(range(table_size), max_snapshots=0)
+    for swap in prefix:
+        evaluator.push(swap)
+    return evaluator
+
+
+def child_shards(solver, prefixes, swaps=None):
+
+    """ Extends each prefix by every swap, keeping one prefix per table state up to
+    equivalence (see TableStateCanonicalizer). Prefixes that already make everyone friends
+    are kept as they are, as their own shard.
+
+    Every shard is searched from its state with no restriction on the next swap, so any
+    of the prefixes reaching equivalent states can stand for all of them. Budgets are not
+    used to prune children, so that the shards are the same however the bound has been
+    tightened, and resumed runs can recognise the shards already searched.
+
+    :param solver: BranchAndBoundSolver for the table.
+    :param prefixes: list of prefixes (lists of swaps).
+    :param swaps: If specified, extend the prefixes by only these swaps, e.g. those left
+    unsearched by a shard that was split.
+    :return: list of the extended prefixes, in a deterministic order.
+    """
+
+    children = []
+    seen = set()
+    for prefix in prefixes:
+        evaluator = replay(solver.n, prefix)
+        if evaluator.is_everyone_friends():
+            children.append(prefix)
+            continue
+        for swap in solver.swaps:
+            if swaps is not None and swap not in swaps:
+                continue
+            if prefix and swap == prefix[-1]:
+                # would just undo the previous swap.
+                continue
+            evaluator.push(swap)
+            (key, _) = solver.canonicalizer.canonicalize(
+                np.array(evaluator.seating_arrangement), evaluator.friend_pairs
+            )
+            evaluator.pop()
+            if key not in seen:
+                seen.add(key)
+                children.append(prefix + [swap])
+    return children
+
+
+# State of each process in the pool used by ShardedSolver; set up by _init_worker.
+_worker_state = {}
+
+
+def _init_worker(table_size, use_transposition_table, bound_file, max_nodes):
+    _worker_state["solver"] = BranchAndBoundSolver(table_size, use_transposition_table)
+    _worker_state["bound"] = SharedHighScore(bound_file, 0)
+    _worker_state["max_nodes"] = max_nodes
+
+
+def _search_shard(prefix):
+
+    """ Searches the subtree of a shard for a shortest sequence within the shared bound.
+
+    :param prefix: list of swaps leading to the shard.
+    :return: tuple (prefix, status, swaps, nodes, unsearched, bound), where status is
+    "done" if the subtree was searched in full and "split" if the search gave up after
+    max_nodes nodes, swaps is the shortest sequence found through the shard (or None),
+    unsearched is the list of next swaps whose subtrees are left to search if it was split
+    (or None), and bound is the shared bound once the search ended: the searched subtrees
+    hold no sequence of at most that many swaps.
+    """
+
+    solver = _worker_state["solver"]
+    bound = _worker_state["bound"]
+    max_swaps = bound.value - len(prefix)
+    if max_swaps < 0:
+        return (prefix, "done", None, 0, None, bound.value)
+    evaluator = replay(solver.n, prefix)
+    swaps = solver.solve(
+        max_swaps,
+        seating_arrangement=evaluator.seating_arrangement,
+        friend_pairs=evaluator.friend_pairs,
+        max_nodes=_worker_state["max_nodes"],
+        # other workers may tighten the bound while the shard is searched.
+        shared_bound=lambda: bound.value - len(prefix),
+    )
+    if swaps is not None:
+        swaps = prefix + swaps
+        # publish the better depth, so that other workers can tighten their bound.
+        bound.lower(len(swaps) - 1)
+    # the bound is only ever lowered while the shard is searched, so the subtrees were
+    # searched under at least the final bound.
+    if solver.aborted:
+        return (prefix, "split", swaps, solver.nodes, solver.unsearched, bound.value)
+    return (prefix, "done", swaps, solver.nodes, None, bound.value)
+
+
+class ShardedSolver(object):
+    """
+    Searches for a shortest sequence of swaps with the branch-and-bound solver, split into
+    independent shards: the table states reached by the prefixes of shard_depth swaps, one
+    per state up to equivalence (see child_shards).
+
+    Shards are searched by a pool of worker processes, which share the bound (one less
+    than the length of the best sequence found so far) through a memory-mapped file, read
+    at every node, so that each shard is pruned by the tightest bound found by any worker.
+    As subtrees are very uneven, a shard that is not finished within max_nodes nodes is
+    split into the child shards of the swaps it left unsearched, which are queued to be
+    taken by whichever workers are free.
+
+    Every finished or split shard is appended to a log in the shard directory, along with
+    the bound it was searched under, so that a run that is stopped can be resumed without
+    searching the finished shards again. Shards searched under a bound tighter than that
+    of the run (e.g. by an earlier run with a lower max_swaps) are searched again.
+    """
+
+    def __init__(
+        self,
+        table_size,
+        max_swaps,
+        shard_depth=2,
+        use_transposition_table=True,
+        max_nodes=DEFAULT_SHARD_MAX_NODES,
+        shard_dir=None,
+    ):
+        """
+        :param table_size: Number of people at the table.
+        :param max_swaps: Maximum number of swaps allowed.
+        :param shard_depth: Number of swaps in the prefixes of the initial shards.
+        :param use_transposition_table: passed on to BranchAndBoundSolver.
+        :param max_nodes: Number of nodes searched in a shard before splitting it.
+        :param shard_dir: directory of the shard log; by default, a subdirectory of
+        SHARDS_DIR named after the table size and shard depth.
+        """
+        self.n = table_size
+        self.max_swaps = max_swaps
+        self.shard_depth = shard_depth
+        self.use_transposition_table = use_transposition_table
+        self.max_nodes = max_nodes
+        if shard_dir is None:
+            shard_dir = os.path.join(
+                SHARDS_DIR, "{}-depth{}".format(table_size, shard_depth)
+            )
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_log_file = os.path.join(shard_dir, SHARD_LOG_FILE)
+        self.bound_file = os.path.join(shard_dir, BOUND_FILE)
+        self.solver = BranchAndBoundSolver(table_size, use_transposition_table)
+
+        self.best = None
+        self.nodes = 0
+        self.num_done = 0
+
+    def _load_log(self):
+        # returns the finished prefixes recorded in the log, as a dict mapping tuples of
+        # them to the loosest bound they were searched under, and the split prefixes, as a
+        # dict mapping them to the bound they were searched under and the swaps they left
+        # unsearched.
+        done = {}
+        split = {}
+        if not os.path.isfile(self.shard_log_file):
+            return (done, split)
+        with open(self.shard_log_file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a record cut short by an interruption while appending.
+                    continue
+                prefix = tuple(tuple(swap) for swap in record["prefix"])
+                if record["status"] == "done":
+                    done[prefix] = max(done.get(prefix, -1), record["bound"])
+                else:
+                    split[prefix] = (
+                        record["bound"],
+                        [tuple(swap) for swap in record["unsearched"]],
+                    )
+                if record["swaps"] is not None:
+                    self._record_best([tuple(swap) for swap in record["swaps"]])
+                self.nodes += record["nodes"]
+        return (done, split)
+
+    def _record_best(self, swaps):
+        if self.best is None or len(swaps) < len(self.best):
+            self.best = swaps
+
+    def bound(self):
+        """
+        :return: the number of swaps a sequence must be within to improve on the best
+        sequence found so far, and on max_swaps.
+        """
+        if self.best is None:
+            return self.max_swaps
+        return min(self.max_swaps, len(self.best) - 1)
+
+    def pending_shards(self):
+        """
+        :return: list of the shards still to be searched, given the shard log.
+        """
+        (done, split) = self._load_log()
+        bound = self.bound()
+        shards = [[]]
+        for _ in range(self.shard_depth):
+            shards = child_shards(self.solver, shards)
+        pending = []
+        self.num_done = 0
+        while shards:
+            shard = shards.pop()
+            if done.get(tuple(shard), -1) >= bound:
+                self.num_done += 1
+            elif tuple(shard) in split and split[tuple(shard)][0] >= bound:
+                shards.extend(
+                    child_shards(self.solver, [shard], split[tuple(shard)][1])
+                )
+            else:
+                pending.append(shard)
+        return pending
+
+    def solve(self, workers=1, progress=None):
+        """ Searches every shard not already searched.
+
+        :param workers: number of processes to search shards in.
+        :param progress: If specified, tqdm progress bar, whose total is kept up to date
+        with the number of shards.
+        :return: shortest sequence of at most max_swaps swaps found (in this or previous
+        runs), or None if there is none.
+        """
+        pending = self.pending_shards()
+        bound = self.bound()
+        shared_bound = SharedHighScore(self.bound_file, bound)
+        # the bound file may be ahead of the log, if a run was interrupted after a worker
+        # lowered it but before its shard was logged, which then needs searching again.
+        shared_bound.reset(bound)
+        if progress is not None:
+            progress.total = self.num_done + len(pending)
+            progress.update(self.num_done)
+
+        results = queue.Queue()
+        with multiprocessing.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(
+                self.n,
+                self.use_transposition_table,
+                self.bound_file,
+                self.max_nodes,
+            ),
+        ) as pool, open(self.shard_log_file, "a") as log:
+
+            def submit(shard):
+                pool.apply_async(
+                    _search_shard,
+                    (shard,),
+                    callback=results.put,
+                    error_callback=results.put,
+                )
+
+            for shard in pending:
+                submit(shard)
+            num_running = len(pending)
+            while num_running:
+                result = results.get()
+                if isinstance(result, BaseException):
+                    # the shard would otherwise never be accounted for.
+                    raise result
+                (prefix, status, swaps, nodes, unsearched, shard_bound) = result
+                num_running -= 1
+                self.nodes += nodes
+                if swaps is not None:
+                    self._record_best(swaps)
+                log.write(
+                    json.dumps(
+                        {
+                            "prefix": prefix,
+                            "status": status,
+                            "swaps": swaps,
+                            "nodes": nodes,
+                            "unsearched": unsearched,
+                            "bound": shard_bound,
+                        }
+                    )
+                    + "\n"
+                )
+                log.flush()
+                if status == "split":
+                    # the subtrees of the other swaps were searched in full.
+                    children = child_shards(self.solver, [prefix], unsearched)
+                    for child in children:
+                        submit(child)
+                    num_running += len(children)
+                    if progress is not None:
+                        progress.total += len(children) - 1
+                        progress.refresh()
+                elif progress is not None:
+                    progress.update(1)
+                    progress.set_description(
+                        "best: {}".format(len(self.best) if self.best else "none")
+                    )
+        shared_bound.close()
+        if self.best is not None and len(self.best) > self.max_swaps:
+            # found by an earlier run with a looser bound.
+            return None
+        return self.best
+
+
+class TestShardedSolver(unittest.TestCase):
+    def test_matches_unsharded_search(self):
+        for n in range(5, 9):
+            with tempfile.TemporaryDirectory() as shard_dir:
+                solver = ShardedSolver(
+                    n, n * (n - 1) // 2, shard_depth=2, max_nodes=50, shard_dir=shard_dir
+                )
+                swaps = solver.solve(workers=2)
+                self.assertTrue(is_covering_sequence(n, swaps))
+                expected = BranchAndBoundSolver(n).solve(n * (n - 1) // 2)
+                self.assertEqual(len(swaps), len(expected))
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            solver = ShardedSolver(8, 8, shard_depth=1, max_nodes=50, shard_dir=shard_dir)
+            swaps = solver.solve()
+            # every shard is recorded, so a resumed run has nothing left to search.
+            resumed = ShardedSolver(8, 8, shard_depth=1, shard_dir=shard_dir)
+            self.assertEqual(resumed.pending_shards(), [])
+            self.assertEqual(len(resumed.solve()), len(swaps))
+
+    def test_resume_with_looser_bound(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            # there is no sequence of 7 swaps at a table of 9, but there is one of 8.
+            solver = ShardedSolver(9, 7, shard_depth=1, shard_dir=shard_dir)
+            self.assertIsNone(solver.solve())
+            # the shards searched under the tighter bound are searched again.
+            swaps = ShardedSolver(9, 8, shard_depth=1, shard_dir=shard_dir).solve()
+            self.assertTrue(is_covering_sequence(9, swaps))
+            self.assertEqual(len(swaps), 8)
+            # and a tighter bound again is answered from the log.
+            resumed = ShardedSolver(9, 7, shard_depth=1, shard_dir=shard_dir)
+            self.assertEqual(resumed.pending_shards(), [])
+            self.assertIsNone(resumed.solve())
+
+    def test_split_shard_keeps_searched_subtrees(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            bound_file = os.path.join(shard_dir, BOUND_FILE)
+            SharedHighScore(bound_file, 7).close()
+            _init_worker(9, True, bound_file, 100)
+            (_, status, _, nodes, unsearched, _) = _search_shard([])
+            self.assertEqual((status, nodes), ("split", 101))
+            # only the children of the swaps left unsearched are searched again.
+            self.assertLess(len(unsearched), 9 * 8 // 2)
+            children = child_shards(_worker_state["solver"], [[]], unsearched)
+            self.assertTrue(all(child[0] in unsearched for child in children))
+
+    def test_worker_error_is_raised(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            solver = ShardedSolver(6, 4, shard_depth=1, shard_dir=shard_dir)
+            with mock.patch.object(
+                BranchAndBoundSolver, "solve", side_effect=RuntimeError("failed")
+            ):
+                with self.assertRaisesRegex(RuntimeError, "failed"):
+                    solver.solve(workers=2)
@@ -1,20 +1,70 @@
 #!/usr/bin/env python3
 
-from constants import PWD, CHECKPOINT_DIR
-import os
-import pickle
+import argparse
+import itertools
 
-for (dirpath, dirnames, filenames) in os.walk(CHECKPOINT_DIR):
-    print(os.path.split(dirpath)[-1])
-    for filename in sorted(filenames, key=lambda x: int(os.path.splitext(x)[0])):
-        cp_file = os.path.join(dirpath, filename)
-        with open(cp_file, "rb") as f:
-            [i, best_swap_sequences] = pickle.load(f)[:2]
-        print(
-            "\t{table_size} - best: {high_score:>4}, seen in {num_achieved:>4}/{num_trials:>11}".format(
-                table_size=os.path.splitext(filename)[0],
-                num_trials=i,
-                high_score=len(best_swap_sequences[0][1]),
-                num_achieved=len(best_swap_sequences),
+from constants import min_swaps
+from results_index import ResultsIndex
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="""
+        Summarize the checkpoints of every swapper and table size, from the results
+        index that runners update as they write checkpoints.
+        """,
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="""If specified, first record every checkpoint in the index from its
+        header (which is done anyway if the index is empty), e.g. for checkpoints
+        written before the index existed.
+        """,
+    )
+    parser.add_argument(
+        "--known-best",
+        action="store_true",
+        help="""If specified, also compare the fewest swaps found for each table size
+        with the known minimums in constants.min_swaps.
+        """,
+    )
+    args = parser.parse_args()
+
+    index = ResultsIndex()
+    results = index.results()
+    if args.rebuild or not results:
+        index.rebuild()
+        results = index.results()
+
+    for (swapper, swapper_results) in itertools.groupby(results, lambda r: r.swapper):
+        print(swapper)
+        for r in swapper_results:
+            print(
+                "\t{table_size} - best: {high_score:>4}, seen in {num_achieved:>4}/{num_trials:>11}{throughput}".format(
+                    table_size=r.table_size,
+                    num_trials=r.trials,
+                    high_score=r.best_length if r.best_length is not None else "-",
+                    num_achieved=r.num_ties,
+                    throughput=", {:.0f} trials/s".format(r.trials_per_second)
+                    if r.trials_per_second
+                    else "",
+                )
+            )
+
+    if args.known_best:
+        print("Known best")
+        best_lengths = index.best_lengths()
+        for table_size in sorted(set(min_swaps) | set(best_lengths)):
+            known = min_swaps.get(table_size)
+            found = best_lengths.get(table_size)
+            note = ""
+            if found is not None and (known is None or found < known):
+                note = " (improves on constants.min_swaps)"
+            print(
+                "\t{} - known: {:>4}, found: {:>4}{}".format(
+                    table_size,
+                    known if known is not None else "-",
+                    found if found is not None else "-",
+                    note,
+                )
             )
-        )
@@ -1,17 +1,31 @@
 import abc
 import itertools
+import math
 import random
+import unittest
 
 import numpy as np
 
-from util import all_friend_pairs, new_friend_pairs, num_new_friend_pairs
+from friend_matrix import FriendMatrix
+from gain_table import MAX_GAIN, SwapGainTable
+from util import all_friend_pairs, new_friend_pair_counts, new_friend_pairs
 
 
 class AbstractSwapper(object):
-    def __init__(self, initial_seating_arrangement):
+    def __init__(self, initial_seating_arrangement, rng=None):
+        """
+        :param initial_seating_arrangement: list of ints representing the seating
+        arrangement.
+        :param rng: random.Random drawing every random choice of the trial, so that the
+        trial can be reproduced from its seed; by default, the global generator of random.
+        """
+        self.rng = random if rng is None else rng
+
         # mutates during operation
         self.seating_arrangement = initial_seating_arrangement
-        self.existing_friend_pairs = all_friend_pairs(self.seating_arrangement)
+        self.existing_friend_pairs = FriendMatrix.from_seating_arrangement(
+            self.seating_arrangement
+        )
         self.swaps = []
 
         # stays fixed
@@ -19,7 +33,7 @@ class AbstractSwapper(object):
         self.num_total_friend_pairs = self.n * (self.n - 1) / 2
         self.all_possible_swaps = list(itertools.combinations(range(self.n), 2))
         # Randomly shuffle the list of possible swaps.
-        np.random.shuffle(self.all_possible_swaps)
+        self.rng.shuffle(self.all_possible_swaps)
 
     @abc.abstractmethod
     def generate_swap(self):
@@ -32,9 +46,7 @@ class AbstractSwapper(object):
         p_j = self.seating_arrangement[j]
         self.seating_arrangement[j] = p_i
         self.seating_arrangement[i] = p_j
-        self.existing_friend_pairs = self.existing_friend_pairs.union(
-            all_friend_pairs(self.seating_arrangement)
-        )
+        self.existing_friend_pairs.update(all_friend_pairs(self.seating_arrangement))
         self.swaps.append(swap)
 
     def do_swap(self, swap):
@@ -47,7 +59,7 @@ class AbstractSwapper(object):
         p_j = self.seating_arrangement[j]
         self.seating_arrangement[j] = p_i
         self.seating_arrangement[i] = p_j
-        self.existing_friend_pairs = self.existing_friend_pairs.union(nfp)
+        self.existing_friend_pairs.update(nfp)
         self.swaps.append(swap)
 
     def is_everyone_friends(self):
@@ -63,118 +75,274 @@ class AbstractSwapper(object):
 
 class RandomSwapper(AbstractSwapper):
     def generate_swap(self):
-        return random.choice(self.all_possible_swaps)
+        return self.rng.choice(self.all_possible_swaps)
 
 
-class GreedySwapper(AbstractSwapper):
-    def generate_swap(self):
-        max_swaps = []
-        max_new_friends = 1
-        for swap in self.all_possible_swaps:
-            num_new_friends = num_new_friend_pairs(
-                self.seating_arrangement, self.existing_friend_pairs, swap
-            )
-            if num_new_friends == max_new_friends:
-                max_swaps.append(swap)
-            elif num_new_friends > max_new_friends:
-                max_new_friends = num_new_friends
-                max_swaps = [swap]
-                if num_new_friends == 4:
-                    # Safe to terminate here since self.all_possible_swaps is randomly sorted.
-                    break
+class GainTableSwapper(AbstractSwapper):
+    """
+    Keeps the gain of every swap (in the order of self.all_possible_swaps) in a table that
+    is updated incrementally after each swap, so that subclasses can pick from the gain
+    vector self.gain_table.gains rather than evaluating every swap at each step.
+    """
 
-        return random.choice(max_swaps)
+    def __init__(self, initial_seating_arrangement, rng=None):
+        super(GainTableSwapper, self).__init__(initial_seating_arrangement, rng)
+        self.gain_table = SwapGainTable(
+            self.seating_arrangement,
+            self.existing_friend_pairs,
+            self.all_possible_swaps,
+            self.rng,
+        )
 
+    def do_swap_v1(self, swap):
+        super(GainTableSwapper, self).do_swap_v1(swap)
+        self.gain_table.update(
+            self.seating_arrangement, self.existing_friend_pairs, swap
+        )
 
-class SubsetGreedySwapper(AbstractSwapper):
+    def do_swap(self, swap):
+        super(GainTableSwapper, self).do_swap(swap)
+        self.gain_table.update(
+            self.seating_arrangement, self.existing_friend_pairs, swap
+        )
+
+
+class GreedySwapper(GainTableSwapper):
     """
-    Checks only a subset of the possible swaps.
+    Picks among the swaps generating the most new friends.
     """
 
     def generate_swap(self):
-        max_swaps = []
-        max_new_friends = 1
-        # TODO: do not hardcode the fraction we're checking.
-        i = 0
-
-        while i < len(self.all_possible_swaps) or len(max_swaps) == 0:
-            swap = self.all_possible_swaps[i]
-            num_new_friends = num_new_friend_pairs(
-                self.seating_arrangement, self.existing_friend_pairs, swap
-            )
-            if num_new_friends == max_new_friends:
-                max_swaps.append(swap)
-            elif num_new_friends > max_new_friends:
-                max_new_friends = num_new_friends
-                max_swaps = [swap]
-                if max_new_friends == 4:
-                    # we've hit the max number of new friends
-                    break
-            i += 1
+        return self.gain_table.sample_best_swap()
 
-        return random.choice(max_swaps)
 
+class SubsetGreedySwapper(AbstractSwapper):
+    """
+    Checks only a subset of the possible swaps: at each step, picks among the swaps
+    generating the most new friends in a fresh random sample of budget swaps (drawn without
+    replacement), falling back to a scan of every swap if none of the sample generates any.
 
-class ImpatientGreedySwapper(AbstractSwapper):
+    Each step takes O(budget) rather than O(n) (for the gain table) or O(n^2) (for a full
+    scan), for a small loss in quality, which pays off on large tables.
+    """
+
+    DEFAULT_BUDGET = 64
+
+    def __init__(self, initial_seating_arrangement, budget=DEFAULT_BUDGET, rng=None):
+        super(SubsetGreedySwapper, self).__init__(initial_seating_arrangement, rng)
+        if budget <= 0:
+            raise ValueError("Budget must be positive, not {}.".format(budget))
+        self.budget = min(budget, len(self.all_possible_swaps))
+        (self.first, self.second) = (
+            np.array(self.all_possible_swaps, dtype=np.intp).reshape(-1, 2).T
+        )
+        # numpy's Generator samples without replacement in O(budget); it is seeded from
+        # self.rng, so that seeding that still makes trials reproducible.
+        self.np_rng = np.random.default_rng(self.rng.getrandbits(64))
+
+    def _best_of(self, candidates):
+        # returns the largest gain among the candidates, and one of the candidates with it.
+        gains = new_friend_pair_counts(
+            np.array(self.seating_arrangement),
+            self.existing_friend_pairs.matrix,
+            self.first[candidates],
+            self.second[candidates],
+        )
+        best_gain = gains.max()
+        best = np.flatnonzero(gains == best_gain)
+        return (best_gain, candidates[best[self.np_rng.integers(len(best))]])
+
+    def generate_swap(self):
+        candidates = self.np_rng.choice(
+            len(self.all_possible_swaps), self.budget, replace=False
+        )
+        (best_gain, k) = self._best_of(candidates)
+        if best_gain == 0:
+            (best_gain, k) = self._best_of(np.arange(len(self.all_possible_swaps)))
+        return self.all_possible_swaps[k]
+
+
+class ImpatientGreedySwapper(GainTableSwapper):
     """
     Tries to make a lot of friends initially, but slowly just gives up.
 
     More specifically, we have a threshold that starts at 4 but backs off to the expected mean.
     """
 
-    def __init__(self, initial_seating_arrangement):
-        super(ImpatientGreedySwapper, self).__init__(initial_seating_arrangement)
+    def __init__(self, initial_seating_arrangement, rng=None):
+        super(ImpatientGreedySwapper, self).__init__(initial_seating_arrangement, rng)
         # This is exactly the number of expected new friends that can be made, by linearity of expectation!
         self.expected_new_friends = 4 * (
             self.num_remaining_friend_pairs() / self.num_total_friend_pairs
         )
+        num_swaps = len(self.all_possible_swaps)
+        # target number of new friends once we have scanned the first i swaps.
+        self.target_new_friends = 4 - (4 - self.expected_new_friends) * (
+            np.arange(num_swaps) / float(num_swaps - 1)
+        )
 
     def generate_swap(self):
-        max_swaps = []
-        max_new_friends = 1
-        i = 0
-
-        for (i, swap) in enumerate(self.all_possible_swaps):
-            swap = self.all_possible_swaps[i]
-            num_new_friends = num_new_friend_pairs(
-                self.seating_arrangement, self.existing_friend_pairs, swap
-            )
-            if num_new_friends == max_new_friends:
-                max_swaps.append(swap)
-            elif num_new_friends > max_new_friends:
-                max_new_friends = num_new_friends
-                max_swaps = [swap]
-            target_new_friends = 4 - (4 - self.expected_new_friends) * (
-                i / float(len(self.all_possible_swaps) - 1)
-            )
-            if max_new_friends >= target_new_friends and len(max_swaps) > 0:
-                # we've hit our target and found an example - time to quit.
-                break
-
-        return random.choice(max_swaps)
-
-
-class WeightedSwapper(AbstractSwapper):
+        # We scan the swaps in order, keeping track of the max number of new friends seen
+        # so far (which must be at least 1), and stop at the first swap where it reaches
+        # the target, choosing among the swaps seen so far with that number of new friends.
+        gains = self.gain_table.gains
+        max_new_friends = np.maximum.accumulate(gains)
+        hit_target = (max_new_friends >= 1) & (
+            max_new_friends >= self.target_new_friends
+        )
+        i = np.argmax(hit_target) if hit_target.any() else len(gains) - 1
+        max_swaps = np.flatnonzero(gains[: i + 1] == max_new_friends[i])
+
+        return self.all_possible_swaps[self.rng.choice(max_swaps)]
+
+
+class LookaheadGreedySwapper(GainTableSwapper):
+    """
+    Picks among the swaps generating the most new friends, preferring those after which
+    the most new friends can be made over the following depth swaps, so that ties are
+    not broken into dead ends where only 1-2 new friends per swap remain.
+
+    Lookahead is pruned: at most max_candidates of the tied swaps are scored at each
+    level (in random order), and scoring stops as soon as a swap achieves the largest
+    possible score. Swaps are scored by carrying them out on the gain table (which only
+    updates the O(n) affected swaps) and undoing them afterwards.
+    """
+
+    def __init__(
+        self, initial_seating_arrangement, depth=1, max_candidates=8, rng=None
+    ):
+        super(LookaheadGreedySwapper, self).__init__(initial_seating_arrangement, rng)
+        self.depth = depth
+        self.max_candidates = max_candidates
+
+    def _carry_out(self, swap):
+        nfp = new_friend_pairs(self.seating_arrangement, self.existing_friend_pairs, swap)
+        (i, j) = swap
+        self.seating_arrangement[i], self.seating_arrangement[j] = (
+            self.seating_arrangement[j],
+            self.seating_arrangement[i],
+        )
+        self.existing_friend_pairs.update(nfp)
+        self.gain_table.update(self.seating_arrangement, self.existing_friend_pairs, swap)
+        return nfp
+
+    def _undo(self, swap, nfp):
+        (i, j) = swap
+        self.seating_arrangement[i], self.seating_arrangement[j] = (
+            self.seating_arrangement[j],
+            self.seating_arrangement[i],
+        )
+        for pair in nfp:
+            self.existing_friend_pairs.discard(pair)
+        self.gain_table.update(self.seating_arrangement, self.existing_friend_pairs, swap)
+
+    def _candidates(self):
+        best_swaps = self.gain_table.best_swaps()
+        return self.rng.sample(best_swaps, min(len(best_swaps), self.max_candidates))
+
+    def _score(self, k, depth):
+        # Returns the gain of swaps[k] plus the most new friends that can then be made
+        # over the following depth swaps (as far as the pruned lookahead can tell).
+        swap = self.all_possible_swaps[k]
+        gain = int(self.gain_table.gains[k])
+        if depth == 0:
+            return gain
+        nfp = self._carry_out(swap)
+        best_gain = self.gain_table.best_gain()
+        if depth == 1 or best_gain == 0:
+            lookahead = best_gain
+        else:
+            lookahead = 0
+            for l in self._candidates():
+                lookahead = max(lookahead, self._score(l, depth - 1))
+                if lookahead == best_gain + MAX_GAIN * (depth - 1):
+                    break
+        self._undo(swap, nfp)
+        return gain + lookahead
+
     def generate_swap(self):
-        # if we maintain and update d at each step, we have the potential to be much quicker
+        candidates = self._candidates()
+        if len(candidates) == 1 or self.is_everyone_friends():
+            return self.all_possible_swaps[candidates[0]]
+        max_score = self.gain_table.best_gain() + MAX_GAIN * self.depth
+        (best_k, best_score) = (None, -1)
+        for k in candidates:
+            score = self._score(k, self.depth)
+            if score > best_score:
+                (best_k, best_score) = (k, score)
+                if score == max_score:
+                    break
+        return self.all_possible_swaps[best_k]
+
 
-        d = {
-            swap: num_new_friend_pairs(
-                self.seating_arrangement, self.existing_friend_pairs, swap
-            )
-            for swap in self.all_possible_swaps
-        }
-        swap = d.keys()
-        p_swap_raw = map(lambda x: np.exp(3 * x), d.itervalues())
-        p_swap = p_swap_raw / sum(p_swap_raw)
+class WeightedSwapper(GainTableSwapper):
+    """
+    Picks a swap at random, with probability proportional to exp(gain / temperature), so
+    that swaps generating more new friends are exponentially more likely to be picked.
+    """
 
-        # all I want to do is have a weighted choice of tuples. is that too hard?
-        return swap[np.random.choice(range(len(swap)), p=p_swap)]
+    DEFAULT_TEMPERATURE = 1 / 3
+
+    def __init__(
+        self, initial_seating_arrangement, temperature=DEFAULT_TEMPERATURE, rng=None
+    ):
+        super(WeightedSwapper, self).__init__(initial_seating_arrangement, rng)
+        if temperature <= 0:
+            raise ValueError("Temperature must be positive, not {}.".format(temperature))
+        self.temperature = temperature
+
+    def generate_swap(self):
+        # weights are relative to the best gain available, so that they cannot all
+        # underflow to zero at low temperatures.
+        best_gain = self.gain_table.best_gain()
+        gain_weights = [
+            math.exp((gain - best_gain) / self.temperature)
+            for gain in range(MAX_GAIN + 1)
+        ]
+        return self.gain_table.sample_weighted_swap(gain_weights)
 
 
 nameToSwapper = {
     "GreedySwapper": GreedySwapper,
     "ImpatientGreedySwapper": ImpatientGreedySwapper,
+    "LookaheadGreedySwapper": LookaheadGreedySwapper,
     "SubsetGreedySwapper": SubsetGreedySwapper,
     "WeightedSwapper": WeightedSwapper,
 }
+
+
+class TestSubsetGreedySwapper(unittest.TestCase):
+    def test_falls_back_to_full_scan(self):
+        s = SubsetGreedySwapper(list(range(10)), budget=1, rng=random.Random(0))
+        # with a single candidate per step, many steps find no new friends in the sample,
+        # but every step must still make new friends while some swap does.
+        while not s.is_everyone_friends():
+            num_remaining = s.num_remaining_friend_pairs()
+            s.do_swap(s.generate_swap())
+            self.assertLess(s.num_remaining_friend_pairs(), num_remaining)
+
+
+class TestLookaheadGreedySwapper(unittest.TestCase):
+    def test_lookahead_leaves_state_unchanged(self):
+        s = LookaheadGreedySwapper(list(range(12)), depth=2, rng=random.Random(0))
+        while not s.is_everyone_friends():
+            seating_arrangement = list(s.seating_arrangement)
+            friend_pairs = set(s.existing_friend_pairs)
+            gains = s.gain_table.gains.copy()
+            swap = s.generate_swap()
+            self.assertEqual(s.seating_arrangement, seating_arrangement)
+            self.assertEqual(set(s.existing_friend_pairs), friend_pairs)
+            self.assertEqual(s.gain_table.gains.tolist(), gains.tolist())
+            s.do_swap(swap)
+
+
+class TestSeededSwappers(unittest.TestCase):
+    def test_same_seed_same_swaps(self):
+        for swapper in nameToSwapper.values():
+            trials = []
+            for _ in range(2):
+                s = swapper(list(range(10)), rng=random.Random(42))
+                while not s.is_everyone_friends():
+                    s.do_swap(s.generate_swap())
+                trials.append(s.swaps)
+            self.assertEqual(trials[0], trials[1])
@@ -1,11 +1,38 @@
 import collections
+import contextlib
+import functools
 import logging
+import math
+import multiprocessing
 import os
-import pickle
+import random
+import tempfile
 import tqdm
 import time
+import unittest
+from unittest import mock
 
+from batch_swapper import BatchGreedySwapper
+from checkpoint import (
+    Checkpoint,
+    CHECKPOINT_EXTENSION,
+    DEFAULT_MAX_STORED_SEQUENCES,
+    HIGH_SCORE_EXTENSION,
+    SeededTrial,
+    SharedHighScore,
+)
 from constants import LOGS_DIR, CHECKPOINT_DIR
+from endgame import EndgameSolver
+from exact_solver import ceil_div, is_covering_sequence
+from results_index import ResultsIndex
+from swapper import (
+    GreedySwapper,
+    LookaheadGreedySwapper,
+    SubsetGreedySwapper,
+    WeightedSwapper,
+    nameToSwapper,
+)
+from trial_results import Histogram, TrialResult, consume
 
 
 def profile_swapper(swapper, num_trials, table_size, show_plot=False):
@@ -20,13 +47,9 @@ def profile_swapper(swapper, num_trials, table_size, show_plot=False):
     :return: Counter of number of swops required for each trial.
     """
 
-    c = collections.Counter()
-    for i in range(num_trials):
-        s = swapper(range(table_size))
-        while not s.is_everyone_friends():
-            s.do_swap(s.generate_swap())
-        num_swaps = len(s.swaps)
-        c[num_swaps] += 1
+    histogram = Histogram()
+    consume(TrialStream(swapper, table_size).run(num_trials), [histogram])
+    c = histogram.counts
 
     # TODO: Temporarily disabling option to show plot as importing matplotlib takes time (and I can't seem to get it working well anyway)
     # if show_plot:
@@ -36,47 +59,479 @@ def profile_swapper(swapper, num_trials, table_size, show_plot=False):
     return c
 
 
-class SwapperRunner(object):
-    def __init__(self, swapper, table_size):
+class RunStats(object):
+    """
+    Opt-in counters of where the time of a run goes: seconds spent in each phase (choosing
+    swaps, carrying them out, solving endgames, checkpoint I/O and progress-bar updates),
+    together with the number of trials, swaps carried out, candidate swaps evaluated (by
+    the gain table of the swapper, if any) and trials given up early.
+    """
+
+    PHASES = ["generate_swap", "do_swap", "endgame", "checkpoint", "progress"]
+
+    def __init__(self, counters=None):
+        self.counters = collections.Counter(counters)
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.counters[phase + "_seconds"] += time.perf_counter() - start_time
+
+    def record_trial(self, s):
+        """
+        :param s: the swapper at the end of a trial.
+        """
+        self.counters["trials"] += 1
+        self.counters["steps"] += len(s.swaps)
+        gain_table = getattr(s, "gain_table", None)
+        if gain_table is not None:
+            self.counters["candidates_evaluated"] += gain_table.num_evaluated
+        if not s.is_everyone_friends():
+            self.counters["early_breaks"] += 1
+
+    def summary(self):
+        """
+        :return: dict of the counters, along with the candidates evaluated per step and
+        the fraction of trials given up early.
+        """
+        summary = dict(self.counters)
+        if self.counters["candidates_evaluated"] and self.counters["steps"]:
+            summary["candidates_per_step"] = (
+                self.counters["candidates_evaluated"] / self.counters["steps"]
+            )
+        if self.counters["trials"]:
+            summary["early_break_rate"] = (
+                self.counters["early_breaks"] / self.counters["trials"]
+            )
+        return summary
+
+
+def format_run_stats(summary):
+    """
+    :param summary: dict returned by RunStats.summary.
+    :return: lines describing the counters, e.g. for --info.
+    """
+    lines = []
+    for phase in RunStats.PHASES:
+        key = phase + "_seconds"
+        if key in summary:
+            lines.append("{:>22}: {:.3f}s".format(key, summary[key]))
+    for key in [
+        "trials",
+        "steps",
+        "candidates_evaluated",
+        "candidates_per_step",
+        "early_breaks",
+        "early_break_rate",
+    ]:
+        if key in summary:
+            lines.append("{:>22}: {:.6g}".format(key, summary[key]))
+    return lines
+
+
+def trial_rng(seed, i):
+    """
+    :param seed: seed of the run.
+    :param i: index of the trial.
+    :return: random.Random drawing every random choice of trial i of the run, so that the
+    trial can be regenerated from (seed, i) alone.
+    """
+    return random.Random(seed * 2 ** 64 + i)
+
+
+def new_run_seed():
+    """
+    :return: a fresh seed for a run, which fits in 64 bits and is never 0 (which marks
+    trials stored by their swaps in checkpoint logs).
+    """
+    return random.SystemRandom().randrange(1, 2 ** 64)
+
+
+def regenerate_trial(swapper, table_size, i, trial):
+
+    """ Runs trial i of a run again from its seed, reproducing its swaps.
+
+    Giving up early never changes the swaps carried out before it does, so the trial is run
+    with the length it reached as its limit. Trials finished by an endgame solver depend on
+    the endgames the solver has cached, and are never stored by their seed.
+
+    :param swapper: Class that is used to select the next swap to be executed.
+    :param table_size:
+    :param i: index of the trial.
+    :param trial: SeededTrial of the trial.
+    :return: list of swaps carried out in the trial.
+    """
+
+    s = run_trial(swapper, table_size, len(trial), rng=trial_rng(trial.seed, i))
+    if not s.is_everyone_friends() or len(s.swaps) != len(trial):
+        raise ValueError(
+            "Trial #{} with seed {} did not reproduce a sequence of {} swaps.".format(
+                i, trial.seed, len(trial)
+            )
+        )
+    return s.swaps
+
+
+def run_trial(
+    swapper,
+    table_size,
+    max_swap_num,
+    endgame_solver=None,
+    endgame_threshold=0,
+    stats=None,
+    rng=None,
+):
+
+    """ Runs a single trial of a swapper, giving up once it is clear that the trial cannot make
+    everyone friends in at most max_swap_num swaps: as a swap makes at most 4 new friend pairs,
+    once len(swaps) + ceil(remaining friend pairs / 4) exceeds max_swap_num.
+
+    :param swapper: Class that is used to select the next swap to be executed.
+    :param table_size:
+    :param max_swap_num: maximum number of swaps the trial may use.
+    :param endgame_solver: If specified, EndgameSolver used to finish the trial exactly once at
+    most endgame_threshold friend pairs remain; the swapper continues if it finds no completion.
+    :param endgame_threshold: number of remaining friend pairs at which to try the endgame solver.
+    :param stats: If specified, RunStats in which to count the time spent in each phase of the trial.
+    :param rng: If specified, random.Random drawing every random choice of the swapper (see trial_rng).
+    :return: the swapper at the end of the trial.
+    """
+
+    s = swapper(list(range(table_size)), rng=rng)
+    tried_endgame = endgame_solver is None
+    # the number of remaining friend pairs is kept by the swapper's FriendMatrix, so the bound
+    # is O(1) to check at every step.
+    while not s.is_everyone_friends() and len(s.swaps) + ceil_div(
+        int(s.num_remaining_friend_pairs()), 4
+    ) <= max_swap_num:
+        if not tried_endgame and s.num_remaining_friend_pairs() <= endgame_threshold:
+            tried_endgame = True
+            with stats.timed("endgame") if stats else contextlib.nullcontext():
+                swaps = endgame_solver.solve(
+                    s.seating_arrangement,
+                    s.existing_friend_pairs,
+                    max_swap_num - len(s.swaps),
+                )
+            if swaps is not None:
+                for swap in swaps:
+                    s.do_swap(swap)
+                break
+        if stats is None:
+            swap = s.generate_swap()
+            s.do_swap(swap)
+        else:
+            with stats.timed("generate_swap"):
+                swap = s.generate_swap()
+            with stats.timed("do_swap"):
+                s.do_swap(swap)
+    if stats is not None:
+        stats.record_trial(s)
+    return s
+
+
+class TrialStream(object):
+    """
+    Runs trials one at a time, yielding the result of each (see TrialResult) as it
+    finishes, so that any number of trials can be analysed in constant memory by
+    consumers of the stream (see trial_results).
+    """
+
+    def __init__(
+        self,
+        swapper,
+        table_size,
+        seed=None,
+        endgame_solver=None,
+        endgame_threshold=0,
+        stats=None,
+        keep_swaps=False,
+    ):
         """
         :param swapper: Class that is used to select the next swap to be executed.
+        :param table_size:
+        :param seed: seed of the trials (see trial_rng); by default, a fresh one.
+        :param endgame_solver: passed on to run_trial.
+        :param endgame_threshold: passed on to run_trial.
+        :param stats: passed on to run_trial.
+        :param keep_swaps: if True, results include the swaps of the trials that finish.
+        """
+        self.swapper = swapper
+        self.table_size = table_size
+        self.seed = new_run_seed() if seed is None else seed
+        self.endgame_solver = endgame_solver
+        self.endgame_threshold = endgame_threshold
+        self.stats = stats
+        self.keep_swaps = keep_swaps
+
+    def run(self, num_trials, max_swap_num=None, first_trial=1):
+        """ Runs trials, yielding each trial as it finishes.
+
+        :param num_trials: Number of trials to run.
+        :param max_swap_num: If specified, trials are cut off once they cannot make everyone
+        friends in at most this many swaps (see run_trial). It is read from self.max_swap_num
+        before every trial, so that it can be lowered while the trials run.
+        :param first_trial: index of the first trial.
+        :return: generator of TrialResult.
+        """
+        self.max_swap_num = max_swap_num
+        for i in range(first_trial, first_trial + num_trials):
+            s = run_trial(
+                self.swapper,
+                self.table_size,
+                math.inf if self.max_swap_num is None else self.max_swap_num,
+                self.endgame_solver,
+                self.endgame_threshold,
+                self.stats,
+                trial_rng(self.seed, i),
+            )
+            if s.is_everyone_friends():
+                yield TrialResult(
+                    i, len(s.swaps), s.swaps if self.keep_swaps else None
+                )
+            else:
+                yield TrialResult(i, None, None)
+
+
+# State shared by the processes in the pool used by SwapperRunner.run_parallel; set up by
+# _init_worker so that it is inherited rather than pickled with every task.
+_worker_state = {}
+
+
+def _init_worker(
+    swapper, table_size, endgame_threshold, high_score_file, count_stats, seed
+):
+    _worker_state["swapper"] = swapper
+    _worker_state["table_size"] = table_size
+    # each worker caches the endgames it solves separately.
+    _worker_state["endgame_solver"] = (
+        EndgameSolver(table_size) if endgame_threshold is not None else None
+    )
+    _worker_state["endgame_threshold"] = endgame_threshold
+    _worker_state["high_score"] = SharedHighScore(
+        high_score_file, table_size * (table_size - 1) // 2
+    )
+    _worker_state["count_stats"] = count_stats
+    _worker_state["seed"] = seed
+
+
+def _run_trial_chunk(chunk):
+
+    """ Runs a chunk of trials in a worker process.
+
+    :param chunk: tuple (first_trial, num_trials), where first_trial is the index of the
+    first trial in the chunk; each trial is driven by trial_rng(seed of the run, index).
+    :return: tuple (num_trials, results, counters), where results is the TrialResult of
+    each trial, with the swaps of those that tied or beat the shared high score at the time
+    they completed, and counters are those of RunStats (or None if they are not counted).
+    """
+
+    (first_trial, num_trials) = chunk
+    high_score = _worker_state["high_score"]
+    stats = RunStats() if _worker_state["count_stats"] else None
+    stream = TrialStream(
+        _worker_state["swapper"],
+        _worker_state["table_size"],
+        _worker_state["seed"],
+        _worker_state["endgame_solver"],
+        _worker_state["endgame_threshold"],
+        stats,
+        keep_swaps=True,
+    )
+
+    results = []
+    for result in stream.run(num_trials, high_score.value, first_trial):
+        if not result.cut_off and not high_score.lower(result.num_swaps):
+            result = result._replace(swaps=None)
+        results.append(result)
+        stream.max_swap_num = high_score.value
+    return (num_trials, results, stats.counters if stats else None)
+
+
+class SwapperRunner(object):
+    def __init__(
+        self,
+        swapper,
+        table_size,
+        max_stored_sequences=DEFAULT_MAX_STORED_SEQUENCES,
+        endgame_threshold=None,
+        count_stats=False,
+        seed=None,
+    ):
+        """
+        :param swapper: Class that is used to select the next swap to be executed, or a
+        functools.partial of it that configures its parameters.
         :type swapper: AbstractSwapper
         :param table_size:
         :type table_size: int
+        :param max_stored_sequences: maximum number of sequences tying the high score to keep
+        :type max_stored_sequences: int
+        :param endgame_threshold: if specified, each trial is finished with an exact search (see
+        EndgameSolver) once at most this many friend pairs remain
+        :type endgame_threshold: int
+        :param count_stats: if True, count where the time of each run goes (see RunStats), writing the counters
+        to the log and (summed over runs) to the checkpoint
+        :type count_stats: bool
+        :param seed: seed of the trials (see trial_rng), by default a fresh one for each runner; trials
+        without an endgame are stored in the checkpoint by their seed, and regenerated when read
+        :type seed: int
         """
 
         self.swapper = swapper
         self.table_size = table_size
+        self.endgame_threshold = endgame_threshold
+        self.endgame_solver = (
+            EndgameSolver(table_size) if endgame_threshold is not None else None
+        )
 
-        log_file = get_log_file(swapper, table_size)
+        log_file = get_log_file(swapper, table_size, endgame_threshold)
         FORMAT = "%(asctime)s %(levelno)s %(message)s"
         logging.basicConfig(filename=log_file, level=logging.DEBUG, format=FORMAT)
 
         ## Initialize from a checkpoint if it exists
-        self.cp_file = get_checkpoint_file(swapper, table_size)
-        if os.path.isfile(self.cp_file):
-            with open(self.cp_file, "rb") as f:
-                [self.last_checkpoint, self.best_swap_sequences,] = pickle.load(f)[:2]
-            self.current_min_swap_num = len(self.best_swap_sequences[0][1])
+        if seed is not None and not 0 < seed < 2 ** 64:
+            raise ValueError("Seed must be in [1, 2^64), not {}.".format(seed))
+        self.seed = new_run_seed() if seed is None else seed
+        logging.debug("Running trials with seed {}.".format(self.seed))
+        # the swaps of endgames depend on the endgames cached, so they are not reproducible.
+        self.seeded = self.endgame_solver is None
+
+        self.cp_file = get_checkpoint_file(swapper, table_size, endgame_threshold)
+        # written in the background, so that trials never wait on disk I/O.
+        self.checkpoint = Checkpoint(
+            self.cp_file,
+            max_stored_sequences,
+            asynchronous=True,
+            regenerate_trial=functools.partial(regenerate_trial, swapper, table_size),
+        )
+        if self.checkpoint.min_swap_num is not None:
+            self.last_checkpoint = self.checkpoint.trials
+            self.current_min_swap_num = self.checkpoint.min_swap_num
             logging.debug(
                 "Restarted from checkpoint at trial #{} with high score at {}.".format(
                     self.last_checkpoint, self.current_min_swap_num
                 )
             )
         else:
-            self.last_checkpoint = 0
-            self.best_swap_sequences = list()
+            self.last_checkpoint = self.checkpoint.trials
             self.current_min_swap_num = table_size * (table_size - 1) // 2
             logging.debug(
                 "Starting with target score at {}.".format(self.current_min_swap_num)
             )
 
+        # trials are pruned against the best score of any process running trials for the
+        # same checkpoint on this host, which may be lower than our own.
+        self.high_score = SharedHighScore(
+            get_high_score_file(swapper, table_size, endgame_threshold),
+            self.current_min_swap_num,
+        )
+        if self.high_score.value < self.current_min_swap_num:
+            # no sequence in the checkpoint backs it, e.g. if the checkpoint was deleted
+            # after an earlier run; trials would be cut off against it for good.
+            logging.warning(
+                "Resetting the shared high score from {} to {}.".format(
+                    self.high_score.value, self.current_min_swap_num
+                )
+            )
+            self.high_score.reset(self.current_min_swap_num)
+
+        self.stats = RunStats() if count_stats else None
+        self.consumers = []
+        # updated with every checkpoint written, along with the throughput of the run.
+        self.results_index = ResultsIndex()
+        self.run_start = (time.time(), self.last_checkpoint)
+        # counters of previous runs, which those of this run are added to in the checkpoint.
+        self.previous_stats = collections.Counter(
+            self.checkpoint.metadata.get("run_stats")
+        )
+
+    def _timed(self, phase):
+        return self.stats.timed(phase) if self.stats else contextlib.nullcontext()
+
+    def _describe_progress(self, pbar):
+        # only called when the description changes, as formatting it for every trial is
+        # a noticeable fraction of a trial on small tables.
+        with self._timed("progress"):
+            pbar.set_description(
+                "last checkpoint: {}, min swaps: {}".format(
+                    self.last_checkpoint,
+                    self.current_min_swap_num
+                    if self.checkpoint.min_swap_num is not None
+                    else "∞",
+                )
+            )
+
+    def _consume(self, result):
+        for consumer in self.consumers:
+            consumer.update(result)
+
     def write_checkpoint(self, i):
-        with open(self.cp_file, "wb") as f:
-            self.last_checkpoint = i
-            pickle.dump([i, self.best_swap_sequences], f)
+        self.last_checkpoint = i
+        with self._timed("checkpoint"):
+            if self.stats:
+                self.checkpoint.metadata["run_stats"] = dict(
+                    self.previous_stats + self.stats.counters
+                )
+            self.checkpoint.write(i)
+            (start_time, start_trial) = self.run_start
+            elapsed = time.time() - start_time
+            self.results_index.record_checkpoint(
+                self.checkpoint, (i - start_trial) / elapsed if elapsed > 0 else None
+            )
+
+    def log_stats(self):
+        if self.stats:
+            lines = format_run_stats(self.stats.summary())
+            logging.info("Run counters:\n{}".format("\n".join(lines)))
+
+    def record_result(self, trials, i, swaps, seeded=False):
+        """ Records a trial that made everyone friends, returning True if it tied or beat the high score.
 
-    def run(self, num_trials, checkpoint_interval_seconds=60):
+        Ties are appended to the checkpoint's log, while a new high score writes a new snapshot.
+
+        :param trials: number of trials run so far.
+        :param i: index of the trial.
+        :param swaps: list of swaps carried out in the trial.
+        :param seeded: if True, the trial was driven by trial_rng(self.seed, i), and is stored by its seed.
+        """
+        if len(swaps) > self.current_min_swap_num:
+            # possible when trials run in parallel and another worker has since improved on the high score.
+            return False
+        if not self.high_score.lower(len(swaps)):
+            # another process sharing the checkpoint has since improved on the high score.
+            return False
+        if seeded:
+            swaps = SeededTrial(self.seed, len(swaps))
+        if len(swaps) == self.checkpoint.min_swap_num:
+            logging.debug(
+                "Trial #{} tied the high score, at {}.".format(
+                    i, self.current_min_swap_num
+                )
+            )
+            with self._timed("checkpoint"):
+                self.checkpoint.add_tie(i, swaps)
+        else:
+            self.current_min_swap_num = len(swaps)
+            logging.info(
+                "Trial #{} hit a new high score at {}.".format(
+                    i, self.current_min_swap_num
+                )
+            )
+            self.last_checkpoint = trials
+            with self._timed("checkpoint"):
+                self.checkpoint.new_high_score(trials, i, swaps)
+        return True
+
+    def run(
+        self,
+        num_trials,
+        checkpoint_interval_seconds=60,
+        workers=1,
+        batch_size=None,
+        consumers=(),
+    ):
         """ Runs the provided swapper for a specified number of trials, returning the swap sequence that makes everyone
         friends in the minimal number of steps.
 
@@ -89,73 +544,447 @@ class SwapperRunner(object):
         :type num_trials: int
         :param checkpoint_interval_seconds: number of seconds between checkpoints
         :type checkpoint_interval_seconds: float
+        :param workers: number of processes to run trials in
+        :type workers: int
+        :param batch_size: if specified, run GreedySwapper trials on batches of this many tables at once
+        :type batch_size: int
+        :param consumers: objects with an update(result) method, fed the TrialResult of every trial as it
+        completes (see trial_results), with the swaps of the trials that tied or beat the high score
+        :type consumers: list
         """
+        self.consumers = list(consumers)
+        self.run_start = (time.time(), self.last_checkpoint)
+        try:
+            if batch_size is not None:
+                self.run_batched(num_trials, checkpoint_interval_seconds, batch_size)
+            elif workers > 1:
+                self.run_parallel(num_trials, checkpoint_interval_seconds, workers)
+            else:
+                self.run_serial(num_trials, checkpoint_interval_seconds)
+        finally:
+            # the writer is a daemon thread, so writes still queued when the run is
+            # interrupted would otherwise be lost, leaving the shared high score ahead of
+            # the checkpoint.
+            self.checkpoint.flush()
+            # the checkpoint now also counts the trials of any other process sharing it.
+            self.results_index.record_checkpoint(self.checkpoint)
+        self.log_stats()
+
+    def run_serial(self, num_trials, checkpoint_interval_seconds):
+        """ Runs trials one at a time in this process.
+
+        :param num_trials:
+        :type num_trials: int
+        :param checkpoint_interval_seconds: number of seconds between checkpoints
+        :type checkpoint_interval_seconds: float
+        """
+        stream = TrialStream(
+            self.swapper,
+            self.table_size,
+            self.seed,
+            self.endgame_solver,
+            self.endgame_threshold,
+            self.stats,
+            keep_swaps=True,
+        )
         last_checkpoint_time = time.time()
         i = self.last_checkpoint
-        with tqdm.trange(num_trials) as pbar:
-            for _ in pbar:
-                i += 1
-                pbar.set_description(
-                    "trial: {}, last checkpoint: {}, min swaps: {}".format(
-                        i,
-                        self.last_checkpoint,
-                        self.current_min_swap_num
-                        if len(self.best_swap_sequences) > 0
-                        else "∞",
-                    )
-                )
-                s = self.swapper(list(range(self.table_size)))
-                while (
-                    not s.is_everyone_friends()
-                    and len(s.swaps) < self.current_min_swap_num
-                ):
-                    # Trying to terminate earlier here by checking the number of friend pairings outstanding
-                    # and bounding the number of steps to get there by dividing that number by 4 does not seem to
-                    # improve performance significantly as per average cProfile results.
-                    swap = s.generate_swap()
-                    s.do_swap(swap)
-                if s.is_everyone_friends():
+        results = stream.run(num_trials, self.high_score.value, i + 1)
+        with tqdm.tqdm(results, total=num_trials) as pbar:
+            self._describe_progress(pbar)
+            for result in pbar:
+                i = result.trial
+                self._consume(result)
+                if not result.cut_off:
                     # You're guaranteed to have tied or beat the high-score due to the early termination condition above.
-                    if len(s.swaps) == self.current_min_swap_num:
-                        logging.debug(
-                            "Trial #{} tied the high score, at {}.".format(
-                                i, self.current_min_swap_num
-                            )
-                        )
+                    if self.record_result(i, i, result.swaps, self.seeded):
+                        self._describe_progress(pbar)
+                stream.max_swap_num = self.high_score.value
+
+                if time.time() - last_checkpoint_time > checkpoint_interval_seconds:
+                    last_checkpoint_time = time.time()
+                    logging.debug("Trial #{} - checkpoint saved.".format(i))
+                    self.write_checkpoint(i)
+                    self._describe_progress(pbar)
+
+            self.write_checkpoint(i)
+
+    def run_batched(self, num_trials, checkpoint_interval_seconds, batch_size):
+        """ Runs GreedySwapper trials on batches of tables advanced in lockstep (see BatchGreedySwapper).
+
+        Trials in a batch finish out of order, so the checkpoint counts the trials completed rather than the index
+        of the last trial completed, as in run_parallel.
+
+        :param num_trials:
+        :type num_trials: int
+        :param checkpoint_interval_seconds: number of seconds between checkpoints
+        :type checkpoint_interval_seconds: float
+        :param batch_size: number of tables advanced together
+        :type batch_size: int
+        """
+        if self.swapper is not GreedySwapper or self.endgame_solver is not None:
+            raise ValueError(
+                "Only GreedySwapper trials without an endgame can be batched."
+            )
+
+        # trials in a batch share a generator, so they are stored by their swaps.
+        batch_swapper = BatchGreedySwapper(self.table_size, batch_size, self.seed)
+        last_checkpoint_time = time.time()
+        i = self.last_checkpoint
+        with tqdm.tqdm(total=num_trials) as pbar:
+            self._describe_progress(pbar)
+            trials = batch_swapper.run(
+                num_trials, self.high_score.value, self.last_checkpoint + 1
+            )
+            while True:
+                # choosing and carrying out swaps are not separable in a batch, so the
+                # time spent advancing the batch is counted as generate_swap.
+                with self._timed("generate_swap"):
+                    (t, swaps) = next(trials, (None, None))
+                if t is None:
+                    break
+                i += 1
+                with self._timed("progress"):
+                    pbar.update(1)
+                if self.stats:
+                    self.stats.counters["trials"] += 1
+                    if swaps is None:
+                        self.stats.counters["early_breaks"] += 1
                     else:
-                        self.current_min_swap_num = len(s.swaps)
-                        self.best_swap_sequences = []
-                        logging.info(
-                            "Trial #{} hit a new high score at {}.".format(
-                                i, self.current_min_swap_num
-                            )
-                        )
-                    self.best_swap_sequences.append((i, s.swaps))
+                        self.stats.counters["steps"] += len(swaps)
+                self._consume(
+                    TrialResult(t, None if swaps is None else len(swaps), swaps)
+                )
+                # trials still running give up once they can no longer tie the high score.
+                batch_swapper.max_swap_num = self.high_score.value
+                if swaps is not None and self.record_result(i, t, swaps):
+                    self._describe_progress(pbar)
+
+                if time.time() - last_checkpoint_time > checkpoint_interval_seconds:
+                    last_checkpoint_time = time.time()
+                    logging.debug("Trial #{} - checkpoint saved.".format(i))
                     self.write_checkpoint(i)
+                    self._describe_progress(pbar)
+
+        self.write_checkpoint(i)
+
+    def run_parallel(
+        self, num_trials, checkpoint_interval_seconds, workers, chunk_size=100
+    ):
+        """ Runs trials across a pool of worker processes, each trial seeded by its index (see trial_rng).
+
+        Workers share the current high score (see SharedHighScore) so that every trial can terminate early against
+        the best score found by any worker, or by any other process running trials for the same checkpoint. Chunks
+        may finish out of order, but their results are merged into the checkpoint in order, so that the checkpoint
+        always counts a contiguous run of trials: a resumed run then starts after every trial already recorded, and
+        never repeats the index (and so, with the same seed, the trial) of one of them.
+
+        :param num_trials:
+        :type num_trials: int
+        :param checkpoint_interval_seconds: number of seconds between checkpoints
+        :type checkpoint_interval_seconds: float
+        :param workers: number of processes to run trials in
+        :type workers: int
+        :param chunk_size: maximum number of trials handed to a worker at once
+        :type chunk_size: int
+        """
+        chunk_size = max(1, min(chunk_size, num_trials // (4 * workers)))
+        logging.debug("Running {} trials on {} workers.".format(num_trials, workers))
+        chunks = [
+            (self.last_checkpoint + start + 1, min(chunk_size, num_trials - start))
+            for start in range(0, num_trials, chunk_size)
+        ]
+
+        last_checkpoint_time = time.time()
+        i = self.last_checkpoint
+        with multiprocessing.Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(
+                self.swapper,
+                self.table_size,
+                self.endgame_threshold,
+                self.high_score.file.name,
+                self.stats is not None,
+                self.seed,
+            ),
+        ) as pool, tqdm.tqdm(total=num_trials) as pbar:
+            self._describe_progress(pbar)
+            # imap keeps the workers busy, holding back the results of chunks finished ahead of the others.
+            for (num_chunk_trials, results, counters) in pool.imap(
+                _run_trial_chunk, chunks
+            ):
+                i += num_chunk_trials
+                with self._timed("progress"):
+                    pbar.update(num_chunk_trials)
+                if counters:
+                    # the time of each phase is summed over the workers.
+                    self.stats.counters.update(counters)
+                for result in results:
+                    self._consume(result)
+                if any(
+                    [
+                        self.record_result(i, result.trial, result.swaps, self.seeded)
+                        for result in results
+                        if result.swaps is not None
+                    ]
+                ):
+                    self._describe_progress(pbar)
 
                 if time.time() - last_checkpoint_time > checkpoint_interval_seconds:
                     last_checkpoint_time = time.time()
                     logging.debug("Trial #{} - checkpoint saved.".format(i))
                     self.write_checkpoint(i)
+                    self._describe_progress(pbar)
 
-            self.write_checkpoint(i)
+        self.write_checkpoint(i)
+
+
+def add_swapper_arguments(parser, swapper_help):
+
+    """ Adds the options choosing a swapper and configuring its parameters to a parser of
+    command line arguments, to be read with get_configured_swapper.
+
+    :param parser: argparse.ArgumentParser
+    :param swapper_help: help of the option choosing the swapper.
+    """
 
+    parser.add_argument(
+        "--swapper",
+        help=swapper_help,
+        default="GreedySwapper",
+        choices=list(nameToSwapper.keys()),
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        help="""Temperature of WeightedSwapper: swaps are picked with probability
+        proportional to exp(new friends / temperature), so lower temperatures are
+        greedier. If not specified, WeightedSwapper uses a temperature of {:.3g}.
+        """.format(WeightedSwapper.DEFAULT_TEMPERATURE),
+    )
+    parser.add_argument(
+        "--lookahead-depth",
+        type=int,
+        help="""Number of swaps LookaheadGreedySwapper looks ahead when choosing
+        between swaps generating the most new friends. If not specified,
+        LookaheadGreedySwapper looks 1 swap ahead.
+        """,
+    )
+    parser.add_argument(
+        "--subset-budget",
+        type=int,
+        help="""Number of swaps SubsetGreedySwapper samples (without replacement)
+        at each step, picking the best of them; a smaller budget makes each step
+        cheaper on large tables at some cost in quality. If not specified,
+        SubsetGreedySwapper samples {} swaps.
+        """.format(SubsetGreedySwapper.DEFAULT_BUDGET),
+    )
+    parser.add_argument(
+        "--endgame-threshold",
+        type=int,
+        help="""If specified, finish each trial with an exact search for the
+        shortest completion once at most this many friend pairs remain, falling
+        back to the swapper if none is found within the search's node limit.
+        Exact endgames are only cheap when few (about 5) friend pairs remain.
+        """,
+    )
 
-def get_checkpoint_file(swapper, table_size):
-    return os.path.join(get_checkpoint_dir(swapper), str(table_size) + ".pickle")
 
+def get_configured_swapper(parser, args):
 
-def get_checkpoint_dir(swapper):
-    cp_dir = os.path.join(CHECKPOINT_DIR, swapper.__name__)
+    """ Reads the options added by add_swapper_arguments, exiting with an error if they
+    configure a parameter of a swapper other than the one chosen.
+
+    :param parser: argparse.ArgumentParser the options were added to.
+    :param args: arguments parsed by parser.
+    :return: the class of the swapper chosen, or a functools.partial of it configuring its
+    parameters (so that checkpoints and logs for each configuration are kept separately).
+    """
+
+    # choices are checked after conversion, so the name is converted here.
+    swapper = nameToSwapper[args.swapper]
+    swapper_kwargs = {}
+    for (option, option_swapper, kwarg) in [
+        ("temperature", WeightedSwapper, "temperature"),
+        ("lookahead_depth", LookaheadGreedySwapper, "depth"),
+        ("subset_budget", SubsetGreedySwapper, "budget"),
+    ]:
+        if getattr(args, option) is not None:
+            if swapper is not option_swapper:
+                parser.error(
+                    "--{} can only be used with {}.".format(
+                        option.replace("_", "-"), option_swapper.__name__
+                    )
+                )
+            swapper_kwargs[kwarg] = getattr(args, option)
+    if swapper_kwargs:
+        swapper = functools.partial(swapper, **swapper_kwargs)
+    return swapper
+
+
+def get_swapper_name(swapper, endgame_threshold=None):
+    """
+    :param swapper: Class that is used to select the next swap to be executed, or a
+    functools.partial of it that configures its parameters.
+    :param endgame_threshold: endgame threshold of the trials, if any (see run_trial).
+    :return: name identifying the swapper and any parameters configured, e.g.
+    "WeightedSwapper" or "WeightedSwapper-temperature=0.5".
+    """
+    if isinstance(swapper, functools.partial):
+        name = "-".join(
+            [swapper.func.__name__]
+            + ["{}={}".format(k, v) for (k, v) in sorted(swapper.keywords.items())]
+        )
+    else:
+        name = swapper.__name__
+    if endgame_threshold is not None:
+        name += "-endgame_threshold={}".format(endgame_threshold)
+    return name
+
+
+def get_checkpoint_file(swapper, table_size, endgame_threshold=None):
+    return os.path.join(
+        get_checkpoint_dir(swapper, endgame_threshold),
+        str(table_size) + CHECKPOINT_EXTENSION,
+    )
+
+
+def get_high_score_file(swapper, table_size, endgame_threshold=None):
+    return os.path.join(
+        get_checkpoint_dir(swapper, endgame_threshold),
+        str(table_size) + HIGH_SCORE_EXTENSION,
+    )
+
+
+def get_checkpoint_dir(swapper, endgame_threshold=None):
+    cp_dir = os.path.join(CHECKPOINT_DIR, get_swapper_name(swapper, endgame_threshold))
     os.makedirs(cp_dir, exist_ok=True)
     return cp_dir
 
 
-def get_log_file(swapper, table_size):
-    return os.path.join(get_log_directory(swapper), str(table_size) + ".log")
+def get_log_file(swapper, table_size, endgame_threshold=None):
+    return os.path.join(
+        get_log_directory(swapper, endgame_threshold), str(table_size) + ".log"
+    )
 
 
-def get_log_directory(swapper):
-    log_dir = os.path.join(LOGS_DIR, swapper.__name__)
+def get_log_directory(swapper, endgame_threshold=None):
+    log_dir = os.path.join(LOGS_DIR, get_swapper_name(swapper, endgame_threshold))
     os.makedirs(log_dir, exist_ok=True)
     return log_dir
+
+
+class TestSwapperRunner(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # runners keep their checkpoints, logs and results index in the directory.
+        self.patch = mock.patch.dict(
+            globals(),
+            {
+                "CHECKPOINT_DIR": os.path.join(self.dir.name, "checkpoint"),
+                "LOGS_DIR": os.path.join(self.dir.name, "logs"),
+                "ResultsIndex": functools.partial(
+                    ResultsIndex, os.path.join(self.dir.name, "results.sqlite")
+                ),
+            },
+        )
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dir.cleanup()
+
+    def test_unbacked_high_score_is_reset(self):
+        runner = SwapperRunner(GreedySwapper, 8)
+        runner.run(20)
+        best = runner.checkpoint.min_swap_num
+        # as if left behind by a run whose checkpoint was lost.
+        runner.high_score.lower(best - 1)
+        self.assertEqual(SwapperRunner(GreedySwapper, 8).high_score.value, best)
+        os.remove(runner.cp_file)
+        self.assertEqual(SwapperRunner(GreedySwapper, 8).high_score.value, 28)
+
+    def test_parallel_run_is_resumed_after_its_last_trial(self):
+        for _ in range(2):
+            # the same seed draws the same trials for the same indices.
+            SwapperRunner(GreedySwapper, 8, seed=1).run(300, workers=2)
+        checkpoint = Checkpoint(
+            get_checkpoint_file(GreedySwapper, 8),
+            regenerate_trial=functools.partial(regenerate_trial, GreedySwapper, 8),
+        )
+        self.assertEqual(checkpoint.trials, 600)
+        sequences = list(checkpoint.swap_sequences())
+        self.assertEqual(len(sequences), checkpoint.num_ties)
+        self.assertEqual(len({i for (i, _) in sequences}), len(sequences))
+        self.assertTrue(all(i <= 600 for (i, _) in sequences))
+        for (_, swaps) in sequences:
+            self.assertEqual(len(swaps), checkpoint.min_swap_num)
+            self.assertTrue(is_covering_sequence(8, swaps))
+
+    def test_run_stats_are_summed_over_runs(self):
+        for num_trials in (20, 30):
+            SwapperRunner(GreedySwapper, 8, count_stats=True).run(num_trials)
+        checkpoint = Checkpoint(get_checkpoint_file(GreedySwapper, 8))
+        summary = RunStats(checkpoint.metadata["run_stats"]).summary()
+        self.assertEqual(summary["trials"], 50)
+        self.assertEqual(
+            summary["early_break_rate"], summary["early_breaks"] / summary["trials"]
+        )
+        self.assertEqual(
+            summary["candidates_per_step"],
+            summary["candidates_evaluated"] / summary["steps"],
+        )
+        self.assertGreater(summary["steps"], 0)
+
+    def test_consumers_receive_every_trial(self):
+        for kwargs in [{}, {"batch_size": 16}, {"workers": 2}]:
+            runner = SwapperRunner(GreedySwapper, 8)
+            start = runner.checkpoint.trials
+            consumer = mock.Mock()
+            runner.run(200, consumers=[consumer], **kwargs)
+            results = [args[0] for (args, _) in consumer.update.call_args_list]
+            self.assertEqual(
+                sorted(r.trial for r in results), list(range(start + 1, start + 201))
+            )
+            # trials cut off early are passed on, as well as those finished.
+            self.assertTrue(any(r.cut_off for r in results))
+            self.assertTrue(any(not r.cut_off for r in results))
+
+
+class TestRunStats(unittest.TestCase):
+    def test_summary(self):
+        stats = RunStats({"trials": 2, "steps": 30, "early_breaks": 1})
+        for (num_swaps, num_evaluated, finished) in [(12, 60, True), (8, 30, False)]:
+            stats.record_trial(
+                mock.Mock(
+                    swaps=[(0, 1)] * num_swaps,
+                    gain_table=mock.Mock(num_evaluated=num_evaluated),
+                    is_everyone_friends=mock.Mock(return_value=finished),
+                )
+            )
+        with mock.patch.object(time, "perf_counter", side_effect=[1.0, 3.5]):
+            with stats.timed("do_swap"):
+                pass
+        # counters of a run are added to those of previous runs.
+        stats.counters += collections.Counter({"trials": 6, "steps": 30})
+        summary = stats.summary()
+        self.assertEqual(
+            (summary["trials"], summary["steps"], summary["early_breaks"]), (10, 80, 2)
+        )
+        self.assertEqual(summary["candidates_per_step"], 90 / 80)
+        self.assertEqual(summary["early_break_rate"], 0.2)
+        self.assertEqual(
+            format_run_stats(summary),
+            [
+                "       do_swap_seconds: 2.500s",
+                "                trials: 10",
+                "                 steps: 80",
+                "  candidates_evaluated: 90",
+                "   candidates_per_step: 1.125",
+                "          early_breaks: 2",
+                "      early_break_rate: 0.2",
+            ],
+        )
+        # ratios are left out when there is nothing to divide by.
+        self.assertEqual(RunStats().summary(), {})
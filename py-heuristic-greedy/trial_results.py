@@ -0,0 +1,252 @@
+import collections
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+
+class TrialResult(
+    collections.namedtuple("TrialResult", ["trial", "num_swaps", "swaps"])
+):
+    """
+    Result of a single trial: its index, the number of swaps it took to make everyone
+    friends (None if it was cut off early, as it could no longer tie the high score), and
+    its swaps (None if they were not kept).
+    """
+
+    __slots__ = ()
+
+    @property
+    def cut_off(self):
+        return self.num_swaps is None
+
+
+def consume(results, consumers):
+
+    """ Feeds a stream of trial results to consumers, one result at a time, so that the
+    stream is never held in memory.
+
+    :param results: iterable of TrialResult.
+    :param consumers: list of objects with an update(result) method.
+    :return: the consumers.
+    """
+
+    for result in results:
+        for consumer in consumers:
+            consumer.update(result)
+    return consumers
+
+
+class Histogram(object):
+    """
+    Online histogram of the number of swaps of the trials that made everyone friends,
+    along with the number of trials cut off early. As the number of swaps of a trial is a
+    small integer, the histogram takes constant memory however many trials it counts, and
+    gives exact quantiles.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.num_cut_off = 0
+
+    def update(self, result):
+        if result.cut_off:
+            self.num_cut_off += 1
+        else:
+            self.counts[result.num_swaps] += 1
+
+    @property
+    def num_finished(self):
+        return sum(self.counts.values())
+
+    def mean(self):
+        """
+        :return: mean number of swaps of the trials that finished, or None if none did.
+        """
+        if not self.counts:
+            return None
+        return sum(k * v for (k, v) in self.counts.items()) / self.num_finished
+
+    def quantile(self, q):
+        """
+        :param q: fraction between 0 and 1.
+        :return: smallest number of swaps achieved by at least a fraction q of the trials
+        that finished, or None if none did.
+        """
+        num_finished = self.num_finished
+        cumulative = 0
+        for num_swaps in sorted(self.counts):
+            cumulative += self.counts[num_swaps]
+            if cumulative >= q * num_finished:
+                return num_swaps
+        return None
+
+    def describe(self):
+        """
+        :return: lines describing the histogram, e.g. for printing after a run.
+        """
+        lines = [
+            "Trials finished: {}, cut off early: {}.".format(
+                self.num_finished, self.num_cut_off
+            )
+        ]
+        if self.counts:
+            lines.append(
+                "Swaps: mean {:.2f}, min {}, median {}, 90th percentile {}, "
+                "max {}.".format(
+                    self.mean(),
+                    min(self.counts),
+                    self.quantile(0.5),
+                    self.quantile(0.9),
+                    max(self.counts),
+                )
+            )
+            lines.extend(
+                "{:>6}: {}".format(k, self.counts[k]) for k in sorted(self.counts)
+            )
+        return lines
+
+
+class BestSoFar(object):
+    """
+    Keeps the fewest swaps of any trial seen so far, the first trial achieving it, its
+    swaps (if kept) and the number of trials tying it.
+    """
+
+    def __init__(self):
+        self.num_swaps = None
+        self.trial = None
+        self.swaps = None
+        self.num_ties = 0
+
+    def update(self, result):
+        if result.cut_off:
+            return
+        if self.num_swaps is None or result.num_swaps < self.num_swaps:
+            (self.num_swaps, self.trial, self.swaps) = (
+                result.num_swaps,
+                result.trial,
+                result.swaps,
+            )
+            self.num_ties = 1
+        elif result.num_swaps == self.num_swaps:
+            self.num_ties += 1
+
+
+class JsonlWriter(object):
+    """
+    Writes each trial result as a line of JSON, with its swaps if they were kept and
+    include_swaps is True.
+    """
+
+    def __init__(self, path, include_swaps=False):
+        self.file = open(path, "a")
+        self.include_swaps = include_swaps
+
+    def update(self, result):
+        record = {
+            "trial": result.trial,
+            "num_swaps": result.num_swaps,
+            "cut_off": result.cut_off,
+        }
+        if self.include_swaps and result.swaps is not None:
+            record["swaps"] = result.swaps
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+# dtype of each column written by ColumnarWriter; num_swaps is -1 for trials cut off.
+COLUMNS = {"trial": np.dtype("<u8"), "num_swaps": np.dtype("<i2")}
+
+
+class ColumnarWriter(object):
+    """
+    Writes trial results column by column, as a raw little-endian array per column (see
+    COLUMNS) in a directory, buffering chunk_size results at a time so that writing
+    takes constant memory. Columns are read back with read_columns, as memory maps.
+    """
+
+    def __init__(self, directory, chunk_size=65536):
+        os.makedirs(directory, exist_ok=True)
+        self.files = {
+            name: open(os.path.join(directory, name + ".bin"), "ab") for name in COLUMNS
+        }
+        self.buffers = {
+            name: np.zeros(chunk_size, dtype) for (name, dtype) in COLUMNS.items()
+        }
+        self.size = 0
+
+    def update(self, result):
+        self.buffers["trial"][self.size] = result.trial
+        self.buffers["num_swaps"][self.size] = (
+            -1 if result.cut_off else result.num_swaps
+        )
+        self.size += 1
+        if self.size == len(self.buffers["trial"]):
+            self.flush()
+
+    def flush(self):
+        for (name, f) in self.files.items():
+            f.write(self.buffers[name][: self.size].tobytes())
+            f.flush()
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+
+def read_columns(directory):
+    """
+    :param directory: directory written by ColumnarWriter.
+    :return: dict mapping each column name to a read-only numpy memory map of it.
+    """
+    columns = {}
+    for (name, dtype) in COLUMNS.items():
+        path = os.path.join(directory, name + ".bin")
+        if os.path.getsize(path) == 0:
+            columns[name] = np.zeros(0, dtype)
+        else:
+            columns[name] = np.memmap(path, dtype=dtype, mode="r")
+    return columns
+
+
+class TestTrialResults(unittest.TestCase):
+    def setUp(self):
+        self.results = [
+            TrialResult(1, 12, [(0, 1)] * 12),
+            TrialResult(2, None, None),
+            TrialResult(3, 10, [(0, 2)] * 10),
+            TrialResult(4, 11, None),
+            TrialResult(5, 10, [(0, 3)] * 10),
+        ]
+
+    def test_online_statistics(self):
+        (histogram, best) = consume(iter(self.results), [Histogram(), BestSoFar()])
+        self.assertEqual((histogram.num_finished, histogram.num_cut_off), (4, 1))
+        self.assertEqual(histogram.mean(), 10.75)
+        self.assertEqual([histogram.quantile(q) for q in (0, 0.5, 0.9)], [10, 10, 12])
+        self.assertEqual((best.num_swaps, best.trial, best.num_ties), (10, 3, 2))
+        self.assertEqual(best.swaps, [(0, 2)] * 10)
+
+    def test_writers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jsonl_writer = JsonlWriter(os.path.join(directory, "results.jsonl"))
+            columnar_writer = ColumnarWriter(os.path.join(directory, "columns"), 2)
+            consume(self.results, [jsonl_writer, columnar_writer])
+            jsonl_writer.close()
+            columnar_writer.close()
+
+            with open(os.path.join(directory, "results.jsonl")) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(
+                records[1], {"trial": 2, "num_swaps": None, "cut_off": True}
+            )
+            columns = read_columns(os.path.join(directory, "columns"))
+            self.assertEqual(columns["trial"].tolist(), [1, 2, 3, 4, 5])
+            self.assertEqual(columns["num_swaps"].tolist(), [12, -1, 10, 11, 10])
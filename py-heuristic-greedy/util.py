@@ -1,6 +1,8 @@
 import itertools
 import unittest
 
+import numpy as np
+
 
 def all_friend_pairs(seating_arrangement):
 
@@ -48,6 +50,46 @@ def get_pair(current_seating_arrangement, i, j):
         return (p_j, p_i)
 
 
+def pair_to_index(first, second):
+
+    """ Converts an unordered pair of distinct non-negative indexes to a single
+    non-negative index, as in pair_to_index in cpp-exhaustive/main.cpp:
+
+    (0, 1) -> 0
+    (0, 2) -> 1
+    (1, 2) -> 2
+    (0, 3) -> 3
+    ...
+
+    Works elementwise on numpy arrays as well as on ints.
+
+    :param first: index of one element of the pair
+    :param second: index of other element of the pair
+    :return: index of the pair
+    """
+
+    lo = np.minimum(first, second)
+    hi = np.maximum(first, second)
+    return hi * (hi - 1) // 2 + lo
+
+
+def index_to_pair(index):
+
+    """ Inverse of pair_to_index, working elementwise on numpy arrays as well as on ints.
+
+    :param index: index of a pair
+    :return: sorted pair (first, second) such that pair_to_index(first, second) == index
+    """
+
+    index = np.asarray(index, dtype=np.int64)
+    second = ((1 + np.sqrt(1 + 8 * index)) // 2).astype(np.int64)
+    # correct for any floating point error in the square root.
+    second -= second * (second - 1) // 2 > index
+    second += (second + 1) * second // 2 <= index
+    first = index - second * (second - 1) // 2
+    return (first, second)
+
+
 def new_friend_pairs_v1(current_seating_arrangement, existing_friend_pairs, swap):
 
     """ Given a list of existing friends, determines the new friendships that would
@@ -132,6 +174,74 @@ def num_new_friend_pairs(current_seating_arrangement, existing_friend_pairs, swa
     )
 
 
+def new_friend_pair_counts(seating_arrangement, adjacency, first, second):
+
+    """ Vectorized version of num_new_friend_pairs, determining the number of new friend
+    pairs generated by each of a batch of swaps in a single pass.
+
+    :param seating_arrangement: numpy array of ints representing the seating arrangement
+    around a circular table.
+    :param adjacency: n x n numpy array, nonzero at [p_a, p_b] if p_a and p_b are
+    already friends (e.g. FriendMatrix.matrix).
+    :param first: numpy array of ints representing the position of the first person in
+    each swap.
+    :param second: numpy array of ints representing the position of the second person in
+    each swap.
+    :return: numpy array of the number of new friend pairs generated by each swap.
+    """
+
+    n = len(seating_arrangement)
+    p_i = seating_arrangement[first]
+    p_j = seating_arrangement[second]
+
+    # as in new_friend_pairs, each person moving is paired with the new neighbours they
+    # would have; pairs of a person with themselves (neighbour swaps) are not counted.
+    counts = np.zeros(len(first), dtype=np.int8)
+    for (p, q) in (
+        (p_i, seating_arrangement[(second - 1) % n]),
+        (p_i, seating_arrangement[(second + 1) % n]),
+        (p_j, seating_arrangement[(first - 1) % n]),
+        (p_j, seating_arrangement[(first + 1) % n]),
+    ):
+        counts += (p != q) & (adjacency[p, q] == 0)
+
+    return counts
+
+
+def batch_new_friend_pair_counts(seating_arrangements, adjacencies, first, second):
+
+    """ Version of new_friend_pair_counts for a batch of tables, determining the number
+    of new friend pairs generated by each of a batch of swaps at each table.
+
+    :param seating_arrangements: B x n numpy array of ints, each row representing the
+    seating arrangement around a circular table.
+    :param adjacencies: B x n x n numpy array, nonzero at [b, p_a, p_b] if p_a and p_b
+    are already friends at table b.
+    :param first: numpy array of ints representing the position of the first person in
+    each swap.
+    :param second: numpy array of ints representing the position of the second person in
+    each swap.
+    :return: B x (number of swaps) numpy array of the number of new friend pairs
+    generated by each swap at each table.
+    """
+
+    (num_tables, n) = seating_arrangements.shape
+    tables = np.arange(num_tables)[:, np.newaxis]
+    p_i = seating_arrangements[:, first]
+    p_j = seating_arrangements[:, second]
+
+    counts = np.zeros((num_tables, len(first)), dtype=np.int8)
+    for (p, q) in (
+        (p_i, seating_arrangements[:, (second - 1) % n]),
+        (p_i, seating_arrangements[:, (second + 1) % n]),
+        (p_j, seating_arrangements[:, (first - 1) % n]),
+        (p_j, seating_arrangements[:, (first + 1) % n]),
+    ):
+        counts += (p != q) & (adjacencies[tables, p, q] == 0)
+
+    return counts
+
+
 class TestNumNewFriendPairs(unittest.TestCase):
 
     # Tests num_new_friend_pairs
@@ -148,3 +258,56 @@ class TestNumNewFriendPairs(unittest.TestCase):
 
     def test_far_swap(self):
         self.assertEqual(num_new_friend_pairs(self.sa, self.fp, (0, 5)), 4)
+
+
+class TestPairToIndex(unittest.TestCase):
+
+    # Tests pair_to_index and index_to_pair
+
+    def test_running_order(self):
+        pairs = sorted(itertools.combinations(range(30), 2), key=lambda x: (x[1], x[0]))
+        self.assertEqual([pair_to_index(*p) for p in pairs], list(range(len(pairs))))
+        self.assertEqual(pair_to_index(3, 1), pair_to_index(1, 3))
+
+    def test_inverse(self):
+        indices = np.arange(300 * 299 // 2)
+        (first, second) = index_to_pair(indices)
+        self.assertTrue((first < second).all())
+        self.assertTrue((pair_to_index(first, second) == indices).all())
+
+
+class TestNewFriendPairCounts(unittest.TestCase):
+
+    # Tests that new_friend_pair_counts agrees with num_new_friend_pairs
+
+    def setUp(self):
+        self.sa = [3, 0, 7, 1, 9, 4, 2, 8, 6, 5]
+        self.fp = all_friend_pairs(self.sa) | all_friend_pairs(range(10))
+        self.adjacency = np.zeros((10, 10), dtype=np.uint8)
+        for (p_a, p_b) in self.fp:
+            self.adjacency[p_a, p_b] = self.adjacency[p_b, p_a] = 1
+
+    def test_all_swaps(self):
+        swaps = list(itertools.combinations(range(10), 2))
+        (first, second) = np.array(swaps).T
+        counts = new_friend_pair_counts(
+            np.array(self.sa), self.adjacency, first, second
+        )
+        for (swap, count) in zip(swaps, counts):
+            self.assertEqual(count, num_new_friend_pairs(self.sa, self.fp, swap))
+
+    def test_batch(self):
+        swaps = list(itertools.combinations(range(10), 2))
+        (first, second) = np.array(swaps).T
+        seating_arrangements = np.array([self.sa, list(range(10))])
+        adjacencies = np.stack([self.adjacency, np.zeros((10, 10), dtype=np.uint8)])
+        counts = batch_new_friend_pair_counts(
+            seating_arrangements, adjacencies, first, second
+        )
+        for (b, adjacency) in enumerate(adjacencies):
+            self.assertEqual(
+                counts[b].tolist(),
+                new_friend_pair_counts(
+                    seating_arrangements[b], adjacency, first, second
+                ).tolist(),
+            )